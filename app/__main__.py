@@ -1,4 +1,26 @@
+import sys
+
 from .app import app
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    if sys.argv[1:] == ['refresh']:
+        from .refresh import run
+        run()
+    elif sys.argv[1:] == ['push']:
+        from .push import send_daily_overview
+        stats = send_daily_overview()
+        print(f'Sent {stats.sent} notifications, {stats.failed} failed, {stats.removed} subscriptions removed, '
+              f'{stats.throughput:.1f}/s')
+    elif sys.argv[1:] == ['slack-digest']:
+        from .slack import send_daily_digest
+        stats = send_daily_digest()
+        print(f'Posted to {stats.sent} workspaces, {stats.failed} failed, {stats.removed} installations removed')
+    elif sys.argv[1:2] == ['backfill']:
+        from . import archive, distribution, history
+        from .data import PRICE_AREAS
+        archive.backfill(*sys.argv[2:3])
+        for area in PRICE_AREAS:
+            distribution.update(area)
+            history.update(area)
+    else:
+        app.run(debug=True)
@@ -0,0 +1,61 @@
+"""Request handling shared by the WSGI app (see app.app) and the ASGI app (see app.asgi).
+
+Both apps expose the same API, so everything about a request which does not depend on the web framework serving it,
+i.e. validating parameters, lives here. Slack commands are handled in app.slack.
+"""
+from .charts import CHART_RANGES, DEFAULT_CHART_RANGE
+
+# History can be asked about this many days back, hourly history for this many days at a time (see app.history).
+MAX_HISTORY_DAYS = 3 * 365
+MAX_HOURLY_HISTORY_DAYS = 31
+DEFAULT_HISTORY_DAYS = 30
+DEFAULT_HISTORY_PERIOD = 3
+
+
+def price_area(args, areas, default):
+    """Gets the price area given by the area parameter among the given request arguments, along with an error
+    response in case it is not one of the given areas."""
+    area = args.get('area', default).upper()
+    if area not in areas:
+        return area, {'success': False, 'error': f'Price area must be one of {", ".join(areas)}.'}
+    return area, None
+
+
+def greenest_period_parameters(period, horizon):
+    """Parses the period and horizon of a request for the greenest period, along with an error response in case they
+    are invalid."""
+    try:
+        period = int(period)
+        horizon = int(horizon)
+    except ValueError:
+        return period, horizon, {'success': False, 'error': 'Given period or horizon was non-integral.'}
+    if period < 1 or period > 6:
+        return period, horizon, {'success': False, 'error': 'Period must be between 1 and 6.'}
+    if horizon < 6 or horizon > 72:
+        return period, horizon, {'success': False, 'error': 'Horizon must be between 1 and 72.'}
+    return period, horizon, None
+
+
+def history_parameters(args, max_days=MAX_HISTORY_DAYS, period=True):
+    """Parses the number of days, and, if period is true, the period in hours, of a request about the history among the
+    given request arguments, along with an error response in case they are invalid."""
+    try:
+        parameters = {'days': int(args.get('days', DEFAULT_HISTORY_DAYS))}
+        if period:
+            parameters['period'] = int(args.get('period', DEFAULT_HISTORY_PERIOD))
+    except ValueError:
+        return None, {'success': False, 'error': 'Given days or period was non-integral.'}
+    if parameters['days'] < 1 or parameters['days'] > max_days:
+        return None, {'success': False, 'error': f'Days must be between 1 and {max_days}.'}
+    if period and (parameters['period'] < 1 or parameters['period'] > 6):
+        return None, {'success': False, 'error': 'Period must be between 1 and 6.'}
+    return parameters, None
+
+
+def chart_range(args):
+    """Gets the range of a request for a chart among the given request arguments, along with an error response in case
+    it is not one we chart."""
+    name = args.get('range', DEFAULT_CHART_RANGE).lower()
+    if name not in CHART_RANGES:
+        return name, {'success': False, 'error': f'Range must be one of {", ".join(CHART_RANGES)}.'}
+    return name, None
@@ -1,58 +1,183 @@
-import os
+import time
 
-import requests
-from flask import Flask, request
+from flask import Flask, Response, g, request
 
-from . import push
-from .cache import get_current_generation_mix, get_forecast, get_model
-from .model import best_period, overview_next_day
+from . import metrics, push, scheduling, slack, stream
+from .api import MAX_HOURLY_HISTORY_DAYS, chart_range, greenest_period_parameters, history_parameters, price_area
+from .cache import (get_chart_response, get_current_generation_mix_response,
+                    get_current_generation_mix_with_plot_response, get_forecast_windows, get_greenest_period_response,
+                    get_history_response, get_model_response, get_model_with_plot_response, get_next_day_response,
+                    get_slack_response)
+from .areas import COMBINED_PRICE_AREA, DEFAULT_PRICE_AREA, GENERATION_MIX_AREAS, PRICE_AREAS
+from .responses import serve
 
 app = Flask(__name__,
             static_url_path='',
             static_folder='static')
 
 
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def record_duration(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.REQUEST_DURATION.observe(time.perf_counter() - g.start, route=route)
+    return response
+
+
 @app.route('/')
 def root():
     return app.send_static_file('index.html')
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    # Meant for Prometheus; the proxy in front of the app need not expose it to the world.
+    return Response(metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _price_area(areas, default):
+    return price_area(request.args, areas, default)
+
+
 @app.route('/api/v1/current-emission-intensity')
 def current_emission_intensity():
-    model = get_model()
-    return model
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    response = get_model_with_plot_response(area)
+    return serve(response.value, response.fresh_until)
+
+
+@app.route('/api/v2/current-emission-intensity')
+def current_emission_intensity_v2():
+    # Rather than a full plot specification, the response contains just the data needed to fill in the chart template
+    # in static/charts/emission-intensity.json.
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    response = get_model_response(area)
+    return serve(response.value, response.fresh_until)
+
+
+@app.route('/api/v2/emission-intensity-chart')
+def emission_intensity_chart():
+    # The emission intensities of a week, month, or year, downsampled to a fixed number of points; see app.charts.
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    name, error = chart_range(request.args)
+    if error:
+        return error
+    response = get_chart_response(name, area)
+    return serve(response.value, response.fresh_until)
 
 
 @app.route('/api/v1/current-generation-mix')
 def current_generation_mix():
-    return get_current_generation_mix()
+    area, error = _price_area(GENERATION_MIX_AREAS, COMBINED_PRICE_AREA)
+    if error:
+        return error
+    response = get_current_generation_mix_with_plot_response(area)
+    return serve(response.value, response.fresh_until)
+
+
+@app.route('/api/v2/current-generation-mix')
+def current_generation_mix_v2():
+    area, error = _price_area(GENERATION_MIX_AREAS, COMBINED_PRICE_AREA)
+    if error:
+        return error
+    response = get_current_generation_mix_response(area)
+    return serve(response.value, response.fresh_until)
 
 
 @app.route('/api/v1/greenest-period/<period>/<horizon>', methods=['GET'])
 def greenest_period(period, horizon):
-    try:
-        period = int(period)
-        horizon = int(horizon)
-    except ValueError:
-        return {'success': False, 'error': 'Given period or horizon was non-integral.'}
-    if period < 0 or period > 6:
-        return {'success': False, 'error': 'Period must be between 1 and 6.'}
-    if horizon < 6 or horizon > 72:
-        return {'success': False, 'error': 'Horizon must be between 1 and 72.'}
-    forecast = get_forecast()
-    return best_period(forecast, period, horizon)
+    period, horizon, error = greenest_period_parameters(period, horizon)
+    if error:
+        return error
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    response = get_greenest_period_response(period, horizon, area)
+    return serve(response.value, response.fresh_until)
 
 
 @app.route('/api/v1/next-day')
 def next_day():
-    forecast = get_forecast()
-    return overview_next_day(forecast)
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    response = get_next_day_response(area=area)
+    return serve(response.value, response.fresh_until)
 
 
 @app.route('/api/v1/next-day-short')
 def next_day_short():
-    forecast = get_forecast()
-    return overview_next_day(forecast, True)
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    response = get_next_day_response(True, area)
+    return serve(response.value, response.fresh_until)
+
+
+def _history(query, **kwargs):
+    # Answers about the history are read from rollups of the archive; see app.history.
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    parameters, error = history_parameters(request.args, **kwargs)
+    if error:
+        return error
+    response = get_history_response(query, area, parameters)
+    return serve(response.value, response.fresh_until)
+
+
+@app.route('/api/v1/history/daily')
+def daily_history():
+    return _history('daily')
+
+
+@app.route('/api/v1/history/hourly')
+def hourly_history():
+    return _history('hourly', max_days=MAX_HOURLY_HISTORY_DAYS, period=False)
+
+
+@app.route('/api/v1/history/greenest-window')
+def greenest_window_history():
+    return _history('greenest_windows')
+
+
+@app.route('/api/v1/history/profile')
+def profile_history():
+    return _history('profile', period=False)
+
+
+@app.route('/api/v1/schedule', methods=['POST'])
+def schedule():
+    # Finds the greenest start for each of a batch of jobs; see app.scheduling.
+    area, error = _price_area(PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return error
+    try:
+        jobs = scheduling.parse_jobs(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+    return scheduling.schedule(get_forecast_windows(area), jobs)
+
+
+@app.route('/api/v1/stream')
+def version_stream():
+    # Tells clients about new versions of the data as soon as they are cached; see app.stream. On threads, every client
+    # would tie up a thread for as long as it stays on the page, so there we answer No Content, on which EventSource
+    # gives up rather than reconnecting, and the page polls instead.
+    if not stream.can_hold_connections():
+        return Response(status=204)
+    return Response(stream.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/api/v1/save-subscription', methods=['POST'])
@@ -76,26 +201,16 @@ def remove_subscription():
 
 
 @app.route('/api/v1/slack', methods=['POST'])
-def slack():
-    forecast = get_forecast()
-    overview = overview_next_day(forecast)
-    return {
-        "response_type": "in_channel",
-        "blocks": [
-            {"type": "section", "text": {"type": "mrkdwn", "text": overview["title"]}},
-            {"type": "section", "text": {"type": "mrkdwn", "text": overview["message"]}}
-        ]
-    }
+def slack_command():
+    # Slack gives up after 3 seconds, so if the answer has yet to be built, it is posted to Slack once it is ready.
+    area = slack.command_area(request.form.get('text'))
+    response = get_slack_response(area, wait=False)
+    if response is None:
+        slack.respond_later(area, request.form.get('response_url'))
+        return slack.ACKNOWLEDGEMENT
+    return serve(response.value, response.fresh_until)
 
 
 @app.route('/api/v1/slack-authorize', methods=['GET'])
 def slack_authorize():
-    code = request.args.get('code')
-    client_id = os.environ['SLACK_CLIENT_ID']
-    client_secret = os.environ['SLACK_CLIENT_SECRET']
-    resp = requests.post(
-        'https://slack.com/api/oauth.v2.access',
-        {'code': code, 'client_id': client_id, 'client_secret': client_secret}
-    ).json()
-    return "App added! Try using /erstroemmengroen in one of your channels"\
-        if resp["ok"] else f"Could not add app: {resp['error']}"
+    return slack.authorize(request.args.get('code'))
@@ -0,0 +1,115 @@
+"""Keeps a local archive of emission intensities, measured as well as forecasted.
+
+Energinet only lets us download data in bulk slowly, so rather than downloading years of history whenever we want to
+compute statistics, we keep every value we have ever seen on disk. Each series, i.e. the measured or forecasted
+intensities of a price area, is kept in a file of its own, as a flat
+array of 32-bit floats on a fixed five minute grid starting at ARCHIVE_START, so the value for a given time is found at
+a position computed from the time alone. Missing values are NaN. A year of data takes up about 400 kB, and reading any
+range of it is a slice of a memory-mapped file, which takes no time at all.
+
+The archive is extended whenever the model is rebuilt (see app.cache), and older data can be filled in with
+`python -m app backfill`. Only the process holding the emission intensity lock writes to the archive, so there is only
+ever a single writer.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from .data import (FORECAST_RESOURCE, HISTORY_RESOURCE, PRICE_AREAS, EmissionData, download_emission_intensities,
+                   executor)
+
+ARCHIVE_DIRECTORY = '/data/archive'
+
+# Energinet's emission intensity data starts in 2017.
+ARCHIVE_START = np.datetime64('2017-01-01T00:00', 'm')
+STEP = np.timedelta64(5, 'm')
+DTYPE = np.dtype('<f4')
+
+# The kinds of archived series, named after the Energinet data sets they come from.
+MEASURED = HISTORY_RESOURCE
+FORECAST = FORECAST_RESOURCE
+
+
+def series(kind, area):
+    """Gets the name of the series of the given kind for the given price area."""
+    return f'{kind}-{area.lower()}'
+
+
+def read(name, start=None, end=None):
+    """Reads the series with the given name from start up to, but not including, end, as arrays of times and values.
+
+    Either bound may be left out to read from the beginning or to the end of the archive. The values are a read-only
+    view of the archive, so they are only copied if modified.
+    """
+    values = _open(name)
+    first = 0 if start is None else max(0, _index(start))
+    last = len(values) if end is None else min(len(values), max(first, _index(end)))
+    times = ARCHIVE_START + np.arange(first, last) * STEP
+    return times, values[first:last]
+
+
+def write(name, times, values):
+    """Writes the given values at the given times, which must lie on the five minute grid, extending the archive."""
+    indices = _index(times)
+    keep = indices >= 0
+    indices = indices[keep]
+    if len(indices) == 0:
+        return
+    os.makedirs(ARCHIVE_DIRECTORY, exist_ok=True)
+    path = _path(name)
+    length = os.path.getsize(path) // DTYPE.itemsize if os.path.exists(path) else 0
+    if indices.max() >= length:
+        with open(path, 'ab') as f:
+            f.write(np.full(indices.max() + 1 - length, np.nan, dtype=DTYPE).tobytes())
+    archive = np.memmap(path, dtype=DTYPE, mode='r+')
+    archive[indices] = np.asarray(values, dtype=DTYPE)[keep]
+    archive.flush()
+
+
+def store(data: EmissionData, area):
+    """Adds freshly built emission data for the given price area to the archive."""
+    write(series(MEASURED, area), data.df_history.Minutes5UTC.values, data.df_history.CO2Emission.values)
+    # The first row of the forecast is a copy of the last measurement (see EmissionData.build).
+    write(series(FORECAST, area), data.df_forecast.Minutes5UTC.values[1:], data.df_forecast.CO2Emission.values[1:])
+
+
+def backfill(start=ARCHIVE_START, end=None):
+    """Downloads whatever data the archive is missing between start and end, a month at a time.
+
+    Months which are already complete for all price areas are skipped, so an interrupted backfill can simply be run
+    again.
+    """
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.utcnow().tz_localize(None).floor('5min')
+    months = pd.date_range(pd.Timestamp(start).to_period('M').to_timestamp(), end, freq='MS')
+    bounds = [(month, min(month + pd.offsets.MonthBegin(), end)) for month in months]
+    for kind in (MEASURED, FORECAST):
+        missing = [(a, b) for a, b in bounds if any(_is_incomplete(series(kind, area), a, b) for area in PRICE_AREAS)]
+        downloads = executor.map(lambda bound: download_emission_intensities(kind, *bound), missing)
+        for (month, _), areas in zip(missing, downloads):
+            for area, df in areas.items():
+                write(series(kind, area), df.Minutes5UTC.values, df.CO2Emission.values)
+                print(f'Archived {len(df)} values of {series(kind, area)} for {month:%Y-%m}')
+
+
+def _is_incomplete(name, start, end):
+    _, values = read(name, start, end)
+    return len(values) < _index(end) - _index(start) or np.isnan(values).any()
+
+
+def _open(name):
+    path = _path(name)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty(0, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode='r')
+
+
+def _path(name):
+    return os.path.join(ARCHIVE_DIRECTORY, f'{name}.f4')
+
+
+def _index(times):
+    """Gets the position of the given time, or array of times, in the archive."""
+    if isinstance(times, (str, pd.Timestamp)):
+        times = pd.Timestamp(times).to_datetime64()
+    return (np.asarray(times).astype('datetime64[m]') - ARCHIVE_START) // STEP
@@ -0,0 +1,13 @@
+"""The price areas we serve data for.
+
+Energinet splits Denmark into two price areas, DK1 (west of the Great Belt) and DK2 (east of it). These are kept apart
+from app.data, so that serving requests for an area does not mean importing pandas.
+"""
+# The price areas for which Energinet provides emission intensities. We default to DK2, which was the only one we
+# supported at first.
+PRICE_AREAS = ['DK1', 'DK2']
+DEFAULT_PRICE_AREA = 'DK2'
+
+# The generation mix can also be shown for Denmark as a whole, i.e. the price areas combined, which is the default.
+COMBINED_PRICE_AREA = 'DK'
+GENERATION_MIX_AREAS = [COMBINED_PRICE_AREA, *PRICE_AREAS]
@@ -0,0 +1,172 @@
+"""The web application as an ASGI app, serving the same API as the WSGI app in app.app.
+
+Almost every request is answered from the cache, so serving a request mostly means waiting for Redis. Rather than
+tying up a thread for every request, this app waits on an event loop, and reads the cache with an asyncio Redis client
+(see app.async_cache). Whatever is CPU bound or blocking, i.e. building data, plots, and talking to the subscription
+database or Slack, runs in threads. The stream of new versions (see app.stream) is served from the event loop as well,
+so there is no need for a separate gevent service either.
+
+Run it with e.g. `uvicorn app.asgi:app`, or set SERVER=asgi for start.sh. See loadtest/README.md for how the two
+compare.
+"""
+import json
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+from starlette.staticfiles import StaticFiles
+
+from . import async_cache, metrics, push, scheduling, slack, stream
+from .api import MAX_HOURLY_HISTORY_DAYS, chart_range, greenest_period_parameters, history_parameters, price_area
+from .areas import COMBINED_PRICE_AREA, DEFAULT_PRICE_AREA, GENERATION_MIX_AREAS, PRICE_AREAS
+from .responses import negotiate
+
+
+def _serve(request, response):
+    status, body, headers = negotiate(response.value, response.fresh_until, request.headers.get('Accept-Encoding'),
+                                      request.headers.get('If-None-Match'))
+    return Response(body, status_code=status, headers=headers, media_type=None if body is None else 'application/json')
+
+
+def _in_price_area(get, areas=PRICE_AREAS, default=DEFAULT_PRICE_AREA):
+    """Creates an endpoint serving the response which the given coroutine function gets for a price area."""
+    async def endpoint(request):
+        area, error = price_area(request.query_params, areas, default)
+        if error:
+            return JSONResponse(error)
+        return _serve(request, await get(area))
+    return endpoint
+
+
+async def greenest_period(request):
+    period, horizon, error = greenest_period_parameters(request.path_params['period'], request.path_params['horizon'])
+    if error:
+        return JSONResponse(error)
+    area, error = price_area(request.query_params, PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return JSONResponse(error)
+    return _serve(request, await async_cache.get_greenest_period_response(period, horizon, area))
+
+
+async def emission_intensity_chart(request):
+    area, error = price_area(request.query_params, PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return JSONResponse(error)
+    name, error = chart_range(request.query_params)
+    if error:
+        return JSONResponse(error)
+    return _serve(request, await async_cache.get_chart_response(name, area))
+
+
+def _history(query, **kwargs):
+    """Creates an endpoint answering the given question about the history; see app.history."""
+    async def endpoint(request):
+        area, error = price_area(request.query_params, PRICE_AREAS, DEFAULT_PRICE_AREA)
+        if error:
+            return JSONResponse(error)
+        parameters, error = history_parameters(request.query_params, **kwargs)
+        if error:
+            return JSONResponse(error)
+        return _serve(request, await async_cache.get_history_response(query, area, parameters))
+    return endpoint
+
+
+async def schedule(request):
+    area, error = price_area(request.query_params, PRICE_AREAS, DEFAULT_PRICE_AREA)
+    if error:
+        return JSONResponse(error)
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        data = None
+    try:
+        jobs = scheduling.parse_jobs(data)
+    except ValueError as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+    windows = await async_cache.get_forecast_windows(area)
+    # Large batches take a few milliseconds, which should not hold up the event loop.
+    return JSONResponse(await run_in_threadpool(scheduling.schedule, windows.value, jobs))
+
+
+async def version_stream(request):
+    return StreamingResponse(stream.async_events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _subscription_endpoint(function):
+    async def endpoint(request):
+        try:
+            await run_in_threadpool(function, (await request.body()).decode('ascii'))
+            return JSONResponse({'success': True})
+        except Exception as e:
+            print(e)
+            return JSONResponse({'success': False})
+    return endpoint
+
+
+async def slack_command(request):
+    form = await request.form()
+    area = slack.command_area(form.get('text'))
+    response = await async_cache.get_slack_response(area, wait=False)
+    if response is None:
+        slack.respond_later(area, form.get('response_url'))
+        return JSONResponse(slack.ACKNOWLEDGEMENT)
+    return _serve(request, response)
+
+
+async def slack_authorize(request):
+    return HTMLResponse(await run_in_threadpool(slack.authorize, request.query_params.get('code')))
+
+
+async def metrics_endpoint(request):
+    # Exporting reads from Redis with the synchronous client.
+    return Response(await run_in_threadpool(metrics.export), media_type='text/plain; version=0.0.4')
+
+
+class _RequestTimer:
+    """Records the time spent on each request, by route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            routes = scope['app'].routes
+            route = next((route.path for route in routes if route.matches(scope)[0] == Match.FULL), 'unmatched')
+            metrics.REQUEST_DURATION.observe(time.perf_counter() - start, route=route or '/')
+
+
+app = Starlette(middleware=[Middleware(_RequestTimer)], routes=[
+    Route('/api/v1/current-emission-intensity', _in_price_area(async_cache.get_model_with_plot_response)),
+    Route('/api/v2/current-emission-intensity', _in_price_area(async_cache.get_model_response)),
+    Route('/api/v2/emission-intensity-chart', emission_intensity_chart),
+    Route('/api/v1/current-generation-mix',
+          _in_price_area(async_cache.get_current_generation_mix_with_plot_response, GENERATION_MIX_AREAS,
+                         COMBINED_PRICE_AREA)),
+    Route('/api/v2/current-generation-mix',
+          _in_price_area(async_cache.get_current_generation_mix_response, GENERATION_MIX_AREAS, COMBINED_PRICE_AREA)),
+    Route('/api/v1/greenest-period/{period}/{horizon}', greenest_period),
+    Route('/api/v1/next-day', _in_price_area(lambda area: async_cache.get_next_day_response(area=area))),
+    Route('/api/v1/next-day-short', _in_price_area(lambda area: async_cache.get_next_day_response(True, area))),
+    Route('/api/v1/history/daily', _history('daily')),
+    Route('/api/v1/history/hourly', _history('hourly', max_days=MAX_HOURLY_HISTORY_DAYS, period=False)),
+    Route('/api/v1/history/greenest-window', _history('greenest_windows')),
+    Route('/api/v1/history/profile', _history('profile', period=False)),
+    Route('/api/v1/schedule', schedule, methods=['POST']),
+    Route('/api/v1/stream', version_stream),
+    Route('/api/v1/save-subscription', _subscription_endpoint(push.save_subscription), methods=['POST']),
+    Route('/api/v1/remove-subscription', _subscription_endpoint(push.remove_subscription), methods=['POST']),
+    Route('/api/v1/slack', slack_command, methods=['POST']),
+    Route('/api/v1/slack-authorize', slack_authorize),
+    Route('/metrics', metrics_endpoint),
+    Mount('/', StaticFiles(directory=os.path.join(os.path.dirname(__file__), 'static'), html=True)),
+])
@@ -0,0 +1,205 @@
+"""Reads the web application cache from asyncio code, for the ASGI app (see app.asgi).
+
+This mirrors the read path of app.cache: the current version of the dataset is looked up, the worker's memory is used
+if it holds that version, and otherwise the item is read from Redis, all without blocking the event loop. Items are
+cached by, and shared with, the synchronous code, so both apps can run side by side against the same Redis.
+
+Building data is CPU bound, and downloads from Energinet with the synchronous client, so it runs in a thread. Rather
+than polling Redis while somebody else builds data, a request waiting for it subscribes to the announcements of new
+versions (see VERSIONS_CHANNEL in app.cache), and is woken up as soon as the data is there.
+"""
+import asyncio
+import json
+import secrets
+import time
+import traceback
+
+import redis.asyncio
+
+from . import cache, metrics, snapshot
+from .areas import COMBINED_PRICE_AREA, DEFAULT_PRICE_AREA
+from .responses import render
+from .windows import best_period
+
+# The client connects lazily, so it can be created before there is an event loop.
+redis_client = redis.asyncio.Redis(host=cache.REDIS_HOSTNAME)
+
+
+async def get_model_response(area=DEFAULT_PRICE_AREA):
+    return await _get(cache._in_area(cache.EMISSION_INTENSITY_MODEL_IDENTIFIER, area), cache.EMISSION_INTENSITY,
+                      cache._update_data)
+
+
+async def get_model_with_plot_response(area=DEFAULT_PRICE_AREA):
+    from .model import build_model_with_plot
+
+    quintiles = (await get_quintiles(area)).value
+    return await _derive(await _get_snapshot(area), 'model-with-plot',
+                         lambda value: build_model_with_plot(value.emission_data(), quintiles))
+
+
+async def get_next_day_response(short_title=False, area=DEFAULT_PRICE_AREA):
+    identifier = cache.NEXT_DAY_SHORT_IDENTIFIER if short_title else cache.NEXT_DAY_IDENTIFIER
+    return await _get(cache._in_area(identifier, area), cache.EMISSION_INTENSITY, cache._update_data)
+
+
+async def get_chart_response(chart_range, area=DEFAULT_PRICE_AREA):
+    return await _get(cache._chart_identifier(chart_range, area), cache.EMISSION_INTENSITY, cache._update_data)
+
+
+async def get_slack_response(area=DEFAULT_PRICE_AREA, wait=True):
+    identifier = cache._in_area(cache.SLACK_IDENTIFIER, area)
+    if not wait and not await redis_client.exists(identifier):
+        return None
+    return await _get(identifier, cache.EMISSION_INTENSITY, cache._update_data)
+
+
+async def get_greenest_period_response(period, horizon, area=DEFAULT_PRICE_AREA):
+    windows = await get_forecast_windows(area)
+    return await _derive(windows, ('greenest-period', period, horizon),
+                         lambda value: best_period(value, period, horizon))
+
+
+async def get_forecast_windows(area=DEFAULT_PRICE_AREA):
+    return await _get(cache._in_area(cache.FORECAST_WINDOWS_IDENTIFIER, area), cache.EMISSION_INTENSITY,
+                      cache._update_data)
+
+
+async def get_quintiles(area=DEFAULT_PRICE_AREA):
+    return await _get(cache._in_area(cache.QUINTILES_IDENTIFIER, area), cache.EMISSION_INTENSITY, cache._update_data)
+
+
+async def get_history_response(query, area=DEFAULT_PRICE_AREA, parameters=None):
+    from . import history
+
+    parameters = parameters or {}
+    quintiles = await get_quintiles(area)
+    # Answers are read and rendered per request, like in app.cache, which should not hold up the event loop.
+    answer = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: render(getattr(history, query)(area, **parameters), fast=True))
+    return cache.LocalEntry(answer, quintiles.fresh_until, quintiles.version)
+
+
+async def _get_snapshot(area):
+    identifier = cache._in_area(cache.SNAPSHOT_IDENTIFIER, area)
+    return await _get(identifier, cache.EMISSION_INTENSITY, cache._update_data,
+                      decode=lambda value: snapshot.share(identifier, value))
+
+
+async def get_current_generation_mix_response(area=COMBINED_PRICE_AREA):
+    return await _get(cache._in_area(cache.GENERATION_MIX_IDENTIFIER, area), cache.GENERATION_MIX,
+                      cache._update_generation_mix)
+
+
+async def get_current_generation_mix_with_plot_response(area=COMBINED_PRICE_AREA):
+    from .model import build_current_generation_mix_with_plot
+
+    data = await _get(cache.GENERATION_MIX_DATA_IDENTIFIER, cache.GENERATION_MIX, cache._update_generation_mix)
+    return await _derive(data, ('generation-mix-with-plot', area),
+                         lambda value: build_current_generation_mix_with_plot(value, area))
+
+
+async def get_versions():
+    versions = await redis_client.mget([dataset.version_identifier for dataset in cache.DATASETS])
+    return {dataset.name: version.decode() if version else None for dataset, version in zip(cache.DATASETS, versions)}
+
+
+async def _get(identifier, dataset, update, decode=None):
+    """Gets an item from the cache, like app.cache._get."""
+    version = await redis_client.get(dataset.version_identifier)
+    local = cache.local_cache.get(identifier)
+    result = 'local'
+    if local is None or version is None or local.version != version.decode():
+        with metrics.STAGE_DURATION.time(stage='cache-read'):
+            entry = await _read(identifier)
+        result = 'hit'
+        if entry is None:
+            result = 'miss'
+            entry = await _update_or_wait(identifier, dataset, update)
+        value, fresh_until, entry_version = entry
+        local = cache.LocalEntry(decode(value) if decode else value, fresh_until, entry_version)
+        cache.local_cache[identifier] = local
+    if time.time() >= local.fresh_until:
+        result = 'stale'
+        await _refresh_in_background(dataset, update)
+    metrics.CACHE_LOOKUPS.inc(dataset=dataset.name, result=result)
+    return local
+
+
+async def _derive(entry, key, compute):
+    """Gets a response derived from the value of a cache entry, like app.cache._derive.
+
+    Deriving responses means building plots, which takes long enough that it should not hold up the event loop.
+    """
+    if key not in entry.derived:
+        return await asyncio.get_running_loop().run_in_executor(None, cache._derive, entry, key, compute)
+    return cache._derive(entry, key, compute)
+
+
+async def _read(identifier):
+    # We read entries as cachelib's RedisCache writes them, i.e. without a key prefix.
+    value = await redis_client.get(identifier)
+    return None if value is None else cache.cache.serializer.loads(value)
+
+
+async def _acquire_lock(lock_identifier):
+    token = secrets.token_hex(16)
+    if await redis_client.set(lock_identifier, token, nx=True, px=int(cache.LOCK_LEASE * 1000)):
+        return token
+    return None
+
+
+async def _refresh_in_background(dataset, update):
+    """Rebuilds stale data in a thread, unless somebody else is already doing so."""
+    token = await _acquire_lock(dataset.lock_identifier)
+    if token is None:
+        return
+
+    def run():
+        # Nobody waits for the result, so failures are printed here rather than lost with it.
+        try:
+            cache._build(dataset.lock_identifier, token, update)
+        except Exception:
+            traceback.print_exc()
+
+    asyncio.get_running_loop().run_in_executor(None, run)
+
+
+async def _update_or_wait(identifier, dataset, update):
+    """Builds missing data or, if somebody else is already building it, waits for them to announce the new version.
+
+    Should the builder crash, its lock expires after at most LOCK_LEASE seconds, after which we take over.
+    """
+    deadline = time.time() + 2 * cache.LOCK_LEASE
+    # We subscribe before checking whether somebody else is building, so that we cannot miss their announcement.
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(cache.VERSIONS_CHANNEL)
+    try:
+        while time.time() < deadline:
+            # The data may have been cached by somebody else since we last looked.
+            entry = await _read(identifier)
+            if entry is not None:
+                return entry
+            token = await _acquire_lock(dataset.lock_identifier)
+            if token is not None:
+                # The lease is renewed, and the lock released, by the thread building the data.
+                entries = await asyncio.get_running_loop().run_in_executor(None, cache._build, dataset.lock_identifier,
+                                                                          token, update)
+                return entries[identifier]
+            lease = await redis_client.pttl(dataset.lock_identifier)
+            with metrics.LOCK_WAIT_DURATION.time(dataset=dataset.name):
+                await _wait_for_version(pubsub, dataset, min(max(lease, 0) / 1000, deadline - time.time()))
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+    metrics.LOCK_WAIT_TIMEOUTS.inc(dataset=dataset.name)
+    raise RuntimeError('timeout while waiting for data to be generated')
+
+
+async def _wait_for_version(pubsub, dataset, timeout):
+    """Waits at most timeout seconds for a new version of the given dataset to be announced."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        message = await pubsub.get_message(timeout=deadline - time.time())
+        if message is not None and json.loads(message['data'])['dataset'] == dataset.name:
+            return
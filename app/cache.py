@@ -2,24 +2,65 @@
 
 We use Redis throughout to cache the main time-consuming parts of the web application's work. In particular,
 we ensure that we will only generate new data (thus hit Energinet) only when what we have is getting stale.
+
+Every cached item has two timeouts: a soft timeout, after which the item is considered stale, and a hard timeout,
+after which Redis forgets about it. When a request finds a stale item, it is served immediately, and a single worker
+rebuilds the item in the background. Only when an item is missing entirely (i.e. on a cold start) does a request have
+to wait for it to be built. To make sure that only one worker rebuilds an item at a time, rebuilding requires holding a
+lock, which is taken atomically and comes with a lease, so that a crashed builder can never block rebuilds for longer
+than the lease.
+
+All items are built for every price area at once, and cached under identifiers of their own for each area.
+
+Items served directly by the API are cached as rendered responses (see app.responses), i.e. already serialized and
+compressed, rather than as the underlying data. The first version of the API includes full plot specifications, which
+are expensive to produce, and which the web app no longer uses, so those are only produced when asked for.
+
+On top of Redis, each worker keeps the decoded items it has seen in memory. Every build of data is tagged with a new
+version, which is stored under a small key of its own, so a worker only has to look up the current version to know
+whether what it has in memory can be used. That way, most requests never have to transfer or deserialize anything.
+
+In production, the cache is kept warm by the refresher (see app.refresh), which rebuilds everything ahead of expiry,
+so that requests only ever read from the cache. The rebuilds triggered by requests below are only a fallback for when
+the refresher is not running, e.g. on a cold start or in development.
 """
+import json
+import secrets
+import threading
 import time
+import traceback
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 
-import pyarrow as pa
+import redis
 from cachelib import RedisCache
 
-from .model import build_current_generation_mix, build_model
+from . import frames, metrics, slack, snapshot
+from .areas import COMBINED_PRICE_AREA, DEFAULT_PRICE_AREA, PRICE_AREAS
+from .responses import render
+from .windows import FORMAT_VERSION as WINDOWS_FORMAT_VERSION
+from .windows import best_period, overview_next_day
 
 # We hardcode the Redis hostname 'redis', matching what we get if we use Docker Compose to spin up the app.
 REDIS_HOSTNAME = 'redis'
 
 # Define identifiers used as keys for Redis throughout.
 EMISSION_INTENSITY_MODEL_IDENTIFIER = 'emission-intensity-model'
-EMISSION_INTENSITY_GENERATING_IDENTIFIER = 'emission-intensity-model-generating'
-FORECAST_IDENTIFIER = 'emission-intensity-forecast'
+EMISSION_INTENSITY_LOCK_IDENTIFIER = 'emission-intensity-model-lock'
+EMISSION_INTENSITY_VERSION_IDENTIFIER = 'emission-intensity-model-version'
+EMISSION_DATA_IDENTIFIER = f'emission-intensity-data-v{frames.FORMAT_VERSION}'
+SNAPSHOT_IDENTIFIER = f'emission-intensity-snapshot-v{snapshot.FORMAT_VERSION}'
+FORECAST_WINDOWS_IDENTIFIER = f'emission-intensity-forecast-windows-v{WINDOWS_FORMAT_VERSION}'
+NEXT_DAY_IDENTIFIER = 'next-day-overview'
+NEXT_DAY_SHORT_IDENTIFIER = 'next-day-short-overview'
+QUINTILES_IDENTIFIER = 'emission-intensity-quintiles'
+SLACK_IDENTIFIER = 'slack-overview'
+CHART_IDENTIFIER = 'emission-intensity-chart'
 
 GENERATION_MIX_IDENTIFIER = 'generation-mix-model'
-GENERATION_MIX_GENERATING_IDENTIFIER = 'generation-mix-model-generating'
+GENERATION_MIX_DATA_IDENTIFIER = 'generation-mix-data'
+GENERATION_MIX_LOCK_IDENTIFIER = 'generation-mix-model-lock'
+GENERATION_MIX_VERSION_IDENTIFIER = 'generation-mix-model-version'
 
 # For the emission intensity data model, we will use the same five minute timeout for all cache values. Energinet's data
 # is updated about every 10-15 minutes, so this way we'll always be mostly fresh. For the generation mix, the data is
@@ -27,69 +68,379 @@ GENERATION_MIX_GENERATING_IDENTIFIER = 'generation-mix-model-generating'
 EMISSION_INTENSITY_TIMEOUT = 5 * 60
 GENERATION_MIX_TIMEOUT = 30 * 60
 
-cache = RedisCache(REDIS_HOSTNAME)
+# The timeouts above are soft timeouts. Stale data is still served for a while after those, as long as we are unable to
+# build new data, but we would rather show nothing than data that is hours old.
+EMISSION_INTENSITY_HARD_TIMEOUT = 60 * 60
+GENERATION_MIX_HARD_TIMEOUT = 3 * 60 * 60
 
+# The lease of the lock held while rebuilding data, in seconds. If a builder crashes, other workers can take over once
+# the lease runs out. Building data usually takes a few seconds, but when Energinet is slow, retrying requests (see
+# app.data) can take longer than the lease, so a builder keeps renewing it while it is alive.
+LOCK_LEASE = 60
 
-def get_model():
-    # Before getting the data from the cache (or recreating it if necessary), we ensure that no other thread is in the
-    # process of generating data. This way, we avoid having two threads generating the same data.
-    _wait_until_not_generating(EMISSION_INTENSITY_GENERATING_IDENTIFIER)
-    model = cache.get(EMISSION_INTENSITY_MODEL_IDENTIFIER)
-    if model:
-        return model
-    model, _ = _update_data()
-    return model
+# Releasing a lock must only delete the lock if we are still the ones holding it; if our lease ran out, somebody else
+# might have taken over. Checking and deleting has to happen atomically, so we do it in a Lua script.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
 
+# Likewise, renewing the lease must only happen if we are still the ones holding the lock.
+RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+else
+    return 0
+end
+"""
 
-def get_forecast():
-    _wait_until_not_generating(EMISSION_INTENSITY_GENERATING_IDENTIFIER)
-    forecast = cache.get(FORECAST_IDENTIFIER)
-    if forecast:
-        return pa.deserialize(forecast)
-    _, forecast = _update_data()
-    return forecast
+# Whenever a new version of a dataset is cached, it is announced on this Redis channel (see app.stream).
+VERSIONS_CHANNEL = 'dataset-versions'
 
+redis_client = redis.Redis(REDIS_HOSTNAME)
+cache = RedisCache(redis_client)
 
-def _wait_until_not_generating(identifier):
-    """This sleeps until data is no longer being generated and added to the cache.
 
-    The use of this is for the cases where we want to make sure that we do not spin up more than one process for
-    adding data to the cache at a time. The identifier is a Redis key pointing to a boolean describing whether or not
-    the relevant data is currently being generated.
+@dataclass
+class Dataset:
+    """Describes a collection of cache items which are built together, and thus share a lock and a version."""
+    name: str
+    lock_identifier: str
+    version_identifier: str
+    timeout: int
+    hard_timeout: int
+
+
+EMISSION_INTENSITY = Dataset('emission-intensity', EMISSION_INTENSITY_LOCK_IDENTIFIER,
+                             EMISSION_INTENSITY_VERSION_IDENTIFIER, EMISSION_INTENSITY_TIMEOUT,
+                             EMISSION_INTENSITY_HARD_TIMEOUT)
+GENERATION_MIX = Dataset('generation-mix', GENERATION_MIX_LOCK_IDENTIFIER, GENERATION_MIX_VERSION_IDENTIFIER,
+                         GENERATION_MIX_TIMEOUT, GENERATION_MIX_HARD_TIMEOUT)
+DATASETS = [EMISSION_INTENSITY, GENERATION_MIX]
+
+
+@dataclass
+class LocalEntry:
+    """A decoded cache item, as kept in the memory of a single worker.
+
+    Anything a worker derives from the item can be kept in derived, so that it is computed only once per version.
     """
-    counter = 0
-    while True:
-        generating = cache.get(identifier)
-        if not generating:
-            break
-        if counter > 100:
-            raise RuntimeError('timeout while waiting for data to be generated')
-        time.sleep(0.1)
-        counter += 1
+    value: object
+    fresh_until: float
+    version: str
+    derived: dict = field(default_factory=dict)
 
 
-def _update_data():
-    """Generates all model data and caches the result for five minutes."""
+# The in-memory cache of the current worker, keyed by Redis identifiers.
+local_cache = {}
+
+
+def get_model_response(area=DEFAULT_PRICE_AREA):
+    return _get(_in_area(EMISSION_INTENSITY_MODEL_IDENTIFIER, area), EMISSION_INTENSITY, _update_data)
+
+
+def get_model_with_plot_response(area=DEFAULT_PRICE_AREA):
+    from .model import build_model_with_plot
+
+    quintiles = get_quintiles(area)
+    return _derive(_get_snapshot(area), 'model-with-plot',
+                   lambda value: build_model_with_plot(value.emission_data(), quintiles))
+
+
+def get_next_day_response(short_title=False, area=DEFAULT_PRICE_AREA):
+    identifier = NEXT_DAY_SHORT_IDENTIFIER if short_title else NEXT_DAY_IDENTIFIER
+    return _get(_in_area(identifier, area), EMISSION_INTENSITY, _update_data)
+
+
+def get_chart_response(chart_range, area=DEFAULT_PRICE_AREA):
+    """Gets the downsampled chart of the given range, e.g. 'week', as named in app.charts.CHART_RANGES."""
+    return _get(_chart_identifier(chart_range, area), EMISSION_INTENSITY, _update_data)
+
+
+def get_slack_response(area=DEFAULT_PRICE_AREA, wait=True):
+    """Gets the answer to the Slack command for the given price area (see app.slack).
+
+    Unless wait is true, this gets None rather than waiting for the answer to be built if it is missing.
+    """
+    identifier = _in_area(SLACK_IDENTIFIER, area)
+    if not wait and not redis_client.exists(identifier):
+        return None
+    return _get(identifier, EMISSION_INTENSITY, _update_data)
+
+
+def get_greenest_period_response(period, horizon, area=DEFAULT_PRICE_AREA):
+    """Gets the greenest period of the given length within the given horizon.
+
+    There are too many combinations of periods and horizons to render them all up front, so each worker renders them
+    as needed, once per version of the forecast.
+    """
+    windows = _get(_in_area(FORECAST_WINDOWS_IDENTIFIER, area), EMISSION_INTENSITY, _update_data)
+    return _derive(windows, ('greenest-period', period, horizon), lambda value: best_period(value, period, horizon))
+
+
+def get_forecast_windows(area=DEFAULT_PRICE_AREA):
+    """Gets the greenest and blackest windows of the forecast, as an instance of app.windows.ForecastWindows."""
+    return _get(_in_area(FORECAST_WINDOWS_IDENTIFIER, area), EMISSION_INTENSITY, _update_data).value
+
+
+def get_quintiles(area=DEFAULT_PRICE_AREA):
+    """Gets the quintiles of the emission intensities of the last three years, or None if they are not known."""
+    return _get(_in_area(QUINTILES_IDENTIFIER, area), EMISSION_INTENSITY, _update_data).value
+
+
+def get_snapshot(area=DEFAULT_PRICE_AREA):
+    """Gets the emission intensity history and forecast as a compact snapshot, shared with the other workers on this
+    host, as an instance of app.snapshot.Snapshot."""
+    return _get_snapshot(area).value
+
+
+def _get_snapshot(area):
+    identifier = _in_area(SNAPSHOT_IDENTIFIER, area)
+    return _get(identifier, EMISSION_INTENSITY, _update_data, decode=lambda value: snapshot.share(identifier, value))
+
+
+def get_current_generation_mix_response(area=COMBINED_PRICE_AREA):
+    return _get(_in_area(GENERATION_MIX_IDENTIFIER, area), GENERATION_MIX, _update_generation_mix)
+
+
+def get_current_generation_mix_with_plot_response(area=COMBINED_PRICE_AREA):
+    from .model import build_current_generation_mix_with_plot
+
+    data = _get(GENERATION_MIX_DATA_IDENTIFIER, GENERATION_MIX, _update_generation_mix)
+    return _derive(data, ('generation-mix-with-plot', area),
+                   lambda value: build_current_generation_mix_with_plot(value, area))
+
+
+def get_history_response(query, area=DEFAULT_PRICE_AREA, parameters=None):
+    """Gets the answer to a question about the history, as given by the name of one of the functions of app.history
+    and its parameters.
+
+    There are thousands of combinations of parameters, so rather than keeping every answer for the whole version of the
+    data, each is read from the rollups, which takes a few milliseconds, and rendered cheaply, per request. The rollups
+    are updated along with the emission intensity data, so answers are fresh for as long as that is.
+    """
+    from . import history
+
+    parameters = parameters or {}
+    quintiles = _get(_in_area(QUINTILES_IDENTIFIER, area), EMISSION_INTENSITY, _update_data)
+    answer = render(getattr(history, query)(area, **parameters), fast=True)
+    return LocalEntry(answer, quintiles.fresh_until, quintiles.version)
+
+
+def get_versions():
+    """Gets the current version of every dataset, keyed by dataset name; versions are None for missing datasets."""
+    versions = redis_client.mget([dataset.version_identifier for dataset in DATASETS])
+    return {dataset.name: version.decode() if version else None for dataset, version in zip(DATASETS, versions)}
+
+
+def refresh_model():
+    """Rebuilds the emission intensity model and forecast, replacing whatever is in the cache.
+
+    If somebody else is already rebuilding, we leave it to them.
+    """
+    _refresh(EMISSION_INTENSITY, _update_data)
+
+
+def refresh_generation_mix():
+    """Rebuilds the current generation mix, replacing whatever is in the cache."""
+    _refresh(GENERATION_MIX, _update_generation_mix)
+
+
+def _in_area(identifier, area):
+    """Gets the identifier of the item of the given kind for the given price area."""
+    return f'{identifier}-{area.lower()}'
+
+
+def _chart_identifier(chart_range, area):
+    return _in_area(f'{CHART_IDENTIFIER}-{chart_range}', area)
+
+
+def _get(identifier, dataset, update, decode=None):
+    """Gets an item from the cache, making sure that it gets rebuilt if it is stale or missing.
+
+    Here, update is a function which builds and caches all items in the dataset, returning a dictionary of the cache
+    entries it created, keyed by identifier. If given, decode is applied to the cached value before it is kept in the
+    worker's memory.
+    """
+    version = redis_client.get(dataset.version_identifier)
+    local = local_cache.get(identifier)
+    result = 'local'
+    if local is None or version is None or local.version != version.decode():
+        with metrics.STAGE_DURATION.time(stage='cache-read'):
+            entry = cache.get(identifier)
+        result = 'hit'
+        if entry is None:
+            result = 'miss'
+            entry = _update_or_wait(identifier, dataset, update)
+        value, fresh_until, entry_version = entry
+        local = LocalEntry(decode(value) if decode else value, fresh_until, entry_version)
+        local_cache[identifier] = local
+    if time.time() >= local.fresh_until:
+        result = 'stale'
+        _refresh_in_background(dataset, update)
+    metrics.CACHE_LOOKUPS.inc(dataset=dataset.name, result=result)
+    return local
+
+
+def _derive(entry, key, compute):
+    """Gets a response derived from the value of a cache entry, rendering it if this worker has not done so already."""
+    if key not in entry.derived:
+        entry.derived[key] = render(compute(entry.value))
+    return LocalEntry(entry.derived[key], entry.fresh_until, entry.version)
+
+
+def _set(dataset, values):
+    """Caches all given values, keyed by identifier, as a new version of the given dataset.
+
+    The version is only published once all values are in place, so a reader seeing the new version will also find the
+    new values. It is then announced to everybody listening for new versions.
+    """
+    version = secrets.token_hex(8)
+    fresh_until = time.time() + dataset.timeout
+    entries = {identifier: (value, fresh_until, version) for identifier, value in values.items()}
+    with metrics.STAGE_DURATION.time(stage='cache-write'):
+        for identifier, entry in entries.items():
+            cache.set(identifier, entry, timeout=dataset.hard_timeout)
+    redis_client.set(dataset.version_identifier, version, ex=dataset.hard_timeout)
+    redis_client.publish(VERSIONS_CHANNEL, json.dumps({'dataset': dataset.name, 'version': version}))
+    return entries
+
+
+def _acquire_lock(lock_identifier):
+    """Attempts to take the lock with the given identifier, returning a token identifying the holder on success."""
+    token = secrets.token_hex(16)
+    if redis_client.set(lock_identifier, token, nx=True, px=int(LOCK_LEASE * 1000)):
+        return token
+    return None
+
+
+def _release_lock(lock_identifier, token):
+    redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_identifier, token)
+
+
+@contextmanager
+def _holding_lock(lock_identifier, token):
+    """Renews the lease of a lock we hold for as long as the block runs, and releases the lock afterwards."""
+    done = threading.Event()
+
+    def renew():
+        while not done.wait(LOCK_LEASE / 3):
+            try:
+                redis_client.eval(RENEW_LOCK_SCRIPT, 1, lock_identifier, token, int(LOCK_LEASE * 1000))
+            except redis.RedisError:
+                traceback.print_exc()
+
+    threading.Thread(target=renew, daemon=True).start()
     try:
-        cache.set(EMISSION_INTENSITY_GENERATING_IDENTIFIER, True)
-        model, forecast = build_model()
-        cache.set(EMISSION_INTENSITY_MODEL_IDENTIFIER, model, timeout=EMISSION_INTENSITY_TIMEOUT)
-        serialized = pa.serialize(forecast).to_buffer()
-        cache.set(FORECAST_IDENTIFIER, serialized, timeout=EMISSION_INTENSITY_TIMEOUT)
-        return model, forecast
+        yield
     finally:
-        cache.delete(EMISSION_INTENSITY_GENERATING_IDENTIFIER)
+        done.set()
+        _release_lock(lock_identifier, token)
+
+
+def _build(lock_identifier, token, update):
+    """Builds data while holding the given lock, returning what update returns."""
+    with _holding_lock(lock_identifier, token):
+        return update()
+
+
+def _refresh(dataset, update):
+    token = _acquire_lock(dataset.lock_identifier)
+    if token is None:
+        return
+    _build(dataset.lock_identifier, token, update)
 
 
-def get_current_generation_mix():
-    _wait_until_not_generating(GENERATION_MIX_GENERATING_IDENTIFIER)
-    current_generation_mix = cache.get(GENERATION_MIX_IDENTIFIER)
-    if current_generation_mix:
-        return current_generation_mix
+def _refresh_in_background(dataset, update):
+    """Rebuilds stale data in a background thread, unless somebody else is already doing so."""
+    token = _acquire_lock(dataset.lock_identifier)
+    if token is None:
+        return
+
+    threading.Thread(target=_build, args=(dataset.lock_identifier, token, update), daemon=True).start()
+
+
+def _update_or_wait(identifier, dataset, update):
+    """Builds missing data or, if somebody else is already building it, waits for them to finish.
+
+    Should the builder crash, its lock expires after at most LOCK_LEASE seconds, after which we take over.
+    """
+    deadline = time.time() + 2 * LOCK_LEASE
+    while time.time() < deadline:
+        token = _acquire_lock(dataset.lock_identifier)
+        if token is not None:
+            return _build(dataset.lock_identifier, token, update)[identifier]
+        with metrics.LOCK_WAIT_DURATION.time(dataset=dataset.name):
+            while redis_client.exists(dataset.lock_identifier) and time.time() < deadline:
+                time.sleep(0.05)
+        entry = cache.get(identifier)
+        if entry is not None:
+            return entry
+    metrics.LOCK_WAIT_TIMEOUTS.inc(dataset=dataset.name)
+    raise RuntimeError('timeout while waiting for data to be generated')
+
+
+def _update_data():
+    """Generates all model data for every price area, caches the result, and adds the new data to the archive."""
+    from . import charts, distribution
+    from .data import EmissionData
+    from .model import build_model
+
+    # Whatever data we already have, we only need to download what is newer than that.
+    entries = cache.get_many(*[_in_area(EMISSION_DATA_IDENTIFIER, area) for area in PRICE_AREAS])
+    previous_histories = None
+    if all(entry is not None for entry in entries):
+        previous_histories = {area: frames.read_history(entry[0]) for area, entry in zip(PRICE_AREAS, entries)}
+    with metrics.STAGE_DURATION.time(stage='emission-data'):
+        areas = EmissionData.build(previous_histories)
+    values = {}
+    for area, data in areas.items():
+        # The quintiles change only slowly, so those of the archive as it was before this build will do.
+        with metrics.STAGE_DURATION.time(stage='quintiles'):
+            quintiles = distribution.quintiles(area)
+        model, windows = build_model(data, quintiles)
+        with metrics.STAGE_DURATION.time(stage='archive'):
+            _archive(data, area)
+        values.update({_in_area(EMISSION_INTENSITY_MODEL_IDENTIFIER, area): render(model),
+                       _in_area(EMISSION_DATA_IDENTIFIER, area): frames.serialize(data),
+                       _in_area(SNAPSHOT_IDENTIFIER, area): snapshot.pack(data),
+                       _in_area(FORECAST_WINDOWS_IDENTIFIER, area): windows,
+                       _in_area(QUINTILES_IDENTIFIER, area): quintiles,
+                       _in_area(NEXT_DAY_IDENTIFIER, area): render(overview_next_day(windows, quintiles=quintiles)),
+                       _in_area(NEXT_DAY_SHORT_IDENTIFIER, area): render(overview_next_day(windows, True, quintiles)),
+                       _in_area(SLACK_IDENTIFIER, area): render(slack.overview(windows, quintiles))})
+        # The charts of longer ranges read the archive, so they are built once the new data is in it.
+        with metrics.STAGE_DURATION.time(stage='charts'):
+            values.update({_chart_identifier(name, area): render(charts.build_chart(data, area, days, quintiles))
+                           for name, days in charts.CHART_RANGES.items()})
+    return _set(EMISSION_INTENSITY, values)
+
+
+def _archive(data, area):
+    """Adds new emission data to the archive, and updates the distribution and the rollups of the archived data
+    accordingly.
+
+    Failing to archive the data should not prevent it from being used, so errors are printed rather than raised.
+    """
+    from . import archive, distribution, history
+
     try:
-        cache.set(GENERATION_MIX_GENERATING_IDENTIFIER, True)
-        current_generation_mix = build_current_generation_mix()
-        cache.set(GENERATION_MIX_IDENTIFIER, current_generation_mix, timeout=GENERATION_MIX_TIMEOUT)
-        return current_generation_mix
-    finally:
-        cache.delete(GENERATION_MIX_GENERATING_IDENTIFIER)
+        archive.store(data, area)
+        start, end = data.df_history.Minutes5UTC.min(), data.df_history.Minutes5UTC.max()
+        distribution.update(area, start, end)
+        history.update(area, start, end)
+    except Exception:
+        traceback.print_exc()
+
+
+def _update_generation_mix():
+    """Generates the current generation mix for every price area, and the areas combined, and caches the result."""
+    from .model import build_current_generation_mix
+
+    current_generation_mix, data = build_current_generation_mix()
+    values = {_in_area(GENERATION_MIX_IDENTIFIER, area): render(description)
+              for area, description in current_generation_mix.items()}
+    return _set(GENERATION_MIX, {**values, GENERATION_MIX_DATA_IDENTIFIER: data})
@@ -0,0 +1,92 @@
+"""Describes the emission intensities of a longer range, i.e. a week, a month, or a year, for charts.
+
+Charting every five minute data point of a year would mean sending over a hundred thousand points to the browser, and
+having it draw them, for a chart a thousand or so pixels wide. Instead, each range is downsampled on the server to at
+most CHART_POINTS points with the Largest-Triangle-Three-Buckets algorithm (Steinarsson, 2013), which keeps the peaks
+and troughs making up the shape of the series rather than averaging them away. That way, the size of the payload and
+the cost of drawing the chart are the same whatever the range.
+
+The measured intensities of the range are read from the archive (see app.archive), followed by the history and forecast
+of the current data. Charts are built along with the rest of the data, for every range and price area (see app.cache),
+and are described like the chart of the current data (see app.model.build_model), so the same template draws both.
+"""
+import numpy as np
+
+from .windows import _quintile_bounds
+
+# The ranges we chart, in days, keyed by name, and the number of points each chart is downsampled to.
+CHART_RANGES = {'week': 7, 'month': 30, 'year': 365}
+DEFAULT_CHART_RANGE = 'week'
+CHART_POINTS = 1000
+
+
+def lttb(x, y, points):
+    """Picks the given number of points of the series given by x and y, x being increasing, that best preserve its
+    shape, returning their indices.
+
+    The first and last points are always kept. The points in between are split into equally many buckets, and from each
+    bucket, we pick the point forming the largest triangle with the point picked from the previous bucket and the mean
+    of the next bucket.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    # The bounds of the buckets of all but the first and last points, and the mean of each, from the prefix sums.
+    bounds = np.linspace(1, n - 1, points - 1).astype(int)
+    sizes = np.diff(bounds)
+    mean_x = np.diff(np.concatenate([[0], np.cumsum(x)])[bounds]) / sizes
+    mean_y = np.diff(np.concatenate([[0], np.cumsum(y)])[bounds]) / sizes
+    # The last bucket is followed by the last point rather than by another bucket.
+    next_x, next_y = np.append(mean_x[1:], x[-1]), np.append(mean_y[1:], y[-1])
+    picked = np.empty(points, dtype=int)
+    picked[0], picked[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        # Twice the areas of the triangles, which is just as good for finding the largest.
+        areas = np.abs((x[previous] - next_x[bucket]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y[bucket] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        picked[bucket + 1] = previous
+    return picked
+
+
+def build_chart(data, area, days, quintiles=None):
+    """Describes the emission intensities of the given number of days up to now, followed by the forecast, as given by
+    the current data for the given price area, an instance of app.data.EmissionData.
+
+    The history and the forecast are downsampled separately, each to its share of the points, so that the lines of both
+    meet where the forecast starts. Missing values in the archive are left out.
+    """
+    from . import archive
+
+    history_times = data.df_history.Minutes5UTC.to_numpy()
+    start = history_times[-1] - np.timedelta64(days, 'D')
+    archived_times, archived = archive.read(archive.series(archive.MEASURED, area), start, history_times[0])
+    times = np.concatenate([archived_times.astype(history_times.dtype), history_times[history_times >= start]])
+    values = np.concatenate([archived, data.df_history.CO2Emission.to_numpy()[history_times >= start]])
+    known = ~np.isnan(values)
+    times, values = times[known], values[known]
+    forecast_times = data.df_forecast.Minutes5UTC.to_numpy()
+    forecast_values = data.df_forecast.CO2Emission.to_numpy()
+
+    history_points = max(3, CHART_POINTS * len(times) // (len(times) + len(forecast_times)))
+    history = lttb(_milliseconds(times), values, history_points)
+    forecast = lttb(_milliseconds(forecast_times), forecast_values, CHART_POINTS - history_points)
+    times = _milliseconds(np.concatenate([times[history], forecast_times[forecast]]))
+    intensities = np.rint(np.concatenate([values[history], forecast_values[forecast]])).astype(int)
+    return {'success': True,
+            'range-days': days,
+            'times': times.tolist(),
+            'intensities': intensities.tolist(),
+            'forecast-start': len(history),
+            'now': int(_milliseconds(history_times[-1])),
+            'selection': [int(times[0]), int(times[-1])],
+            'plot-height': max(250, int(intensities.max()) + 25),
+            'quintiles': _quintile_bounds(quintiles)}
+
+
+def _milliseconds(times):
+    """Converts times to milliseconds since the epoch, as used in the chart template."""
+    return np.asarray(times).astype('datetime64[ms]').astype(np.int64)
@@ -1,21 +1,59 @@
-"""Contains the logic necessary to turn Energinet's data into pandas dataframes."""
+"""Contains the logic necessary to turn Energinet's data into pandas dataframes.
+
+All requests to Energinet go through a single session, so that connections are kept alive and reused between
+requests and rebuilds, and requests that do not depend on each other are made concurrently.
+
+Energinet splits Denmark into two price areas, DK1 (west of the Great Belt) and DK2 (east of it), and provides data
+for each of them. Rather than making a request per area, we get the data of all areas at once, and split it up
+afterwards.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from urllib.parse import urlsplit
 
 import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .areas import DEFAULT_PRICE_AREA, PRICE_AREAS
 
 # General parts of the data queries that will be used for all purposes below
 BASE_URL = 'https://api.energidataservice.dk/dataset/'
-EMISSION_INTENSITY_FILTERS = '{"PriceArea": "DK2"}'
-GENERATION_MIX_FIELDS = 'TimeDK,GrossCon,Biomass,Biogas,FossilGas,FossilHardCoal,FossilOil,HydroPower,OtherRenewable,' \
-                      'SolarPower,Waste,OnshoreWindPower,OffshoreWindPower,ExchangeGermany,ExchangeGreatBelt,' \
-                      'ExchangeSweden,ExchangeNorway,ExchangeNetherlands,ExchangeGreatBritain'
+GENERATION_MIX_FIELDS = 'TimeDK,PriceArea,GrossCon,Biomass,Biogas,FossilGas,FossilHardCoal,FossilOil,HydroPower,' \
+                      'OtherRenewable,SolarPower,Waste,OnshoreWindPower,OffshoreWindPower,ExchangeGermany,' \
+                      'ExchangeGreatBelt,ExchangeSweden,ExchangeNorway,ExchangeNetherlands,ExchangeGreatBritain'
 GENERATION_MIX_SORT = 'TimeUTC desc'
 HISTORY_RESOURCE = 'co2emis'
 FORECAST_RESOURCE = 'co2emisprog'
 EMISSION_MIX_RESOURCE = 'GenerationProdTypeExchange'
 
+# The resolution of the emission intensity data is 5 minutes, and we keep 2 days of history, i.e. (60/5) * 24 * 2 = 576
+# data points.
+RESOLUTION = pd.Timedelta('5m')
+HISTORY_LENGTH = 576
+
+# Emission intensities are either measured or forecasted.
+EMISSION_TYPES = ['Målt', 'Prognose']
+
+# Rows for the price areas are interleaved, but not always evenly, as data for one area may arrive before data for the
+# other. We therefore ask for a bit more than we need of each area.
+ROWS_PER_AREA = HISTORY_LENGTH + 12
+
+# Timeouts, in seconds, for connecting to Energinet and for waiting for data respectively. If Energinet is slow, we
+# would rather fail, and keep serving the data we already have, than have a worker wait indefinitely.
+TIMEOUT = (3.05, 20)
+
+# Failed requests are retried a few times, waiting 0.5, 1, and 2 seconds before each attempt.
+RETRIES = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=RETRIES))
+executor = ThreadPoolExecutor(max_workers=4)
+
 
 @dataclass
 class EmissionData:
@@ -23,24 +61,38 @@ class EmissionData:
     df_forecast: pd.DataFrame
 
     @classmethod
-    def build(cls):
-        """Produces data frames of emission intensities with 2 days of history and as long a forecast as possible."""
-        # The resolution of the data is 5 minutes, so we want (60/5) * 24 * 2 = 576 data points
-        limit = 576
-        query = f'?limit={limit}&filter={EMISSION_INTENSITY_FILTERS}'
-        data_history = requests.get(f'{BASE_URL}/{HISTORY_RESOURCE}{query}').json()
-        data_forecast = requests.get(f'{BASE_URL}/{FORECAST_RESOURCE}{query}').json()
-        df_history = pd.DataFrame(data_history['records'])[::-1]
-        df_history['Minutes5DK'] = pd.to_datetime(df_history.Minutes5DK).dt.tz_localize('Europe/Copenhagen', ambiguous='NaT')
-        df_history['Minutes5UTC'] = pd.to_datetime(df_history.Minutes5UTC)
-        df_history['Type'] = 'Målt'
-        df_history = df_history.drop(['PriceArea'], axis=1)
-        df_forecast = pd.DataFrame(data_forecast['records'])[::-1]
-        df_forecast['Minutes5DK'] = pd.to_datetime(df_forecast.Minutes5DK).dt.tz_localize('Europe/Copenhagen', ambiguous='NaT')
-        df_forecast['Minutes5UTC'] = pd.to_datetime(df_forecast.Minutes5UTC)
-        df_forecast['Type'] = 'Prognose'
-        df_forecast = df_forecast.drop(['PriceArea'], axis=1)
-        df_forecast = df_forecast[df_forecast.Minutes5DK >= df_history.Minutes5DK.max()]
+    def build(cls, previous=None):
+        """Produces data frames of emission intensities with 2 days of history and as long a forecast as possible.
+
+        The result is a dictionary containing such data for every price area, keyed by area. If given the histories of
+        previously built data, as the times (UTC) and emission intensities of each area keyed by area, e.g. as read by
+        app.frames.read_history, we only download the history that is newer than what we already have.
+        """
+        # Unlike the history, the forecast gets revised as time passes, so we always get all of it; we only need it from
+        # the current time onwards though. Measurements can be delayed by a while, so to be on the safe side, we also
+        # get the forecast for the last few hours, and let the history decide where it should start.
+        start = _format_time(pd.Timestamp.utcnow().tz_localize(None) - pd.Timedelta('6H'))
+        forecast_query = f'start={start}&timezone=utc&limit={ROWS_PER_AREA * len(PRICE_AREAS)}'
+        forecasts = executor.submit(_get_emission_intensities, FORECAST_RESOURCE, 'Prognose', forecast_query)
+        histories = None
+        if previous is not None:
+            histories = _extend_histories(previous)
+        if histories is None:
+            query = f'limit={ROWS_PER_AREA * len(PRICE_AREAS)}'
+            histories = _get_emission_intensities(HISTORY_RESOURCE, 'Målt', query)
+        forecasts = forecasts.result()
+        return {area: cls._join(area, histories[area].iloc[-HISTORY_LENGTH:].reset_index(drop=True), forecasts[area])
+                for area in PRICE_AREAS}
+
+    @classmethod
+    def _join(cls, area, df_history, df_forecast):
+        # Should Energinet have no data for an area, we would rather say so than fail somewhere further down the line.
+        if len(df_history) == 0:
+            raise ValueError(f'Energinet has no emission intensity history for {area}')
+        df_forecast = df_forecast[df_forecast.Minutes5DK >= df_history.Minutes5DK.max()].reset_index(drop=True)
+        if len(df_forecast) == 0:
+            raise ValueError(f'Energinet has no emission intensity forecast for {area} from '
+                             f'{df_history.Minutes5UTC.max()}')
         # Replace forecasted value for current time with actual time, mainly to make it simpler to produce a connected
         # graph below.
         df_forecast.iloc[0] = [df_history.Minutes5UTC.max(),
@@ -50,6 +102,106 @@ class EmissionData:
         return cls(df_history, df_forecast)
 
 
+def get_json(url, timeout=TIMEOUT):
+    """Gets JSON data from Energinet.
+
+    The response is decoded directly from the connection, rather than first being read into memory in its entirety.
+    """
+    resource = urlsplit(url).path.rsplit('/', 1)[-1]
+    with metrics.UPSTREAM_DURATION.time(resource=resource):
+        try:
+            response = session.get(url, timeout=timeout, stream=True)
+        except requests.RequestException:
+            metrics.UPSTREAM_RESPONSES.inc(resource=resource, status='error')
+            raise
+        with response:
+            metrics.UPSTREAM_RESPONSES.inc(resource=resource, status=response.status_code)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            data = json.load(response.raw)
+            # The number of bytes read from the connection, i.e. before decompression.
+            metrics.UPSTREAM_SIZE.observe(response.raw.tell(), resource=resource)
+            return data
+
+
+def download_emission_intensities(resource, start, end):
+    """Gets all emission intensities from start up to, but not including, end, as a data frame in chronological order
+    for each price area.
+
+    This is meant for downloading longer periods of history, e.g. a month at a time, so we are more patient than usual.
+    """
+    query = f'start={_format_time(start)}&end={_format_time(end)}&timezone=utc&limit=0'
+    data = get_json(f'{BASE_URL}/{resource}?{query}', timeout=(TIMEOUT[0], 120))
+    type_ = 'Målt' if resource == HISTORY_RESOURCE else 'Prognose'
+    return parse_emission_intensities(data['records'], type_)
+
+
+def _get_emission_intensities(resource, type_, query):
+    """Gets emission intensities from one of the Energinet data sets, as a data frame in chronological order for each
+    price area."""
+    data = get_json(f'{BASE_URL}/{resource}?{query}')
+    return parse_emission_intensities(data['records'], type_)
+
+
+@metrics.STAGE_DURATION.time(stage='parse')
+def parse_emission_intensities(records, type_):
+    """Turns emission intensity records, as provided by Energinet in reverse chronological order, into a data frame for
+    each price area, returned as a dictionary keyed by area.
+
+    Rather than having pandas infer types from a list of dictionaries, we build each column directly. We derive Danish
+    times from UTC times, which is both cheaper than parsing them and avoids the ambiguity of Danish times when the
+    clocks are set back.
+    """
+    records = records[::-1]
+    minutes5_utc = np.array([record['Minutes5UTC'] for record in records], dtype='datetime64[ns]')
+    co2_emission = np.fromiter((record['CO2Emission'] for record in records), dtype=np.float64, count=len(records))
+    df = _frame(minutes5_utc, co2_emission, type_)
+    rows = df.groupby(np.array([record['PriceArea'] for record in records], dtype=object)).indices
+    return {area: df.take(rows.get(area, [])).reset_index(drop=True) for area in PRICE_AREAS}
+
+
+def _frame(minutes5_utc, co2_emission, type_):
+    """Builds a data frame of emission intensities of the given type from their times (UTC) and values."""
+    minutes5_utc = pd.DatetimeIndex(minutes5_utc)
+    return pd.DataFrame({'Minutes5UTC': minutes5_utc,
+                         'Minutes5DK': minutes5_utc.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                         'CO2Emission': co2_emission,
+                         'Type': pd.Categorical([type_] * len(minutes5_utc), categories=EMISSION_TYPES)})
+
+
+def _extend_histories(histories):
+    """Adds newly available data to the given histories of each price area, while keeping their lengths fixed, and
+    returns them as data frames.
+
+    The histories are given as the times (UTC) and emission intensities of each area, which are only read from, so
+    they can be views of the cached data (see app.frames.read_history). If the new data does not connect to the given
+    histories, e.g. because they are too old, this returns None, indicating that the history should be downloaded
+    from scratch.
+    """
+    if set(histories) != set(PRICE_AREAS) or any(len(times) == 0 for times, _ in histories.values()):
+        return None
+    last = pd.Timestamp(min(times[-1] for times, _ in histories.values()))
+    if pd.Timestamp.utcnow().tz_localize(None) - last > HISTORY_LENGTH * RESOLUTION:
+        return None
+    query = f'start={_format_time(last + RESOLUTION)}&timezone=utc&limit={ROWS_PER_AREA * len(PRICE_AREAS)}'
+    new = _get_emission_intensities(HISTORY_RESOURCE, 'Målt', query)
+    extended = {}
+    for area, (times, intensities) in histories.items():
+        new_times, new_intensities = new[area].Minutes5UTC.to_numpy(), new[area].CO2Emission.to_numpy()
+        if len(new_times) > 0 and new_times[0] > times[-1] + RESOLUTION.to_timedelta64():
+            return None
+        # New measurements replace those we already have of the same times.
+        kept = times < new_times[0] if len(new_times) > 0 else slice(None)
+        times = np.concatenate([times[kept], new_times])[-HISTORY_LENGTH:]
+        intensities = np.concatenate([intensities[kept], new_intensities])[-HISTORY_LENGTH:]
+        extended[area] = _frame(times, intensities, 'Målt')
+    return extended
+
+
+def _format_time(timestamp):
+    return timestamp.strftime('%Y-%m-%dT%H:%M')
+
+
 @dataclass
 class EmissionDataQuintiles:
     """Represents quintiles of the complete data, as well as its daily averages, for the last three years."""
@@ -57,18 +209,19 @@ class EmissionDataQuintiles:
     quintiles_daily_averages: [float]
 
     @classmethod
-    def calculate(cls):
-        """Calculate the quintiles.
+    def calculate(cls, area=DEFAULT_PRICE_AREA):
+        """Calculate the quintiles for the given price area.
 
-        Note that getting all the data can take a long while.
+        Note that getting all the data can take a long while; app.distribution provides the same quintiles from the
+        local archive at no cost.
         """
         # We want three years of data or, ignoring leap years, (60/5) * 24 * 365 * 3 = 315360 data points.
         limit = 315360
-        query = f'?limit={limit}'
-        data = requests.get(f'{BASE_URL}/{HISTORY_RESOURCE}{query}').json()
-        values = np.array([x['CO2Emission'] for x in data['records']])
-        quintiles_all = np.percentile(values, [20, 40, 60, 80])
-        daily_averages = values.reshape(24, limit//24).mean(0)
+        query = f'limit={limit}&filter={json.dumps({"PriceArea": area})}'
+        data = get_json(f'{BASE_URL}/{HISTORY_RESOURCE}?{query}', timeout=(TIMEOUT[0], 600))
+        df = parse_emission_intensities(data['records'], 'Målt')[area]
+        quintiles_all = np.percentile(df.CO2Emission, [20, 40, 60, 80])
+        daily_averages = df.groupby(df.Minutes5UTC.dt.floor('D')).CO2Emission.mean()
         quintiles_daily_averages = np.percentile(daily_averages, [20, 40, 60, 80])
         return cls(quintiles_all, quintiles_daily_averages)
 
@@ -90,7 +243,7 @@ class GenerationMixData:
         # valid data, we default to using the first two rows.
         query = f'?fields={GENERATION_MIX_FIELDS}&sort={GENERATION_MIX_SORT}&limit=24'
         url = f'{BASE_URL}/{EMISSION_MIX_RESOURCE}{query}'
-        response = requests.get(url).json()
+        response = get_json(url)
         df = pd.DataFrame(response['records'])
         starting_index = 0
         for starting_index in range(0, 24, 2):
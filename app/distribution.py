@@ -0,0 +1,111 @@
+"""Keeps track of the distribution of measured emission intensities in each price area, as kept in the archive (see
+app.archive).
+
+Emission intensities are classified by how they compare to the quintiles of the last few years. Rather than going
+through years of data to compute those, we keep a histogram of each day's values, with a bin for every integer g/kWh,
+along with each day's mean. Both are stored next to the archive, and only the days touched by new data are updated.
+The quintiles of any period of whole days then follow from the sum of the histograms of its days, or, for daily means,
+from a thousand or so numbers.
+
+Days are UTC days, matching the grid of the archive.
+"""
+import os
+
+import numpy as np
+
+from . import archive
+
+# Intensities are counted in bins of 1 g/kWh from 0 up to BINS; anything higher is counted in the last bin.
+BINS = 1000
+VALUES_PER_DAY = 24 * 12
+DAY = np.timedelta64(1, 'D')
+
+# A period must have at least this fraction of its values in the archive for its quintiles to be trusted, and likewise
+# a day for its mean.
+MIN_COVERAGE = 0.9
+
+QUINTILES = [0.2, 0.4, 0.6, 0.8]
+
+
+def update(area, start=None, end=None):
+    """Updates the histograms and means of all days with data for the given price area between start and end, or of
+    the entire archive."""
+    first_day, values = read_days(area, start, end)
+    days = len(values)
+    if days == 0:
+        return
+    present = ~np.isnan(values)
+    # Count the values of all days at once, by giving each day a range of bins of its own.
+    bins = np.clip(np.nan_to_num(values), 0, BINS - 1).astype(np.int64) + np.arange(days)[:, None] * BINS
+    histograms = np.bincount(bins[present], minlength=days * BINS).reshape(days, BINS).astype(np.uint16)
+    counts = present.sum(1)
+    with np.errstate(invalid='ignore'):
+        means = np.where(counts >= MIN_COVERAGE * VALUES_PER_DAY, np.nansum(values, 1) / counts, np.nan)
+    _write_rows(_path(area, 'histograms.u2'), first_day, histograms, 0)
+    _write_rows(_path(area, 'daily-means.f4'), first_day, means.astype('<f4'), np.nan)
+
+
+def quintiles(area, years=3, daily=False, today=None):
+    """Gets the quintiles in the given price area of the last given number of years up to, but not including, today.
+
+    If daily is true, these are quintiles of the daily means rather than of the 5 minute values. If the archive does
+    not cover enough of the period, this returns None.
+    """
+    today = _day(np.datetime64('now') if today is None else today)
+    first = today - 365 * years
+    if daily:
+        means = _read_rows(_path(area, 'daily-means.f4'), '<f4', (), first, today)
+        means = means[~np.isnan(means)]
+        if len(means) < MIN_COVERAGE * 365 * years:
+            return None
+        return np.quantile(means, QUINTILES).tolist()
+    histogram = _read_rows(_path(area, 'histograms.u2'), '<u2', (BINS,), first, today).sum(0, dtype=np.int64)
+    total = histogram.sum()
+    if total < MIN_COVERAGE * 365 * years * VALUES_PER_DAY:
+        return None
+    # Interpolate within the bin holding each quintile, assuming values to be spread evenly across the bin.
+    cumulative = np.cumsum(histogram)
+    targets = np.array(QUINTILES) * total
+    indices = np.searchsorted(cumulative, targets)
+    below = np.where(indices > 0, cumulative[indices - 1], 0)
+    return (indices + (targets - below) / histogram[indices]).tolist()
+
+
+def read_days(area, start=None, end=None):
+    """Reads the measured intensities of all days with data for the given price area between start and end, or of the
+    entire archive, as the index of the first day and an array with a row for each day, padded with NaN."""
+    first_day = 0 if start is None else max(0, _day(start))
+    _, values = archive.read(archive.series(archive.MEASURED, area), first_day * DAY + archive.ARCHIVE_START,
+                             None if end is None else (_day(end) + 1) * DAY + archive.ARCHIVE_START)
+    days = len(values) // VALUES_PER_DAY + (len(values) % VALUES_PER_DAY > 0)
+    values = np.concatenate([values, np.full(days * VALUES_PER_DAY - len(values), np.nan, dtype=values.dtype)])
+    return first_day, values.reshape(days, VALUES_PER_DAY)
+
+
+def _day(time):
+    return int((np.datetime64(time, 'm') - archive.ARCHIVE_START) // DAY)
+
+
+def _path(area, name):
+    return os.path.join(archive.ARCHIVE_DIRECTORY, f'{archive.series(archive.MEASURED, area)}-{name}')
+
+
+def _read_rows(path, dtype, shape, first, last):
+    """Reads rows first up to last of a file of rows of the given dtype and shape, leaving out rows beyond its end."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty((0,) + shape, dtype=dtype)
+    rows = np.memmap(path, dtype=dtype, mode='r').reshape((-1,) + shape)
+    return rows[max(0, first):max(0, last)]
+
+
+def _write_rows(path, first, rows, fill):
+    """Writes the given rows to a file of rows, starting at row first, extending the file with fill as needed."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    row_size = rows[0].nbytes
+    length = os.path.getsize(path) // row_size if os.path.exists(path) else 0
+    if first + len(rows) > length:
+        with open(path, 'ab') as f:
+            f.write(np.full((first + len(rows) - length,) + rows.shape[1:], fill, dtype=rows.dtype).tobytes())
+    stored = np.memmap(path, dtype=rows.dtype, mode='r+').reshape((-1,) + rows.shape[1:])
+    stored[first:first + len(rows)] = rows
+    stored.flush()
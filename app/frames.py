@@ -0,0 +1,72 @@
+"""Defines the format in which emission data frames are kept in the cache.
+
+We store the history and the forecast together as a single Arrow IPC stream, history first. Reading the stream back
+does not copy the underlying buffer, and neither does slicing the table into the history and forecast. Rebuilding the
+data only needs the times and emission intensities of the history, which read_history gets as NumPy arrays that are
+views of the buffer, so nothing is copied at all. Only deserialize, which gets the complete data frames, copies the
+columns into pandas.
+
+The format is versioned: the version is part of the cache key as well as the schema metadata, so that workers running
+different versions of the code during a deploy never try to read each other's data.
+
+Reading and writing frames needs pyarrow and pandas, which workers only serving rendered responses never do, so both
+are imported on first use.
+"""
+from . import metrics
+
+FORMAT_VERSION = 1
+
+
+@metrics.STAGE_DURATION.time(stage='serialize')
+def serialize(data) -> bytes:
+    import pyarrow as pa
+
+    history = pa.Table.from_pandas(data.df_history, preserve_index=False)
+    forecast = pa.Table.from_pandas(data.df_forecast, preserve_index=False).cast(history.schema)
+    table = pa.concat_tables([history, forecast])
+    metadata = {**(table.schema.metadata or {}),
+                b'format-version': str(FORMAT_VERSION).encode(),
+                b'history-rows': str(len(data.df_history)).encode()}
+    table = table.replace_schema_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _read_table(buffer):
+    import pyarrow as pa
+
+    reader = pa.ipc.open_stream(pa.py_buffer(buffer))
+    metadata = reader.schema.metadata
+    version = int(metadata[b'format-version'])
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unsupported emission data format version {version}')
+    return reader.read_all()
+
+
+@metrics.STAGE_DURATION.time(stage='deserialize')
+def deserialize(buffer):
+    from .data import EmissionData
+
+    table = _read_table(buffer)
+    history_rows = int(table.schema.metadata[b'history-rows'])
+    df_history = table.slice(0, history_rows).to_pandas()
+    df_forecast = table.slice(history_rows).to_pandas()
+    return EmissionData(df_history, df_forecast)
+
+
+def read_history(buffer):
+    """Reads the times (UTC) and emission intensities of the history from the given buffer, as NumPy arrays which are
+    views of the buffer."""
+    table = _read_table(buffer)
+    history = table.slice(0, int(table.schema.metadata[b'history-rows']))
+    return _column(history, 'Minutes5UTC'), _column(history, 'CO2Emission')
+
+
+def _column(table, name):
+    # The history is the first record batch of the stream, and so a single chunk, which is viewed as it is. Values
+    # missing from a column are masked by Arrow, whereas NumPy needs them to be NaN, which only a copy can give.
+    column = table.column(name)
+    column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    return column.to_numpy(zero_copy_only=column.null_count == 0)
@@ -0,0 +1,177 @@
+"""Keeps hourly and daily rollups of the measured emission intensities in the archive (see app.archive), and answers
+questions about the history from them.
+
+Questions like how much greener the greenest three hours of a day were than the day as a whole, over the last 90 days,
+would otherwise mean going through tens of thousands of five minute values per request. Instead, we keep rows of
+precomputed statistics next to the archive:
+
+- for every hour, the mean, minimum and maximum intensity,
+- for every day, the same, along with the greenest and the blackest window of each length in PERIODS which lies within
+  the day, as its start and its mean intensity.
+
+Like the distribution (see app.distribution), the rows are updated whenever new data is archived, and only those of the
+days touched by the new data, so that answering a question means reading a row per hour or day asked about. Hours and
+days are UTC, matching the grid of the archive, as are all times in the answers. Statistics of hours and days without
+enough data are NaN, and left out of averages.
+"""
+import numpy as np
+
+from . import archive, distribution
+
+# The lengths of the windows we keep track of, in hours, matching the periods of the greenest period API.
+PERIODS = range(1, 7)
+
+VALUES_PER_HOUR = 12
+HOURS_PER_DAY = 24
+HOUR = np.timedelta64(1, 'h')
+DAY = distribution.DAY
+STEP_MINUTES = 5
+
+# The statistics kept for each hour and day, and for the greenest and blackest windows of each day, in this order.
+STATISTICS = ['mean', 'min', 'max']
+WINDOW_SHAPE = (len(PERIODS), 2, 2)
+
+
+def update(area, start=None, end=None):
+    """Updates the rollups of all days with data for the given price area between start and end, or of the entire
+    archive."""
+    first_day, values = distribution.read_days(area, start, end)
+    days = len(values)
+    if days == 0:
+        return
+    hourly = _statistics(values.reshape(days * HOURS_PER_DAY, VALUES_PER_HOUR))
+    daily = _statistics(values)
+    # Windows are only worth knowing for days with enough data, since otherwise the actual greenest window may be
+    # missing.
+    covered = ~np.isnan(daily[:, 0])
+    windows = np.stack([_windows(values, period * VALUES_PER_HOUR) for period in PERIODS], axis=1)
+    windows[~covered] = np.nan
+    for name, first, rows in [('hourly.f4', first_day * HOURS_PER_DAY, hourly), ('daily.f4', first_day, daily),
+                              ('windows.f4', first_day, windows)]:
+        distribution._write_rows(distribution._path(area, name), first, rows.astype('<f4'), np.nan)
+
+
+def daily(area, days, period, today=None):
+    """Gets the statistics of each of the last given number of days in the given price area, along with its greenest
+    and blackest window of the given length in hours."""
+    first, last = _days(days, today)
+    rows = _read(area, 'daily.f4', (len(STATISTICS),), first, last)
+    windows = _read(area, 'windows.f4', WINDOW_SHAPE, first, last)[:, period - 1]
+    dates = archive.ARCHIVE_START + np.arange(first, last) * DAY
+    return {'success': True,
+            'period': period,
+            'days': [{'date': str(date.astype('datetime64[D]')),
+                      **{statistic: _round(value) for statistic, value in zip(STATISTICS, row)},
+                      'greenest-start': _start(date, window[0, 0]),
+                      'greenest-intensity': _round(window[0, 1]),
+                      'blackest-start': _start(date, window[1, 0]),
+                      'blackest-intensity': _round(window[1, 1])}
+                     for date, row, window in zip(dates, rows, windows)]}
+
+
+def hourly(area, days, today=None):
+    """Gets the statistics of each hour of the last given number of days in the given price area."""
+    first, last = _days(days, today)
+    rows = _read(area, 'hourly.f4', (len(STATISTICS),), first * HOURS_PER_DAY, last * HOURS_PER_DAY)
+    hours = archive.ARCHIVE_START + first * DAY + np.arange(len(rows)) * HOUR
+    return {'success': True,
+            'hours': [{'start': _time(hour), **{statistic: _round(value) for statistic, value in zip(STATISTICS, row)}}
+                      for hour, row in zip(hours, rows)]}
+
+
+def greenest_windows(area, days, period, today=None):
+    """Sums up the greenest windows of the given length in hours of each of the last given number of days in the given
+    price area: how green they were on average, how much greener than the days as a whole, and when they started."""
+    first, last = _days(days, today)
+    means = _read(area, 'daily.f4', (len(STATISTICS),), first, last)[:, 0]
+    windows = _read(area, 'windows.f4', WINDOW_SHAPE, first, last)[:, period - 1, 0]
+    known = ~np.isnan(windows[:, 1])
+    if not known.any():
+        return {'success': False, 'error': 'There is no history for the given number of days.'}
+    means, starts, intensities = means[known], windows[known, 0], windows[known, 1]
+    start_hours = np.bincount((starts // 60).astype(int), minlength=HOURS_PER_DAY)
+    mean = float(means.mean())
+    greenest = float(intensities.mean())
+    return {'success': True,
+            'period': period,
+            'days': int(known.sum()),
+            'mean-intensity': int(round(mean)),
+            'greenest-intensity': int(round(greenest)),
+            'savings': int(round(mean - greenest)),
+            'improvement': f'{int(round(100 * (1 - greenest / mean)))} %',
+            'typical-start': f'{int(start_hours.argmax()):02d}:00',
+            'start-hours': start_hours.tolist()}
+
+
+def profile(area, days, today=None):
+    """Gets the mean intensity in the given price area by hour of the day and by day of the week, Monday first, over
+    the last given number of days."""
+    first, last = _days(days, today)
+    means = _read(area, 'hourly.f4', (len(STATISTICS),), first * HOURS_PER_DAY, last * HOURS_PER_DAY)[:, 0]
+    if np.isnan(means).all():
+        return {'success': False, 'error': 'There is no history for the given number of days.'}
+    means = np.concatenate([means, np.full((last - first) * HOURS_PER_DAY - len(means), np.nan)])
+    # 1970-01-01, from which weekdays are counted below, was a Thursday.
+    weekdays = (first + np.arange(last - first) + (archive.ARCHIVE_START.astype('datetime64[D]').astype(int) + 3)) % 7
+    by_hour = means.reshape(-1, HOURS_PER_DAY)
+    return {'success': True,
+            'hour-of-day': [_round(value) for value in _nanmean(by_hour, 0)],
+            'day-of-week': [_round(_nanmean(by_hour[weekdays == weekday])) for weekday in range(7)]}
+
+
+def _statistics(values):
+    """Gets the mean, minimum and maximum of each row of values, or NaN for rows without enough values."""
+    present = ~np.isnan(values)
+    counts = present.sum(1)
+    enough = counts >= distribution.MIN_COVERAGE * values.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(values, 1) / counts
+    minima = np.where(present, values, np.inf).min(1)
+    maxima = np.where(present, values, -np.inf).max(1)
+    return np.where(enough[:, None], np.stack([means, minima, maxima], axis=1), np.nan)
+
+
+def _windows(values, length):
+    """Finds the greenest and blackest windows of the given number of values in each row of values, as the minute of
+    the day at which they start and their mean, leaving out windows with missing values."""
+    present = ~np.isnan(values)
+    sums = np.cumsum(np.pad(np.where(present, values, 0).astype(np.float64), ((0, 0), (1, 0))), axis=1)
+    counts = np.cumsum(np.pad(present, ((0, 0), (1, 0))), axis=1)
+    complete = counts[:, length:] - counts[:, :-length] == length
+    means = (sums[:, length:] - sums[:, :-length]) / length
+    windows = np.full((len(values), 2, 2), np.nan)
+    rows = complete.any(1)
+    for i, (masked, pick) in enumerate([(np.inf, np.argmin), (-np.inf, np.argmax)]):
+        starts = pick(np.where(complete, means, masked), axis=1)
+        windows[rows, i, 0] = starts[rows] * STEP_MINUTES
+        windows[rows, i, 1] = means[rows, starts[rows]]
+    return windows
+
+
+def _days(days, today):
+    """Gets the first and last days, the latter not included, of the given number of days up to, but not including,
+    today."""
+    today = distribution._day(np.datetime64('now') if today is None else today)
+    return max(0, today - days), today
+
+
+def _read(area, name, shape, first, last):
+    return distribution._read_rows(distribution._path(area, name), '<f4', shape, first, last)
+
+
+def _nanmean(values, axis=None):
+    present = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(present, values, 0).sum(axis) / present.sum(axis)
+
+
+def _round(value):
+    return None if np.isnan(value) else round(float(value), 1)
+
+
+def _start(date, minute):
+    return None if np.isnan(minute) else _time(date + np.timedelta64(int(minute), 'm'))
+
+
+def _time(time):
+    return f'{time.astype("datetime64[m]")}Z'
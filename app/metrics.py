@@ -0,0 +1,177 @@
+"""Collects metrics on how the app spends its time, and exports them in Prometheus' text format on /metrics.
+
+We keep track of how long each stage of building data takes, how the cache is doing, how long requests wait for
+somebody else to build data, what Energinet sends us, and how long requests take to serve, by route.
+
+Every worker, as well as the refresher, counts on its own in memory, which costs next to nothing, and adds its counts
+to totals kept in Redis every FLUSH_INTERVAL seconds. Whichever worker is scraped then reports the totals of all
+processes, so Prometheus sees the app as a whole. Counts reach Redis with a delay of at most FLUSH_INTERVAL, apart from
+those of the scraped worker, which flushes first. If Redis is restarted, all counters start over, which Prometheus
+treats like the restart of a process.
+"""
+import bisect
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# Every process adds its counts to Redis this often, in seconds.
+FLUSH_INTERVAL = 10
+
+# Metrics are kept in Redis in a hash per metric, under this prefix.
+REDIS_PREFIX = 'metrics:'
+
+# The boundaries of the buckets of durations, in seconds, from quick cache reads up to slow downloads.
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [1e3, 1e4, 1e5, 1e6, 1e7, 1e8]
+
+
+class _Registry:
+    """The counts of the current process which have yet to be added to Redis."""
+
+    def __init__(self):
+        self.metrics = []
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def add(self, metric, field, amount):
+        with self.lock:
+            key = (metric.name, field)
+            self.pending[key] = self.pending.get(key, 0) + amount
+            # Threads do not survive forking, so every worker starts a flusher of its own.
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._flush_periodically, daemon=True)
+                self.thread.start()
+
+    def flush(self):
+        from .cache import redis_client
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        pipeline = redis_client.pipeline(transaction=False)
+        for (name, field), amount in pending.items():
+            if isinstance(amount, float):
+                pipeline.hincrbyfloat(REDIS_PREFIX + name, field, amount)
+            else:
+                pipeline.hincrby(REDIS_PREFIX + name, field, amount)
+        try:
+            pipeline.execute()
+        except Exception:
+            # Keep the counts for the next attempt rather than lose them.
+            with self.lock:
+                for key, amount in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + amount
+            raise
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+
+registry = _Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        registry.metrics.append(self)
+
+    def _labels(self, labels):
+        return ','.join(f'{label}="{labels[label]}"' for label in self.labels)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        registry.add(self, self._labels(labels), amount)
+
+    def _samples(self, totals):
+        for labels, value in sorted(totals.items()):
+            yield self.name, labels, value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        # Each bucket is counted on its own, and only made cumulative on export.
+        registry.add(self, f'{labels}|{bisect.bisect_left(self.buckets, value)}', 1)
+        registry.add(self, f'{labels}|sum', float(value))
+
+    @contextmanager
+    def time(self, **labels):
+        """Times the enclosed block, or, used as a decorator, every call of the decorated function."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, totals):
+        series = {}
+        for field, value in totals.items():
+            labels, _, key = field.rpartition('|')
+            series.setdefault(labels, {})[key] = value
+        for labels, values in sorted(series.items()):
+            separator = ',' if labels else ''
+            cumulative = 0
+            for i, bound in enumerate(self.buckets + ['+Inf']):
+                cumulative += values.get(str(i), 0)
+                yield f'{self.name}_bucket', f'{labels}{separator}le="{bound}"', cumulative
+            yield f'{self.name}_sum', labels, values.get('sum', 0)
+            yield f'{self.name}_count', labels, cumulative
+
+
+STAGE_DURATION = Histogram('gsweb_stage_duration_seconds', 'Time spent in each stage of building data.',
+                           ['stage'])
+CACHE_LOOKUPS = Counter('gsweb_cache_lookups_total',
+                        'Cache lookups by dataset and result: found in the memory of the worker (local), found in '
+                        'Redis (hit), missing (miss), or found but stale (stale).', ['dataset', 'result'])
+LOCK_WAIT_DURATION = Histogram('gsweb_lock_wait_seconds',
+                               'Time requests spent waiting for somebody else to build missing data.', ['dataset'])
+LOCK_WAIT_TIMEOUTS = Counter('gsweb_lock_wait_timeouts_total',
+                             'Requests which gave up waiting for somebody else to build missing data.', ['dataset'])
+UPSTREAM_RESPONSES = Counter('gsweb_upstream_responses_total',
+                             'Responses from Energinet by data set and status code.', ['resource', 'status'])
+UPSTREAM_DURATION = Histogram('gsweb_upstream_duration_seconds',
+                              'Time spent getting and decoding data from Energinet, by data set.', ['resource'])
+UPSTREAM_SIZE = Histogram('gsweb_upstream_response_bytes',
+                          'Size of responses from Energinet as transferred, by data set.', ['resource'], SIZE_BUCKETS)
+REQUEST_DURATION = Histogram('gsweb_request_duration_seconds', 'Time spent serving requests, by route.',
+                             ['route'])
+
+
+def export():
+    """Gets the totals of all processes in Prometheus' text format."""
+    from .cache import redis_client
+    registry.flush()
+    pipeline = redis_client.pipeline(transaction=False)
+    for metric in registry.metrics:
+        pipeline.hgetall(REDIS_PREFIX + metric.name)
+    lines = []
+    for metric, totals in zip(registry.metrics, pipeline.execute()):
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        totals = {field.decode(): float(value) for field, value in totals.items()}
+        for name, labels, value in metric._samples(totals):
+            lines.append(f'{name}{{{labels}}} {value!r}' if labels else f'{name} {value!r}')
+    return '\n'.join(lines) + '\n'
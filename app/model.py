@@ -1,8 +1,9 @@
 """Contains the model (in the MVC sense) of the data presented in the web app.
 
-In particular, this provides all post-processing of Energinet's data.
+In particular, this provides all post-processing of Energinet's data. It needs altair and pandas, which are slow to
+import and take up a lot of memory, so only the refresher and requests for plots import it. What requests need of the
+forecast, i.e. the greenest and blackest windows, is in app.windows.
 """
-import datetime
 import math
 from bisect import bisect
 from collections import namedtuple
@@ -11,13 +12,17 @@ import altair as alt
 import numpy as np
 import pandas as pd
 
+from . import metrics
+from .areas import COMBINED_PRICE_AREA, GENERATION_MIX_AREAS
 from .data import EmissionData, GenerationMixData
+from .windows import ForecastWindows, _quintile_bounds
 
 
 class EmissionIntensityModel:
 
-    def __init__(self):
-        self.data = EmissionData.build()
+    def __init__(self, data: EmissionData, quintiles=None):
+        self.data = data
+        self.quintiles = _quintile_bounds(quintiles)
         self.forecast_length_hours = math.ceil(len(self.data.df_forecast) / 12)
         self.df = pd.concat([self.data.df_history, self.data.df_forecast])
         self.now_utc_int = self.data.df_history.Minutes5UTC.astype(int).max() / 1000000
@@ -26,11 +31,6 @@ class EmissionIntensityModel:
         self.now = self.data.df_history.Minutes5DK.max()
         self.current_emission = int(self.data.df_forecast.iloc[0].CO2Emission)
 
-    # Hardcoded quintiles of data distribution. These can be obtained through EmissionDataQuintiles,
-    # but doing so takes so long that we'll want to cache the result (and hardcoding them is easier
-    # than obtaining them from storage).
-    quintiles = [0, 68, 112, 158, 227, 1000]
-
     def plot(self):
         df_combined = self.df
         m = self.now_utc_int
@@ -98,30 +98,41 @@ class EmissionIntensityModel:
         )
 
 
-def get_greenest(df_forecast, period: int, horizon: int):
-    return get_extreme(df_forecast, period, horizon, False)
-
-
-def get_blackest(df_forecast, period: int, horizon: int):
-    return get_extreme(df_forecast, period, horizon, True)
-
-
-def get_extreme(df_forecast, period: int, horizon: int, idxmax: bool):
-    """Given forecast data, determines the greenest/blackest period of a given length in the given horizon."""
-    df_next_day = df_forecast[df_forecast.Minutes5UTC < df_forecast.Minutes5UTC.min() + pd.Timedelta(f'{horizon}H')]
-    min_periods = period * 12
-    rolling = df_next_day.set_index('Minutes5DK').CO2Emission\
-                         .rolling(f'{period}H', min_periods=min_periods).mean()[min_periods-1:]
-    lowest = rolling.idxmax() if idxmax else rolling.idxmin()
-    lowest_mean = rolling.loc[lowest]
-    lowest_interval_start = lowest - pd.Timedelta(f'{period}H') + pd.Timedelta('5m')
-    lowest_interval_end = lowest + pd.Timedelta('5m')
-    return lowest_mean, lowest_interval_start, lowest_interval_end
-
-
-def build_model():
-    model = EmissionIntensityModel()
-    full_chart = model.plot()
+@metrics.STAGE_DURATION.time(stage='model')
+def build_model(data: EmissionData, quintiles=None):
+    """Builds the emission intensity model of the given data, returning a compact description of it, along with the
+    greenest and blackest windows of the forecast.
+
+    The intensities are classified by the given quintiles of the data distribution, if known.
+
+    Rather than a full plot specification, the description contains only the data needed to fill in the static chart
+    template in static/charts/emission-intensity.json.
+    """
+    model = EmissionIntensityModel(data, quintiles)
+    # Convert the times to milliseconds since the epoch, and the intensities to integers, making for a compact payload.
+    times = pd.concat([model.data.df_history.Minutes5UTC, model.data.df_forecast.Minutes5UTC])
+    intensities = model.df.CO2Emission.round().astype(int)
+    now = int(model.now_utc_int)
+    max_time = int(times.max().value // 1000000)
+    emission_intensity = {**_emission_intensity_summary(model),
+                          'times': (times.astype('int64') // 1000000).tolist(),
+                          'intensities': intensities.tolist(),
+                          'forecast-start': len(model.data.df_history),
+                          'now': now,
+                          'selection': [now - 3600 * 1000 * 12, min(now + 3600 * 1000 * 12, max_time)],
+                          'plot-height': max(250, int(model.df.CO2Emission.max()) + 25),
+                          'quintiles': model.quintiles}
+    return emission_intensity, ForecastWindows.build(model.data.df_forecast)
+
+
+@metrics.STAGE_DURATION.time(stage='emission-intensity-plot')
+def build_model_with_plot(data: EmissionData, quintiles=None):
+    """Describes the emission intensity model with a full plot specification, as in the first version of the API."""
+    model = EmissionIntensityModel(data, quintiles)
+    return {**_emission_intensity_summary(model), 'plot-data': model.plot().to_dict()}
+
+
+def _emission_intensity_summary(model: EmissionIntensityModel):
     latest_data = model.now.strftime('%Y-%m-%d %H:%M')
     current_emission = model.current_emission
     quintiles = model.quintiles
@@ -130,16 +141,14 @@ def build_model():
     border_colors = [f'rgba(0, {i+64}, 0, 0.9)' for i in range(128, 0, -32)] + ['#333']
     fg_colors = ['#FFF', '#FFF', '#EEE', '#EEE', '#EEE']
     levels = ['MEGET GRØN', 'GRØN', 'BÅDE GRØN OG SORT', 'PRIMÆRT SORT', 'KULSORT']
-    emission_intensity = {'success': True,
-                          'current-intensity': current_emission,
-                          'intensity-level-bgcolor': bg_colors[index],
-                          'intensity-level-fgcolor': fg_colors[index],
-                          'intensity-level-border-color': border_colors[index],
-                          'intensity-level': levels[index],
-                          'forecast-length-hours': model.forecast_length_hours,
-                          'latest-data': latest_data,
-                          'plot-data': full_chart.to_dict()}
-    return emission_intensity, model.data.df_forecast
+    return {'success': True,
+            'current-intensity': current_emission,
+            'intensity-level-bgcolor': bg_colors[index],
+            'intensity-level-fgcolor': fg_colors[index],
+            'intensity-level-border-color': border_colors[index],
+            'intensity-level': levels[index],
+            'forecast-length-hours': model.forecast_length_hours,
+            'latest-data': latest_data}
 
 
 # We explicitly keep track of all energy types that can appear in Energinet generation mix data.
@@ -163,36 +172,36 @@ class GenerationMixModel:
     RENEWABLE_ENERGY_STR = 'Vedvarende energi'
     NON_RENEWABLE_ENERGY_STR = 'Ikke-vedvarende energi'
 
-    def __init__(self):
-        df_mix = GenerationMixData.build().df_mix
-        # Energy sources with no generation are representated by NaNs; get rid of those, and combine the results for DK1
-        # and DK2. If CO2 forecasts are ever split over DK1/DK2, we can treat the two separately here as well.
-        total = df_mix.fillna(0).sum()
+    def __init__(self, data: GenerationMixData, area=COMBINED_PRICE_AREA):
+        df_mix = data.df_mix
+        if area != COMBINED_PRICE_AREA:
+            df_mix = df_mix[df_mix.PriceArea == area]
         # df_mix contains two rows representing the current time for each region; the times will always be the same, and
         # we can just take one of them. The format is almost what we want, so we parse it as a string rather than rely
         # on datetime libraries.
         self.data_time = df_mix.TimeDK.iloc[0].replace('T', ' ')[:-3]
-        df_total = pd.DataFrame(total).reset_index()
-        df_total.columns = ['type', 'production_mw']
-        # Remove exchange data from the data frame by only focussing on the hardcoded energy types; exchanges will be
-        # included in import/export calculations later.
-        self.data = df_total[df_total.type.isin(energy_types)]
+        # Only focus on the hardcoded energy types; exchanges will be included in import/export calculations later.
+        # Energy sources with no generation are representated by NaNs; get rid of those, and combine the results for DK1
+        # and DK2, unless we only have one of them.
+        types = [column for column in df_mix.columns if column in energy_types]
         # Force production values to be floating points to avoid potential issues with attempting to serialize int64s
-        self.data['production_mw'] = self.data['production_mw'].astype(np.float64)
-        self.data['danish_name'] = self.data.type.map(lambda x: energy_types[x].danish_name)
-        self.data['renewable'] = self.data.type.map(lambda x: energy_types[x].renewable)
-        self.total_prod = self.data.production_mw.sum()
+        production_mw = df_mix[types].fillna(0).sum().to_numpy(dtype=np.float64)
+        renewable = np.array([energy_types[t].renewable for t in types], dtype=bool)
+        self.total_prod = production_mw.sum()
         # Explicitly define the share percentage string. It would be nicer if our plotting framework could do this for
         # us, so we could keep the logic closer to the view, and indeed d3.js can automatically handle percentages, but
         # not without changing decimal points.
-        self.data['share'] =\
-            (self.data.production_mw / self.total_prod * 100).map('{:.2f} %'.format).str.replace('.', ',')
-        self.data['renewable_desc_str'] =\
-            self.data.renewable.map(lambda x: self.RENEWABLE_ENERGY_STR if x else self.NON_RENEWABLE_ENERGY_STR)
-        self.data['is_renewable_str'] = self.data.renewable.map(lambda x: 'Ja' if x else 'Nej')
-        self.data['production_str'] = self.data.production_mw.map('{:.2f} MW'.format).str.replace('.', ',')
+        self.data = pd.DataFrame({
+            'type': types,
+            'production_mw': production_mw,
+            'danish_name': [energy_types[t].danish_name for t in types],
+            'renewable': renewable,
+            'share': np.char.replace(np.char.mod('%.2f %%', production_mw / self.total_prod * 100), '.', ','),
+            'renewable_desc_str': np.where(renewable, self.RENEWABLE_ENERGY_STR, self.NON_RENEWABLE_ENERGY_STR),
+            'is_renewable_str': np.where(renewable, 'Ja', 'Nej'),
+            'production_str': np.char.replace(np.char.mod('%.2f MW', production_mw), '.', ',')})
         # Calculate import and export across each link separately; the double sum comes as a result of summing over all
-        # rows (i.e. regions, DK1/DK2) and all columns (i.e. import/export destinations) at the same time.
+        # rows (i.e. regions, DK1/DK2, if combined) and all columns (i.e. import/export destinations) at the same time.
         exchanges = df_mix[['ExchangeGermany', 'ExchangeSweden', 'ExchangeNorway', 'ExchangeNetherlands', 'ExchangeGreatBritain']]
         self.imp = round(exchanges[exchanges > 0].sum().sum())
         self.exp = round(-exchanges[exchanges < 0].sum().sum())
@@ -231,68 +240,37 @@ class GenerationMixModel:
         )
 
 
+@metrics.STAGE_DURATION.time(stage='generation-mix')
 def build_current_generation_mix():
-    model = GenerationMixModel()
+    """Builds the generation mix model of every price area, and of the areas combined, returning a compact description
+    of each, keyed by area, along with the underlying data.
+
+    Like for the emission intensities, the descriptions contain only the data needed to fill in the static chart
+    template in static/charts/generation-mix.json.
+    """
+    data = GenerationMixData.build()
+    descriptions = {}
+    for area in GENERATION_MIX_AREAS:
+        model = GenerationMixModel(data, area)
+        descriptions[area] = {**_generation_mix_summary(model),
+                              'data-time': model.data_time,
+                              'names': model.data.danish_name.tolist(),
+                              'production': model.data.production_mw.round(2).tolist(),
+                              'renewable': model.data.renewable.tolist()}
+    return descriptions, data
+
+
+@metrics.STAGE_DURATION.time(stage='generation-mix-plot')
+def build_current_generation_mix_with_plot(data: GenerationMixData, area=COMBINED_PRICE_AREA):
+    """Describes the generation mix with a full plot specification, as in the first version of the API."""
+    model = GenerationMixModel(data, area)
+    return {**_generation_mix_summary(model), 'plot-data': model.plot().to_dict()}
+
+
+def _generation_mix_summary(model: GenerationMixModel):
     # We explicitly convert our import and export values to Python integers to avoid the possibility of them ending
     # up as np.int64, which can not be serialized to JSON.
     return {'success': True,
-            'plot-data': model.plot().to_dict(),
             'total-production': round(model.total_prod),
             'import': int(round(model.imp)),
             'export': int(round(model.exp))}
-
-
-def current_period_emission(df_forecast, period):
-    return int(round(df_forecast.iloc[:12*period].CO2Emission.mean()))
-
-
-def best_period(df_forecast, period, horizon):
-    lowest_mean, lowest_interval_start, lowest_interval_end = get_greenest(df_forecast, period, horizon)
-    best_period_start = f'{lowest_interval_start.strftime("%H:%M")}'
-    best_period_end = f'{lowest_interval_end.strftime("%H:%M")}'
-    best_period_intensity = int(round(lowest_mean))
-    current = current_period_emission(df_forecast, period)
-    improvement = f'{int(round(100*(1 - best_period_intensity/current)))} %'
-    return {'success': True,
-            'current-intensity': current,
-            'improvement': improvement,
-            'best-period-start': best_period_start,
-            'best-period-end': best_period_end,
-            'best-period-intensity': best_period_intensity}
-
-
-def overview_next_day(df_forecast, short_title: bool = False):
-    period = 3
-    horizon = 24
-
-    mean = df_forecast[df_forecast.Minutes5UTC < df_forecast.Minutes5UTC.min() + pd.Timedelta(f'{horizon}H')]\
-        .CO2Emission.mean()
-    lowest_mean, lowest_interval_start, lowest_interval_end = get_greenest(df_forecast, period, horizon)
-    best_hour_start = f'{lowest_interval_start.strftime("%H:%M")}'
-    best_hour_end = f'{lowest_interval_end.strftime("%H:%M")}'
-    if lowest_interval_start.day != df_forecast.Minutes5UTC.min().day:
-        best_hour_end += ' i morgen'
-    best_hour_intensity = int(round(lowest_mean))
-    highest_mean, highest_interval_start, highest_interval_end = get_blackest(df_forecast, period, horizon)
-    worst_hour_start = f'{highest_interval_start.strftime("%H:%M")}'
-    worst_hour_end = f'{highest_interval_end.strftime("%H:%M")}'
-    if highest_interval_start.day != df_forecast.Minutes5UTC.min().day:
-        worst_hour_end += ' i morgen'
-    worst_hour_intensity = int(round(highest_mean))
-
-    q = EmissionIntensityModel.quintiles
-    index = bisect(q, mean) - 1
-    if short_title:
-        colors = ['Meget grøn 💚', 'Grøn 💚', 'Grøn og sort', 'Sort 🏭', 'Kulsort 🏭']
-        general_color = colors[index]
-        # New forecasts arrive around 16:00, so we change our title message accordingly.
-        prefix = 'i dag' if datetime.datetime.now().hour < 16 else 'det næste døgn'
-        title = f'Strømmen {prefix}: {general_color}'
-    else:
-        colors = ['meget grøn 💚', 'grøn 💚', 'både grøn og sort', 'ret sort 🏭', 'kulsort 🏭']
-        general_color = colors[index]
-        forecast_length = min(horizon, math.ceil(len(df_forecast) / 12))
-        title = f'De næste {forecast_length} timer er strømmen generelt {general_color}'
-    message = f'🟢 Grønnest: {best_hour_start}-{best_hour_end} ({best_hour_intensity} g CO2/kWh).\n' +\
-        f'⚫ Sortest: {worst_hour_start}-{worst_hour_end} ({worst_hour_intensity} g CO2/kWh).'
-    return {'title': title, 'message': message}
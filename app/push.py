@@ -2,49 +2,183 @@
 
 For progressive web apps, all push notifications are represented
 through subscription info objects. When subscribing to push notifications,
-we receive such an object, and store it an sqlite database.
+we receive such an object, and store it in an sqlite database (see
+app.subscriptions).
+
+Once a day, the overview of the next day is sent to all subscribers (see
+send_daily_overview). There can be thousands of subscribers, and every push
+service takes a while to answer, so notifications are sent in parallel.
+
+pywebpush pulls in aiohttp and cryptography, which the workers serving
+requests only need when somebody subscribes, so it is imported on first use.
 """
 import json
 import os
-import sqlite3
-
-import pywebpush
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from urllib.parse import urlsplit
 
-DB_PATH = '/data/subs.db'
+from . import subscriptions
+from .cache import get_next_day_response
 
+# The VAPID private key matching the public key in main.js is provided through the environment, as VAPID_PRIVATE_KEY,
+# along with VAPID_SUBJECT, the mailto: or https: address which push services can use to reach us in case of trouble.
 
-def _execute_sql(sql, args):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(sql, args)
-        conn.commit()
-    finally:
-        if conn:
-            conn.close()
+# VAPID signatures may be valid for at most 24 hours. We sign for 12 hours, and renew signatures well before expiry.
+VAPID_EXPIRY = 12 * 60 * 60
+VAPID_RENEWAL_MARGIN = 60 * 60
 
+# The number of notifications sent concurrently, and how long to wait for each push service.
+PUSH_WORKERS = 32
+PUSH_TIMEOUT = (3.05, 10)
 
-def _ensure_db_exists():
-    db_exists = os.path.exists(DB_PATH)
-    if not db_exists:
-        _execute_sql('CREATE TABLE subs (sub text)', [])
+# How long a push service should hold on to the notification if the subscriber is offline. The overview is of no use
+# the day after.
+PUSH_TTL = 12 * 60 * 60
 
 
 def save_subscription(data):
-    _ensure_db_exists()
     _validate_subscription_info(data)
-    _execute_sql('INSERT INTO subs (sub) VALUES (?)', (data,))
+    subscriptions.save(data)
 
 
 def remove_subscription(data):
-    _ensure_db_exists()
     _validate_subscription_info(data)
-    _execute_sql('DELETE FROM subs WHERE sub = ?', (data,))
+    subscriptions.remove(data)
 
 
 def _validate_subscription_info(data):
     """Checks whether or not a string representing subscription info is valid"""
+    import pywebpush
+
     subscription_info = json.loads(data)
     # We exploit the fact that pywebpush.WebPusher validates the data on initialization; we don't actually use
     # pywebpush for any of its real functionality here.
     pywebpush.WebPusher(subscription_info)
+
+
+def send_daily_overview():
+    """Sends the overview of the next day to all subscribers."""
+    # The overview is the same for everybody, and already rendered in the cache.
+    from py_vapid import Vapid02
+
+    payload = get_next_day_response(short_title=True).value.body
+    vapid = Vapid02.from_string(os.environ['VAPID_PRIVATE_KEY'])
+    return send_notifications(payload, vapid, os.environ['VAPID_SUBJECT'])
+
+
+@dataclass
+class PushStats:
+    """Summarizes the result of sending a notification to all subscribers."""
+    sent: int = 0
+    failed: int = 0
+    removed: int = 0
+    seconds: float = 0
+
+    @property
+    def throughput(self):
+        """The number of notifications handled per second."""
+        return (self.sent + self.failed + self.removed) / self.seconds if self.seconds else 0
+
+
+class _VapidSigner:
+    """Creates VAPID headers, reusing them for all endpoints of the same push service until they are close to expiry.
+
+    Unlike the encryption of the payload, which is specific to each subscription, the signature only depends on the
+    audience of the claims, i.e. the origin of the push service, so a single signature covers all of its subscriptions.
+    """
+
+    def __init__(self, vapid, subject):
+        self.vapid = vapid
+        self.subject = subject
+        self.headers = {}
+        self.lock = threading.Lock()
+
+    def headers_for(self, audience):
+        now = time.time()
+        with self.lock:
+            cached = self.headers.get(audience)
+            if cached is None or cached[1] - VAPID_RENEWAL_MARGIN < now:
+                expires = int(now) + VAPID_EXPIRY
+                claims = {'sub': self.subject, 'aud': audience, 'exp': expires}
+                cached = self.vapid.sign(claims), expires
+                self.headers[audience] = cached
+            return cached[0]
+
+
+class _Sessions:
+    """Keeps a pooled HTTP session per push service, so that connections are reused across subscriptions."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, origin):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self.lock:
+            session = self.sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PUSH_WORKERS)
+                session.mount(origin, adapter)
+                self.sessions[origin] = session
+            return session
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+
+
+def send_notifications(payload, vapid, subject):
+    """Sends the given payload to all subscribers, signing with the given py_vapid key on behalf of subject.
+
+    Subscriptions which the push service reports as gone are removed. Failures are otherwise only counted; a
+    subscription which fails today might well work tomorrow.
+    """
+    import pywebpush
+
+    signer = _VapidSigner(vapid, subject)
+    sessions = _Sessions()
+    stats = PushStats()
+    start = time.time()
+
+    def send(row):
+        subscription_id, data = row
+        subscription_info = json.loads(data)
+        endpoint = urlsplit(subscription_info['endpoint'])
+        origin = f'{endpoint.scheme}://{endpoint.netloc}'
+        pusher = pywebpush.WebPusher(subscription_info, requests_session=sessions.get(origin))
+        response = pusher.send(payload, signer.headers_for(origin), ttl=PUSH_TTL, timeout=PUSH_TIMEOUT)
+        return subscription_id, response.status_code
+
+    # We go through the subscriptions a chunk at a time, so that we never hold more than a chunk in memory.
+    try:
+        with ThreadPoolExecutor(max_workers=PUSH_WORKERS) as executor:
+            for chunk in subscriptions.chunks():
+                gone = []
+                for future in as_completed([executor.submit(send, row) for row in chunk]):
+                    try:
+                        subscription_id, status = future.result()
+                    except Exception:
+                        traceback.print_exc()
+                        stats.failed += 1
+                        continue
+                    if status in (404, 410):
+                        gone.append(subscription_id)
+                    elif status < 300:
+                        stats.sent += 1
+                    else:
+                        stats.failed += 1
+                subscriptions.remove_ids(gone)
+                stats.removed += len(gone)
+    finally:
+        sessions.close()
+
+    stats.seconds = time.time() - start
+    return stats
+
@@ -0,0 +1,53 @@
+"""Keeps the web application cache warm.
+
+Rather than having an unlucky request rebuild the model whenever a cache entry expires, we run a separate refresher
+process (`python -m app refresh`) that rebuilds every cached item some time before it is due to expire. Each item is
+refreshed on its own cadence, determined by its cache timeout.
+"""
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable
+
+from .cache import (EMISSION_INTENSITY_TIMEOUT, GENERATION_MIX_TIMEOUT, refresh_generation_mix,
+                    refresh_model)
+
+# We rebuild items this many seconds before they expire. Rebuilding the emission intensity model takes a few seconds at
+# most, so a minute leaves plenty of room for a slow response from Energinet.
+REFRESH_MARGIN = 60
+
+# If a rebuild fails, e.g. because Energinet is unavailable, we try again after this many seconds. Since we refresh
+# ahead of expiry, the cache will generally still contain usable data in the meantime.
+RETRY_INTERVAL = 15
+
+
+@dataclass
+class RefreshJob:
+    name: str
+    refresh: Callable[[], None]
+    interval: float
+    next_run: float = 0
+
+    def run(self):
+        try:
+            self.refresh()
+            self.next_run = time.time() + self.interval
+        except Exception:
+            traceback.print_exc()
+            self.next_run = time.time() + RETRY_INTERVAL
+
+
+def build_jobs():
+    return [RefreshJob('emission-intensity', refresh_model, EMISSION_INTENSITY_TIMEOUT - REFRESH_MARGIN),
+            RefreshJob('generation-mix', refresh_generation_mix, GENERATION_MIX_TIMEOUT - REFRESH_MARGIN)]
+
+
+def run(jobs=None):
+    """Runs all refresh jobs forever, each one as soon as it is due."""
+    jobs = jobs or build_jobs()
+    while True:
+        now = time.time()
+        for job in jobs:
+            if job.next_run <= now:
+                job.run()
+        time.sleep(max(0, min(job.next_run for job in jobs) - time.time()))
@@ -0,0 +1,85 @@
+"""Precomputed JSON responses.
+
+Most of the API returns the same data to everybody until the underlying model is rebuilt, so rather than encoding and
+compressing the data for every request, we do so once per model version, keep the result in the cache, and serve the
+bytes directly. Since every client polls the API regularly, we also support conditional requests: a client which
+already has the current version of a response only gets a 304 back.
+"""
+import gzip
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+
+from flask import Response, request
+from werkzeug.http import parse_accept_header, parse_etags
+
+from . import metrics
+
+# Brotli compresses our JSON noticeably better than gzip, but we can do without it.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@dataclass
+class RenderedResponse:
+    """The body of a JSON response, along with its compressed variants."""
+    body: bytes
+    etag: str
+    gzip: bytes
+    br: bytes = None
+
+    def encodings(self):
+        return ['br', 'gzip'] if self.br is not None else ['gzip']
+
+
+# Responses rendered once per version are compressed as well as we can. Responses rendered for a single request are not
+# worth spending more time on compressing than it saves on sending them.
+BROTLI_QUALITY = 11
+GZIP_LEVEL = 9
+FAST_BROTLI_QUALITY = 4
+FAST_GZIP_LEVEL = 1
+
+
+@metrics.STAGE_DURATION.time(stage='render')
+def render(value, fast=False):
+    body = json.dumps(value, separators=(',', ':')).encode()
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    quality, level = (FAST_BROTLI_QUALITY, FAST_GZIP_LEVEL) if fast else (BROTLI_QUALITY, GZIP_LEVEL)
+    br = brotli.compress(body, quality=quality) if brotli is not None else None
+    return RenderedResponse(body, etag, gzip.compress(body, compresslevel=level), br)
+
+
+def serve(rendered, fresh_until):
+    """Creates a response for the current request from a rendered response which is fresh until the given time.
+
+    Clients are allowed to cache the response for as long as it remains fresh.
+    """
+    status, body, headers = negotiate(rendered, fresh_until, request.headers.get('Accept-Encoding'),
+                                      request.headers.get('If-None-Match'))
+    if body is None:
+        return Response(status=status, headers=headers)
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+
+def negotiate(rendered, fresh_until, accept_encoding, if_none_match):
+    """Picks the representation of a rendered response to serve to a request with the given Accept-Encoding and
+    If-None-Match headers, either of which may be None.
+
+    This returns the status, the body, which is None for a 304, and the headers of the response, independently of any
+    web framework, so that it serves both the WSGI and the ASGI app (see app.asgi).
+    """
+    encoding = parse_accept_header(accept_encoding).best_match(rendered.encodings())
+    # Strong validators must differ between representations, so the ETag depends on the encoding.
+    etag = f'{rendered.etag}-{encoding}' if encoding else rendered.etag
+    headers = {'ETag': f'"{etag}"',
+               'Cache-Control': f'public, max-age={max(0, int(fresh_until - time.time()))}',
+               'Vary': 'Accept-Encoding'}
+    if parse_etags(if_none_match).contains_weak(etag):
+        return 304, None, headers
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        return 200, rendered.br if encoding == 'br' else rendered.gzip, headers
+    return 200, rendered.body, headers
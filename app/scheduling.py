@@ -0,0 +1,204 @@
+"""Finds the greenest time to run each of a batch of flexible loads, e.g. charging an electric car or running a heat
+pump, within the forecast.
+
+A job is given by its duration in minutes, the earliest time at which it may start, the time by which it must be done,
+and optionally its power draw in kW for each five minute step of its duration. Rather than going through the jobs one
+by one, all jobs are evaluated against the forecast at once:
+
+- For jobs without a profile, the mean intensity of a job starting at any given point follows from the prefix sums of
+  the forecast, which app.windows.ForecastWindows keeps anyway. The means for every job and every start are computed as
+  a single matrix of jobs by starts.
+- For jobs with a profile, the emissions of a job starting at any given point are the correlation of the forecast with
+  the profile. Jobs of the same duration are evaluated at once, as the product of the matrix of all windows of the
+  forecast of that duration with the matrix of their profiles.
+
+Either way, a batch costs a few array operations rather than a loop over jobs, so that scheduling a thousand jobs takes
+about as long as scheduling one. Jobs are only ever scheduled within the forecast; those which do not fit are answered
+with an error of their own, so that one job does not fail the whole batch.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+MAX_JOBS = 1000
+STEP = np.timedelta64(5, 'm')
+STEP_MINUTES = 5
+
+# Bounds on what a job may ask for, well beyond any forecast and any load, so that the arithmetic below cannot overflow:
+# the duration in minutes, the range of its times, and its power draw in kW.
+MAX_DURATION = 7 * 24 * 60
+TIME_RANGE = (np.datetime64('2000-01-01T00:00', 'm'), np.datetime64('2100-01-01T00:00', 'm'))
+MAX_POWER = 1e6
+
+
+@dataclass
+class Jobs:
+    """A batch of jobs, as arrays with an element for each job, times being on a grid of minutes."""
+    ids: list
+    # The duration of each job, in steps of five minutes.
+    lengths: np.ndarray
+    earliest_starts: np.ndarray
+    deadlines: np.ndarray
+    # The power draw of each job for each step of its duration, or None if it is constant.
+    profiles: list
+
+
+def parse_jobs(data, now=None):
+    """Parses the jobs of the body of a scheduling request, raising ValueError with a message for the user if they are
+    invalid.
+
+    Jobs may leave out their earliest start, in which case they may start now, and their deadline, in which case they
+    must be done by the end of the forecast.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+        raise ValueError('Body must be a JSON object with a list of jobs.')
+    if not 1 <= len(data['jobs']) <= MAX_JOBS:
+        raise ValueError(f'There must be between 1 and {MAX_JOBS} jobs.')
+    now = np.datetime64('now', 'm') if now is None else np.datetime64(now, 'm')
+    ids, lengths, earliest_starts, deadlines, profiles = [], [], [], [], []
+    for i, job in enumerate(data['jobs']):
+        if not isinstance(job, dict):
+            raise ValueError(f'Job {i} is not a JSON object.')
+        duration = job.get('duration')
+        if not isinstance(duration, int) or isinstance(duration, bool) or duration <= 0 or duration % STEP_MINUTES:
+            raise ValueError(f'Duration of job {i} must be a positive number of minutes divisible by {STEP_MINUTES}.')
+        if duration > MAX_DURATION:
+            raise ValueError(f'Duration of job {i} must be at most {MAX_DURATION} minutes.')
+        profile = job.get('profile')
+        if profile is not None:
+            profile = _profile(profile, duration // STEP_MINUTES, i)
+        ids.append(job.get('id', i))
+        lengths.append(duration // STEP_MINUTES)
+        earliest_starts.append(_time(job.get('earliest-start'), now, i))
+        deadlines.append(_time(job.get('deadline'), np.datetime64('NaT', 'm'), i))
+        profiles.append(profile)
+    return Jobs(ids, np.array(lengths), np.array(earliest_starts, dtype='datetime64[m]'),
+                np.array(deadlines, dtype='datetime64[m]'), profiles)
+
+
+def schedule(windows, jobs: Jobs):
+    """Finds the greenest start of every job within the forecast, given as an instance of ForecastWindows, along with
+    its mean intensity, and how much greener it is than starting as early as possible."""
+    prefix_sums = windows.prefix_sums
+    rows = len(prefix_sums) - 1
+    first_time = windows.times_utc[0]
+    # The first and last rows at which each job may start, rounding its times to the grid of the forecast.
+    first = np.maximum(0, -((first_time - jobs.earliest_starts) // STEP))
+    deadlines = np.where(np.isnat(jobs.deadlines), first_time + rows * STEP, jobs.deadlines)
+    last = np.minimum((deadlines - first_time) // STEP, rows) - jobs.lengths
+    feasible = first <= last
+    # The best start of each job, with its mean intensity and that of its earliest start, and, for jobs with profiles,
+    # the emissions of both.
+    starts = np.zeros(len(jobs.ids), dtype=int)
+    best, baseline = np.zeros(len(jobs.ids)), np.ones(len(jobs.ids))
+    emissions, baseline_emissions = np.zeros(len(jobs.ids)), np.zeros(len(jobs.ids))
+
+    constant = np.flatnonzero(feasible & np.array([profile is None for profile in jobs.profiles]))
+    if len(constant):
+        # The means of all windows of every length asked for, as a matrix of lengths by starts.
+        lengths, length_rows = np.unique(jobs.lengths[constant], return_inverse=True)
+        candidates = np.arange(rows)[None, :]
+        with np.errstate(invalid='ignore'):
+            means = np.where(candidates + lengths[:, None] <= rows,
+                             (prefix_sums[np.minimum(candidates + lengths[:, None], rows)] - prefix_sums[candidates])
+                             / lengths[:, None], np.inf)
+        starts[constant], best[constant], baseline[constant] = _range_best(means, length_rows, first[constant],
+                                                                           last[constant])
+
+    values = np.diff(prefix_sums)
+    profiled = np.flatnonzero(feasible & np.array([profile is not None for profile in jobs.profiles]))
+    for length in np.unique(jobs.lengths[profiled]):
+        group = profiled[jobs.lengths[profiled] == length]
+        weights = np.array([jobs.profiles[i] for i in group])
+        # Every window of the forecast of the given length, as a read-only view of the forecast.
+        all_windows = np.lib.stride_tricks.as_strided(values, (rows - length + 1, length), values.strides * 2,
+                                                      writeable=False)
+        # The emissions of each job for each start, in g, were each step of the profile an hour rather than 5 minutes.
+        costs = np.round((all_windows @ weights.T).T, 9)
+        candidates = np.arange(rows - length + 1)[None, :]
+        allowed = (candidates >= first[group][:, None]) & (candidates <= last[group][:, None])
+        starts[group] = np.argmin(np.where(allowed, costs, np.inf), axis=1)
+        emissions[group] = costs[np.arange(len(group)), starts[group]] * STEP_MINUTES / 60
+        baseline_emissions[group] = costs[np.arange(len(group)), first[group]] * STEP_MINUTES / 60
+        energy = weights.sum(1) * STEP_MINUTES / 60
+        best[group], baseline[group] = emissions[group] / energy, baseline_emissions[group] / energy
+
+    # Everything is formatted up front, so that answering a job is just putting together a dictionary.
+    start_times = np.char.add(np.datetime_as_string(first_time + starts * STEP, unit='m'), 'Z').tolist()
+    end_times = np.char.add(np.datetime_as_string(first_time + (starts + jobs.lengths) * STEP, unit='m'), 'Z').tolist()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        improvements = np.nan_to_num(100 * (1 - best / baseline))
+    intensities, savings, improvements, emissions, emissions_saved = (
+        np.rint(column).astype(int).tolist()
+        for column in (best, baseline - best, improvements, emissions, baseline_emissions - emissions))
+    answers = []
+    for i, job_id in enumerate(jobs.ids):
+        if not feasible[i]:
+            answers.append({'id': job_id, 'success': False,
+                            'error': 'The job does not fit between its earliest start and deadline within the '
+                                     'forecast.'})
+            continue
+        answer = {'id': job_id, 'success': True, 'start': start_times[i], 'end': end_times[i],
+                  'intensity': intensities[i], 'savings': savings[i], 'improvement': f'{improvements[i]} %'}
+        if jobs.profiles[i] is not None:
+            answer.update({'emissions': emissions[i], 'emissions-saved': emissions_saved[i]})
+        answers.append(answer)
+    return {'success': True, 'jobs': answers}
+
+
+def _range_best(costs, rows, first, last):
+    """Finds the start of least cost between first and last, both included, in the given rows of costs, along with its
+    cost and that of the first start, for each of the given ranges.
+
+    Rather than going through every range, we build a sparse table of the starts of least cost in every range whose
+    length is a power of two, for every row at once. Each range is then covered by two such ranges, so finding the best
+    start of any number of ranges takes a lookup each, and building the table takes time independent of their number.
+    """
+    # Round the costs to avoid having floating point errors decide between starts of equal costs, in which case the
+    # earliest one wins.
+    costs = np.round(costs, 9)
+    width = costs.shape[1]
+    table = [np.broadcast_to(np.arange(width), costs.shape)]
+    while 2 ** len(table) <= width:
+        half = 2 ** (len(table) - 1)
+        left, right = table[-1][:, :-half], table[-1][:, half:]
+        left_costs, right_costs = np.take_along_axis(costs, left, 1), np.take_along_axis(costs, right, 1)
+        table.append(np.where(left_costs <= right_costs, left, right))
+    levels = np.floor(np.log2(last - first + 1)).astype(int)
+    starts = np.zeros(len(rows), dtype=int)
+    for level in np.unique(levels):
+        ranges = levels == level
+        candidates = np.stack([table[level][rows[ranges], first[ranges]],
+                               table[level][rows[ranges], last[ranges] - 2 ** level + 1]])
+        candidate_costs = costs[rows[ranges], candidates]
+        starts[ranges] = np.where(candidate_costs[0] <= candidate_costs[1], candidates[0], candidates[1])
+    return starts, costs[rows, starts], costs[rows, first]
+
+
+def _profile(profile, length, i):
+    if not isinstance(profile, list) or len(profile) != length:
+        raise ValueError(f'Profile of job {i} must be a list with the power draw for each 5 minutes of the job.')
+    try:
+        profile = np.array(profile, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f'Profile of job {i} must contain numbers only.')
+    if not np.isfinite(profile).all() or (profile < 0).any() or profile.sum() == 0:
+        raise ValueError(f'Profile of job {i} must be non-negative, and not all zero.')
+    if (profile > MAX_POWER).any():
+        raise ValueError(f'Profile of job {i} must not draw more than {MAX_POWER:.0f} kW.')
+    return profile
+
+
+def _time(value, default, i):
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f'Times of job {i} must be given as ISO 8601, e.g. 2021-06-01T14:30Z.')
+    try:
+        # Times are UTC, with or without a Z to say so.
+        time = np.datetime64(value[:-1] if value.endswith('Z') else value, 'm')
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'Times of job {i} must be given as ISO 8601, e.g. 2021-06-01T14:30Z.')
+    if np.isnat(time) or not TIME_RANGE[0] <= time < TIME_RANGE[1]:
+        raise ValueError(f'Times of job {i} must be between {TIME_RANGE[0]}Z and {TIME_RANGE[1]}Z.')
+    return time
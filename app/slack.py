@@ -0,0 +1,146 @@
+"""Answers our Slack command, /erstroemmengroen, and posts the overview of the next day to every workspace which
+installed our Slack app.
+
+Slack gives us 3 seconds to answer a command, so the answer for each price area is rendered along with the forecast
+(see app.cache), and answering is just reading it from the cache. Only when it is missing, e.g. on a cold start, would
+we have to wait for it to be built, so instead we acknowledge the command at once and post the answer to the
+response_url of the command from a background thread once it is ready.
+
+When a workspace installs the app, the OAuth exchange gives us its token along with an incoming webhook for the channel
+picked by whoever installed it. Both are stored (see app.subscriptions), and once a day, the overview is posted to all
+webhooks in parallel (see send_daily_digest), like push notifications are sent (see app.push).
+
+requests is only needed when actually talking to Slack, so it is imported on first use.
+"""
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import subscriptions
+from .areas import DEFAULT_PRICE_AREA, PRICE_AREAS
+from .windows import overview_next_day
+
+SLACK_API = 'https://slack.com/api'
+
+# Answers to commands may only be posted to Slack's own response URLs.
+RESPONSE_URL_PREFIX = 'https://hooks.slack.com/'
+
+# Slack is given this many seconds, for connecting and for responding, to answer any of our requests.
+SLACK_TIMEOUT = (3.05, 10)
+
+# The number of answers posted concurrently in the background, and of digests posted concurrently.
+RESPONSE_WORKERS = 4
+DIGEST_WORKERS = 16
+
+# What we answer at once when the actual answer has yet to be built.
+ACKNOWLEDGEMENT = {'response_type': 'ephemeral', 'text': 'Et øjeblik, vi henter prognosen...'}
+
+_responders = ThreadPoolExecutor(max_workers=RESPONSE_WORKERS)
+
+
+def command_area(text):
+    """Gets the price area given as the text of a Slack command; if it is not, or it is unknown, we use the default."""
+    area = (text or '').strip().upper()
+    return area if area in PRICE_AREAS else DEFAULT_PRICE_AREA
+
+
+def overview(windows, quintiles):
+    """Puts together the answer to a Slack command from the forecast windows and quintiles of a price area."""
+    overview = overview_next_day(windows, quintiles=quintiles)
+    return {
+        "response_type": "in_channel",
+        "blocks": [
+            {"type": "section", "text": {"type": "mrkdwn", "text": overview["title"]}},
+            {"type": "section", "text": {"type": "mrkdwn", "text": overview["message"]}}
+        ]
+    }
+
+
+def respond_later(area, response_url):
+    """Posts the answer to a command for the given price area to the given response URL once it is ready, in the
+    background."""
+    if not (response_url or '').startswith(RESPONSE_URL_PREFIX):
+        return
+    _responders.submit(_respond, area, response_url)
+
+
+def _respond(area, response_url):
+    import requests
+
+    from .cache import get_slack_response
+
+    try:
+        body = get_slack_response(area).value.body
+        requests.post(response_url, data=body, headers={'Content-Type': 'application/json'}, timeout=SLACK_TIMEOUT)
+    except Exception:
+        traceback.print_exc()
+
+
+def authorize(code):
+    """Exchanges the code of a Slack authorization for a token, which is stored along with the rest of the
+    installation, returning a message for the user."""
+    import requests
+
+    resp = requests.post(
+        f'{SLACK_API}/oauth.v2.access',
+        {'code': code, 'client_id': os.environ['SLACK_CLIENT_ID'], 'client_secret': os.environ['SLACK_CLIENT_SECRET']},
+        timeout=SLACK_TIMEOUT
+    ).json()
+    if not resp["ok"]:
+        return f"Could not add app: {resp['error']}"
+    subscriptions.save_slack_installation(resp['team']['id'], json.dumps(resp))
+    return "App added! Try using /erstroemmengroen in one of your channels"
+
+
+def send_daily_digest():
+    """Posts the overview of the next day to the incoming webhook of every installation of our Slack app.
+
+    Installations whose webhooks Slack reports as gone, e.g. since the app was removed or the channel archived, are
+    removed. The statistics are reported like those of push notifications.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    from .cache import get_slack_response
+    from .push import PushStats
+
+    # The digest is the same for every workspace, and already rendered in the cache.
+    payload = get_slack_response(DEFAULT_PRICE_AREA).value.body
+    stats = PushStats()
+    start = time.time()
+    webhooks = {}
+    for team_id, data in subscriptions.slack_installations():
+        url = json.loads(data).get('incoming_webhook', {}).get('url')
+        if url:
+            webhooks[team_id] = url
+
+    # All webhooks are on the same host, so a single pooled session reuses connections across workspaces.
+    with requests.Session() as session:
+        session.mount(RESPONSE_URL_PREFIX, HTTPAdapter(pool_maxsize=DIGEST_WORKERS))
+
+        def send(team_id):
+            response = session.post(webhooks[team_id], data=payload, headers={'Content-Type': 'application/json'},
+                                    timeout=SLACK_TIMEOUT)
+            return team_id, response.status_code
+
+        gone = []
+        with ThreadPoolExecutor(max_workers=DIGEST_WORKERS) as executor:
+            for future in as_completed([executor.submit(send, team_id) for team_id in webhooks]):
+                try:
+                    team_id, status = future.result()
+                except Exception:
+                    traceback.print_exc()
+                    stats.failed += 1
+                    continue
+                if status in (403, 404, 410):
+                    gone.append(team_id)
+                elif status < 300:
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
+    subscriptions.remove_slack_installations(gone)
+    stats.removed = len(gone)
+    stats.seconds = time.time() - start
+    return stats
@@ -0,0 +1,136 @@
+"""Defines the compact snapshot of the emission intensity history and forecast of a price area, which all workers on a
+host share.
+
+As data frames, the history and forecast take up hundreds of kilobytes in every worker that decodes them: timezone-aware
+times, Danish times, object-dtype types, and 64-bit intensities. All that is really there, though, is a time and an
+intensity for every data point, and where the history ends. A snapshot keeps just that, as minutes since the epoch in
+32-bit integers and intensities in g CO2/kWh in 16-bit unsigned integers, which is about 6 kB for a whole window:
+
+    header (4 little-endian int32s): format version, rows, forecast start, reserved
+    times (rows little-endian int32s)
+    intensities (rows little-endian uint16s)
+
+Snapshots are cached along with the rest of the data (see app.cache). The first worker on a host to see a new one
+writes it to SNAPSHOT_DIRECTORY, which is in shared memory where there is such a thing, and every worker then maps that
+file rather than keeping a copy of its own, so memory use does not grow with the number of workers. Files are named by
+their contents and only ever replaced atomically, so a worker either maps a complete snapshot or none at all. A worker
+still mapping a snapshot which has since been replaced keeps its pages until it moves on to the new one.
+
+Snapshots need only numpy. The data frames can be rebuilt from them (see Snapshot.emission_data), which needs pandas, so
+that is imported on first use.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import traceback
+from dataclasses import dataclass
+from glob import glob
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+SNAPSHOT_DIRECTORY = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'co2-snapshots')
+
+HEADER = np.dtype('<i4')
+HEADER_LENGTH = 4
+TIMES = np.dtype('<i4')
+INTENSITIES = np.dtype('<u2')
+
+MINUTE = np.timedelta64(1, 'm')
+
+
+@dataclass
+class Snapshot:
+    # The time at which each data point starts, in minutes since the epoch (UTC).
+    times: np.ndarray
+    # The emission intensity of each data point, in g CO2/kWh.
+    intensities: np.ndarray
+    # The number of data points of the history, which is followed by the forecast.
+    forecast_start: int
+
+    @property
+    def times_utc(self):
+        return self.times.astype('datetime64[m]')
+
+    def emission_data(self):
+        """Rebuilds the data frames of the history and forecast, as an instance of app.data.EmissionData."""
+        import pandas as pd
+
+        from .data import EMISSION_TYPES, EmissionData
+
+        times = pd.DatetimeIndex(self.times_utc.astype('datetime64[ns]'))
+        types = np.where(np.arange(len(times)) < self.forecast_start, EMISSION_TYPES[0], EMISSION_TYPES[1])
+        df = pd.DataFrame({'Minutes5UTC': times,
+                           'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                           'CO2Emission': self.intensities.astype(np.float64),
+                           'Type': pd.Categorical(types, categories=EMISSION_TYPES)})
+        return EmissionData(df.iloc[:self.forecast_start].reset_index(drop=True),
+                            df.iloc[self.forecast_start:].reset_index(drop=True))
+
+
+def pack(data) -> bytes:
+    """Packs emission data, as an instance of app.data.EmissionData, into a snapshot.
+
+    Energinet's intensities are whole numbers of g CO2/kWh, so rounding them loses nothing.
+    """
+    times = np.concatenate([data.df_history.Minutes5UTC.to_numpy(), data.df_forecast.Minutes5UTC.to_numpy()])
+    intensities = np.concatenate([data.df_history.CO2Emission.to_numpy(), data.df_forecast.CO2Emission.to_numpy()])
+    header = np.array([FORMAT_VERSION, len(times), len(data.df_history), 0], dtype=HEADER)
+    minutes = (times.astype('datetime64[m]') - np.datetime64(0, 'm')) // MINUTE
+    intensities = np.clip(np.rint(intensities), 0, np.iinfo(INTENSITIES).max)
+    return header.tobytes() + minutes.astype(TIMES).tobytes() + intensities.astype(INTENSITIES).tobytes()
+
+
+def unpack(buffer) -> Snapshot:
+    """Reads a snapshot from the given buffer; its arrays are views of the buffer, so nothing is copied."""
+    version, rows, forecast_start, _ = np.frombuffer(buffer, dtype=HEADER, count=HEADER_LENGTH)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unsupported snapshot format version {version}')
+    offset = HEADER_LENGTH * HEADER.itemsize
+    times = np.frombuffer(buffer, dtype=TIMES, count=rows, offset=offset)
+    intensities = np.frombuffer(buffer, dtype=INTENSITIES, count=rows, offset=offset + rows * TIMES.itemsize)
+    return Snapshot(times, intensities, int(forecast_start))
+
+
+def share(name, buffer) -> Snapshot:
+    """Gets the snapshot in the given buffer as a map of the file shared by all workers on this host, writing the file
+    if no other worker has done so yet.
+
+    Here, name identifies what the snapshot is of, e.g. the price area, and earlier snapshots of the same are removed.
+    Should sharing fail, e.g. as the directory is not writable, the snapshot is read from the buffer instead.
+    """
+    path = os.path.join(SNAPSHOT_DIRECTORY, f'{name}-{_digest(buffer)}')
+    try:
+        try:
+            return _map(path)
+        except FileNotFoundError:
+            pass
+        os.makedirs(SNAPSHOT_DIRECTORY, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=SNAPSHOT_DIRECTORY, suffix='.tmp', delete=False) as f:
+            f.write(buffer)
+        os.replace(f.name, path)
+        for earlier in glob(os.path.join(SNAPSHOT_DIRECTORY, f'{name}-*')):
+            if earlier != path and not earlier.endswith('.tmp'):
+                _remove(earlier)
+        return _map(path)
+    except OSError:
+        traceback.print_exc()
+        return unpack(buffer)
+
+
+def _digest(buffer):
+    return hashlib.blake2b(buffer, digest_size=8).hexdigest()
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        return unpack(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
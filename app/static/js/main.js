@@ -1,8 +1,19 @@
+// The price area can be chosen by adding e.g. ?area=DK1 to the address of the page; if it is not, the API uses its
+// defaults.
+var priceArea = new URLSearchParams(window.location.search).get("area");
+
+function inPriceArea(url) {
+    return priceArea ? url + "?area=" + encodeURIComponent(priceArea) : url;
+}
+
+// Likewise, a longer range can be charted by adding e.g. ?range=month; the API knows of week, month, and year.
+var chartRange = new URLSearchParams(window.location.search).get("range");
+
 function updateGreenestPeriod() {
     // Update all data pertaining to the "greenest period of time"
     var period = $('#dropdown-toggle-period').data('value');
     var horizon = $('#dropdown-toggle-horizon').data('value');
-    $.get("/api/v1/greenest-period/" + period + "/" + horizon, function(data) {
+    $.get(inPriceArea("/api/v1/greenest-period/" + period + "/" + horizon), function(data) {
         $("#average-intensity").text(data["current-intensity"]);
         $("#improvement").text(data["improvement"]);
         $("#best-period-start").text(data["best-period-start"]);
@@ -11,9 +22,67 @@ function updateGreenestPeriod() {
     });
 }
 
+// The Vega-Lite specifications of our charts are static, so we only fetch each of them once, and then fill in the
+// data from the API whenever it is updated.
+var chartTemplates = {};
+
+function getChartTemplate(name) {
+    if (!(name in chartTemplates)) {
+        chartTemplates[name] = $.getJSON("/charts/" + name + ".json");
+    }
+    return chartTemplates[name];
+}
+
+function fillTemplate(template, values) {
+    // Replace every string of the form "$name" in the template by values["name"].
+    if (typeof template === "string" && template.charAt(0) === "$") {
+        return values[template.substring(1)];
+    }
+    if (Array.isArray(template)) {
+        return template.map(function(item) { return fillTemplate(item, values); });
+    }
+    if (template !== null && typeof template === "object") {
+        var filled = {};
+        for (var key in template) {
+            filled[key] = fillTemplate(template[key], values);
+        }
+        return filled;
+    }
+    return template;
+}
+
+function plotEmissionIntensity(data) {
+    var times = data["times"];
+    var quintiles = data["quintiles"];
+    var intensities = times.map(function(time, i) {
+        return {"time": time, "intensity": data["intensities"][i],
+                "type": i < data["forecast-start"] ? "Målt" : "Prognose"};
+    });
+    var bands = [];
+    for (var i = 0; i < quintiles.length - 1; i++) {
+        bands.push({"x": times[0], "x2": times[times.length - 1], "y": quintiles[i], "y2": quintiles[i + 1], "band": i});
+    }
+    var now = [{"x": data["now"], "y": 0}, {"x": data["now"], "y": quintiles[quintiles.length - 1]}];
+    getChartTemplate("emission-intensity").then(function(template) {
+        var spec = fillTemplate(template, {"intensities": intensities, "now": now, "bands": bands,
+                                           "domain": [0, data["plot-height"]], "selection": data["selection"]});
+        vegaEmbed("#vis", spec, {"renderer": "canvas", "actions": false});
+    });
+}
+
+function plotGenerationMix(data) {
+    var mix = data["names"].map(function(name, i) {
+        return {"name": name, "production": data["production"][i], "renewable": data["renewable"][i]};
+    });
+    getChartTemplate("generation-mix").then(function(template) {
+        var spec = fillTemplate(template, {"mix": mix, "dataTime": data["data-time"]});
+        vegaEmbed("#vis-generation-mix", spec, {"renderer": "canvas", "actions": false});
+    });
+}
+
 function updateEmissionIntensity() {
     // Update the main information about emission intensities, and the corresponding plot.
-    $.get("/api/v1/current-emission-intensity", function(data) {
+    $.get(inPriceArea("/api/v2/current-emission-intensity"), function(data) {
         $("#jumbotron").css("background-color", data["intensity-level-bgcolor"]);
         $("meta[name='theme-color']").attr("content", data["intensity-level-bgcolor"]);
         $("meta[name='msapplication-navbutton-color']").attr("content", data["intensity-level-bgcolor"]);
@@ -45,23 +114,21 @@ function updateEmissionIntensity() {
                 $('#dropdown-toggle-horizon').html(newText);
             }
         }
-
-        // TODO: Rather than generating the plot from scratch, it would make sense to keep the
-        // Vega-Lite specification static, and then simply update its data here.
-        var plot_data = data["plot-data"];
-        var plot_opt = {"renderer": "canvas", "actions": false};
-        vegaEmbed("#vis", plot_data, plot_opt);
+        if (chartRange) {
+            var url = inPriceArea("/api/v2/emission-intensity-chart");
+            $.get(url + (priceArea ? "&" : "?") + "range=" + encodeURIComponent(chartRange), plotEmissionIntensity);
+        } else {
+            plotEmissionIntensity(data);
+        }
     });
 }
 
 function updateCurrentGenerationMix() {
-    $.get("/api/v1/current-generation-mix", function(data) {
+    $.get(inPriceArea("/api/v2/current-generation-mix"), function(data) {
         $("#current-import").text(data["import"]);
         $("#current-export").text(data["export"]);
         $("#current-production").text(data["total-production"]);
-        var plot_data = data["plot-data"];
-        var plot_opt = {"renderer": "canvas", "actions": false};
-        vegaEmbed("#vis-generation-mix", plot_data, plot_opt);
+        plotGenerationMix(data);
     });
 
 }
@@ -73,10 +140,41 @@ function updateAll() {
     updateCurrentGenerationMix();
 }
 
+// The datasets we are told about by the server, along with the updates to make when a new version arrives.
+var datasetUpdates = {
+    "emission-intensity": function() { updateEmissionIntensity(); updateGreenestPeriod(); },
+    "generation-mix": updateCurrentGenerationMix
+};
+var datasetVersions = {};
+
+function followUpdates() {
+    // Rather than polling, we let the server tell us whenever new data is available. On connecting, the server sends
+    // the current versions, which we already have unless we missed an update while disconnected. Browsers reconnect
+    // by themselves if the connection drops, but if the stream is unavailable altogether, we fall back to polling.
+    if (!window.EventSource) {
+        setInterval(updateAll, 5*60*1000);
+        return;
+    }
+    var source = new EventSource("/api/v1/stream");
+    source.onmessage = function(event) {
+        var data = JSON.parse(event.data);
+        var known = datasetVersions[data["dataset"]];
+        datasetVersions[data["dataset"]] = data["version"];
+        if (known !== undefined && known !== data["version"] && data["dataset"] in datasetUpdates) {
+            datasetUpdates[data["dataset"]]();
+        }
+    };
+    source.onerror = function() {
+        if (source.readyState === EventSource.CLOSED) {
+            setInterval(updateAll, 5*60*1000);
+        }
+    };
+}
+
 $(document).ready(function() {
-    // Immediately set the page data, and refresh it every five minutes.
+    // Immediately set the page data, and keep it up to date from then on.
     updateAll();
-    setInterval(updateAll, 5*60*1000);
+    followUpdates();
     registerServiceWorker();
 
     // Determine which "Add to home screen" guides to display based on user agents.
@@ -0,0 +1,160 @@
+"""Streams new versions of the cached data to clients as server-sent events.
+
+Rather than having every client poll the API every few minutes, whether or not anything changed, clients keep a
+connection to /api/v1/stream open, and are told as soon as a new version of a dataset is cached. Every worker
+subscribes to the Redis channel on which new versions are announced (see app.cache) only once, and passes the
+announcements on to all of its clients.
+
+Each client holds on to its connection for as long as it stays on the page, so the stream is only served by workers
+which can hold many idle connections at little cost, i.e. uwsgi with gevent, as set up in docker-compose.yml, with the
+proxy in proxy/nginx.conf routing the stream there. Other WSGI workers, with a thread for every connection, answer No
+Content instead (see can_hold_connections), on which the page falls back to polling. The code below is plain threading
+and blocking I/O, which gevent's monkey patching turns into greenlets and cooperative I/O. The ASGI app (see
+app.asgi) serves the stream from its event loop instead, with the asyncio counterparts at the end of this module, which
+import app.async_cache, and with it redis.asyncio, only when used.
+"""
+import asyncio
+import json
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from . import cache
+
+# Clients are sent a comment at least this often, in seconds, so that proxies do not consider the connection idle,
+# and so that we notice clients which have gone away.
+HEARTBEAT_INTERVAL = 30
+
+# If the connection to Redis is lost, we wait this many seconds before reconnecting.
+RECONNECT_INTERVAL = 5
+
+
+def can_hold_connections():
+    """Tells whether the current worker can hold many idle connections, i.e. whether it runs on gevent, which uwsgi's
+    --gevent-monkey-patch has patched the standard library for."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+class Broadcaster:
+    """Passes the announcements of new versions on to all clients of the current worker."""
+
+    def __init__(self):
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def connect(self):
+        """Connects a new client, returning the queue on which it will receive announcements."""
+        client = queue.Queue()
+        with self.lock:
+            self.clients.add(client)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._listen, daemon=True)
+                self.thread.start()
+        return client
+
+    def disconnect(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def _listen(self):
+        while True:
+            pubsub = cache.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(cache.VERSIONS_CHANNEL)
+                for message in pubsub.listen():
+                    with self.lock:
+                        clients = list(self.clients)
+                    for client in clients:
+                        client.put(message['data'].decode())
+            except Exception:
+                traceback.print_exc()
+                time.sleep(RECONNECT_INTERVAL)
+            finally:
+                # Give the connection back before reconnecting, so that every failure does not leak one.
+                pubsub.close()
+
+
+broadcaster = Broadcaster()
+
+
+def events():
+    """Generates the events sent to a client.
+
+    On connecting, a client is sent the current version of every dataset, so that a client which reconnects after
+    having missed an announcement can tell that it is out of date.
+    """
+    client = broadcaster.connect()
+    try:
+        for dataset, version in cache.get_versions().items():
+            if version is not None:
+                yield _event({'dataset': dataset, 'version': version})
+        while True:
+            try:
+                yield f'data: {client.get(timeout=HEARTBEAT_INTERVAL)}\n\n'
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+    finally:
+        broadcaster.disconnect(client)
+
+
+def _event(data):
+    return f'data: {json.dumps(data)}\n\n'
+
+
+class AsyncBroadcaster:
+    """Passes the announcements of new versions on to all clients of the current worker's event loop."""
+
+    def __init__(self):
+        self.clients = set()
+        self.task = None
+
+    def connect(self):
+        client = asyncio.Queue()
+        self.clients.add(client)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._listen())
+        return client
+
+    def disconnect(self, client):
+        self.clients.discard(client)
+
+    async def _listen(self):
+        from . import async_cache
+
+        while True:
+            pubsub = async_cache.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(cache.VERSIONS_CHANNEL)
+                async for message in pubsub.listen():
+                    for client in list(self.clients):
+                        client.put_nowait(message['data'].decode())
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(RECONNECT_INTERVAL)
+            finally:
+                await pubsub.aclose()
+
+
+async_broadcaster = AsyncBroadcaster()
+
+
+async def async_events():
+    """Generates the events sent to a client, like events."""
+    from . import async_cache
+
+    client = async_broadcaster.connect()
+    try:
+        for dataset, version in (await async_cache.get_versions()).items():
+            if version is not None:
+                yield _event({'dataset': dataset, 'version': version})
+        while True:
+            try:
+                yield f'data: {await asyncio.wait_for(client.get(), HEARTBEAT_INTERVAL)}\n\n'
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+    finally:
+        async_broadcaster.disconnect(client)
@@ -0,0 +1,171 @@
+"""Stores push notification subscriptions, as well as the workspaces which installed our Slack app, in an sqlite
+database.
+
+Subscriptions are keyed by a hash of their endpoint, which is what identifies a subscription to the push service, so
+subscribing twice from the same browser replaces the old subscription rather than adding a duplicate. The hash is
+indexed, so saving and removing a subscription does not have to scan the whole table.
+
+Each worker process keeps a single connection open, in WAL mode, so that readers never block the writer and vice
+versa; the fan-out of notifications can thus iterate over all subscriptions while the web app keeps saving new ones.
+
+The schema is versioned through sqlite's user_version, and brought up to date by MIGRATIONS whenever a worker first
+connects to the database.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+DB_PATH = '/data/subs.db'
+
+# Subscriptions are read this many at a time when iterating over all of them.
+CHUNK_SIZE = 1000
+
+# Subscriptions are removed this many at a time, keeping well below sqlite's limit on parameters.
+REMOVE_BATCH_SIZE = 500
+
+
+def _create_subs(connection):
+    # The original schema, which databases created before we versioned the schema already have.
+    connection.execute('CREATE TABLE IF NOT EXISTS subs (sub text)')
+
+
+def _create_subscriptions(connection):
+    connection.execute('CREATE TABLE subscriptions ('
+                       'id INTEGER PRIMARY KEY, endpoint_hash BLOB NOT NULL UNIQUE, sub TEXT NOT NULL)')
+    for (data,) in connection.execute('SELECT sub FROM subs ORDER BY rowid').fetchall():
+        try:
+            endpoint_hash = _endpoint_hash(data)
+        except (ValueError, KeyError, TypeError):
+            continue
+        # Later duplicates replace earlier ones, so we keep the most recent version of each subscription.
+        connection.execute('INSERT OR REPLACE INTO subscriptions (endpoint_hash, sub) VALUES (?, ?)',
+                           (endpoint_hash, data))
+    connection.execute('DROP TABLE subs')
+
+
+def _create_slack_installations(connection):
+    # Slack installations are keyed by workspace, so installing the app again replaces the old installation.
+    connection.execute('CREATE TABLE slack_installations (team_id TEXT PRIMARY KEY, installation TEXT NOT NULL)')
+
+
+# Migration i brings the schema from version i to version i + 1.
+MIGRATIONS = [_create_subs, _create_subscriptions, _create_slack_installations]
+
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+
+def save(data):
+    """Saves the subscription represented by the given JSON string, replacing any with the same endpoint."""
+    with _lock:
+        _connect().execute('INSERT INTO subscriptions (endpoint_hash, sub) VALUES (?, ?) '
+                           'ON CONFLICT (endpoint_hash) DO UPDATE SET sub = excluded.sub', (_endpoint_hash(data), data))
+
+
+def remove(data):
+    """Removes the subscription represented by the given JSON string."""
+    with _lock:
+        _connect().execute('DELETE FROM subscriptions WHERE endpoint_hash = ?', (_endpoint_hash(data),))
+
+
+def remove_ids(ids):
+    """Removes the subscriptions with the given ids, as obtained from chunks."""
+    ids = list(ids)
+    for i in range(0, len(ids), REMOVE_BATCH_SIZE):
+        batch = ids[i:i + REMOVE_BATCH_SIZE]
+        with _lock:
+            _connect().execute(f'DELETE FROM subscriptions WHERE id IN ({",".join("?" * len(batch))})', batch)
+
+
+def chunks(chunk_size=CHUNK_SIZE):
+    """Iterates over all subscriptions in chunks, each a list of (id, JSON string) tuples.
+
+    Every chunk is read in a query of its own, continuing from the last id of the previous chunk, so no transaction is
+    held open between chunks, and subscriptions may be saved or removed while iterating.
+    """
+    last_id = 0
+    while True:
+        with _lock:
+            chunk = _connect().execute('SELECT id, sub FROM subscriptions WHERE id > ? ORDER BY id LIMIT ?',
+                                       (last_id, chunk_size)).fetchall()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def count():
+    with _lock:
+        return _connect().execute('SELECT count(*) FROM subscriptions').fetchone()[0]
+
+
+def save_slack_installation(team_id, data):
+    """Saves the installation of our Slack app in the given workspace, represented by the given JSON string, i.e. the
+    response to the OAuth exchange, replacing any earlier installation in the same workspace."""
+    with _lock:
+        _connect().execute('INSERT INTO slack_installations (team_id, installation) VALUES (?, ?) '
+                           'ON CONFLICT (team_id) DO UPDATE SET installation = excluded.installation', (team_id, data))
+
+
+def slack_installations():
+    """Gets all installations of our Slack app, as a list of (team id, JSON string) tuples.
+
+    There is one per workspace, rather than one per user, so there are few enough to read them all at once.
+    """
+    with _lock:
+        return _connect().execute('SELECT team_id, installation FROM slack_installations ORDER BY team_id').fetchall()
+
+
+def remove_slack_installations(team_ids):
+    """Removes the installations of our Slack app in the given workspaces."""
+    team_ids = list(team_ids)
+    for i in range(0, len(team_ids), REMOVE_BATCH_SIZE):
+        batch = team_ids[i:i + REMOVE_BATCH_SIZE]
+        with _lock:
+            _connect().execute(f'DELETE FROM slack_installations WHERE team_id IN ({",".join("?" * len(batch))})',
+                               batch)
+
+
+def _endpoint_hash(data):
+    return hashlib.sha256(json.loads(data)['endpoint'].encode()).digest()
+
+
+def _connect():
+    """Gets the connection of the current worker, opening it if necessary. Must be called while holding _lock.
+
+    Connections must not be shared across processes, so a worker forked from a process which had already connected
+    opens a connection of its own.
+    """
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        # We manage transactions ourselves; outside of migrations, every statement is a transaction of its own.
+        connection = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        _migrate(connection)
+        _connection, _connection_pid = connection, os.getpid()
+    return _connection
+
+
+def _migrate(connection):
+    """Applies whatever migrations the database is missing.
+
+    Each migration runs in an immediate transaction, which also checks the version, so when several workers start at
+    once, each migration is applied by exactly one of them.
+    """
+    while True:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                connection.execute('COMMIT')
+                return
+            MIGRATIONS[version](connection)
+            connection.execute(f'PRAGMA user_version = {version + 1}')
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
@@ -0,0 +1,170 @@
+"""Finds the greenest and blackest periods of the forecast, and sums up the next day.
+
+This is all that is needed to answer requests for the greenest period and for the overview of the next day from a
+cached ForecastWindows, so it is kept apart from app.model, and needs neither pandas nor altair.
+"""
+import datetime
+import math
+from bisect import bisect
+from collections import namedtuple
+from dataclasses import dataclass
+
+import numpy as np
+
+# The version of ForecastWindows, which is part of its cache key, so that windows pickled by an earlier version are never
+# read back, e.g. ones pickled while ForecastWindows was still part of app.model, which would import it, and with it
+# altair and pandas, or ones pickled before times_utc was added.
+FORMAT_VERSION = 3
+
+# Hardcoded quintiles of data distribution, bounded by 0 and 1000. These are used whenever the actual quintiles of the
+# last few years are not known, i.e. until the archive covers enough of them (see app.distribution).
+DEFAULT_QUINTILES = [0, 68, 112, 158, 227, 1000]
+
+# The longest period and horizon, in hours, for which we precompute the greenest and blackest windows of the forecast.
+MAX_PERIOD = 6
+MAX_HORIZON = 72
+
+# A window of the forecast, given by its mean emission intensity, the clock times at which it starts and ends, and
+# whether it starts on a later day than the forecast does.
+Window = namedtuple('Window', ['mean', 'start', 'end', 'later_day'])
+
+
+def _prefix_argmin(values):
+    """For every i, finds the index of the first occurrence of the minimum of values[:i + 1]."""
+    running_min = np.minimum.accumulate(values)
+    is_new_min = np.ones(len(values), dtype=bool)
+    is_new_min[1:] = values[1:] < running_min[:-1]
+    return np.maximum.accumulate(np.where(is_new_min, np.arange(len(values)), 0))
+
+
+@dataclass
+class ForecastWindows:
+    """Contains the greenest and blackest windows of a forecast for every period and horizon we support.
+
+    The means of all windows of a given length can be obtained from the prefix sums of the forecast in a single pass,
+    and from the running minima (maxima) of those, we get the greenest (blackest) window starting within the first k
+    data points for every k at once. This gives us the extreme windows for every horizon, so that answering a request
+    afterwards is just a lookup.
+    """
+    prefix_sums: np.ndarray
+    # The number of data points within the first h hours of the forecast, indexed by h.
+    horizon_rows: np.ndarray
+    # The indices at which the greenest and blackest windows start, indexed by period and horizon; a negative index
+    # means that there is no such window, as the forecast is too short.
+    greenest: np.ndarray
+    blackest: np.ndarray
+    start_times: list
+    end_times: list
+    start_days: np.ndarray
+    first_day: int
+    # The UTC time at which each data point starts, for scheduling jobs at given times (see app.scheduling).
+    times_utc: np.ndarray
+
+    @classmethod
+    def build(cls, df_forecast):
+        values = df_forecast.CO2Emission.to_numpy(dtype=np.float64)
+        prefix_sums = np.concatenate([[0], np.cumsum(values)])
+        times_utc = df_forecast.Minutes5UTC.to_numpy()
+        horizon_rows = np.searchsorted(times_utc, times_utc[0] + np.arange(MAX_HORIZON + 1) * np.timedelta64(1, 'h'))
+        greenest = np.full((MAX_PERIOD + 1, MAX_HORIZON + 1), -1)
+        blackest = np.full((MAX_PERIOD + 1, MAX_HORIZON + 1), -1)
+        for period in range(1, MAX_PERIOD + 1):
+            length = period * 12
+            if length > len(values):
+                break
+            # Round the means to avoid having floating point errors decide between windows of equal means.
+            means = np.round((prefix_sums[length:] - prefix_sums[:-length]) / length, 9)
+            last_start = horizon_rows - length
+            valid = last_start >= 0
+            greenest[period, valid] = _prefix_argmin(means)[last_start[valid]]
+            blackest[period, valid] = _prefix_argmin(-means)[last_start[valid]]
+        # Windows are labelled by the time their first data point starts, and the time their last data point ends.
+        times = df_forecast.Minutes5DK
+        start_times = list(times.dt.strftime('%H:%M'))
+        end_times = list((times + np.timedelta64(5, 'm')).dt.strftime('%H:%M'))
+        return cls(prefix_sums, horizon_rows, greenest, blackest, start_times, end_times,
+                   times.dt.day.to_numpy(), df_forecast.Minutes5UTC.min().day, times_utc.astype('datetime64[m]'))
+
+    def mean(self, rows):
+        """Calculates the mean of the first given number of data points."""
+        rows = min(rows, len(self.prefix_sums) - 1)
+        return self.prefix_sums[rows] / rows
+
+    def __len__(self):
+        return len(self.prefix_sums) - 1
+
+    def greenest_window(self, period: int, horizon: int):
+        return self._window(self.greenest[period, horizon], period)
+
+    def blackest_window(self, period: int, horizon: int):
+        return self._window(self.blackest[period, horizon], period)
+
+    def _window(self, start, period):
+        if start < 0:
+            return None
+        end = start + period * 12
+        mean = (self.prefix_sums[end] - self.prefix_sums[start]) / (end - start)
+        return Window(mean, self.start_times[start], self.end_times[end - 1], self.start_days[start] != self.first_day)
+
+
+def _quintile_bounds(quintiles):
+    """Turns the quintiles of the data distribution into bounds on each fifth of it, falling back to the defaults."""
+    bounds = DEFAULT_QUINTILES
+    if quintiles is None:
+        return bounds
+    return [bounds[0]] + [int(round(quintile)) for quintile in quintiles] + [bounds[-1]]
+
+
+def current_period_emission(windows: ForecastWindows, period):
+    return int(round(windows.mean(12*period)))
+
+
+def best_period(windows: ForecastWindows, period, horizon):
+    lowest = windows.greenest_window(period, horizon)
+    if lowest is None:
+        return {'success': False, 'error': 'Forecast is shorter than the given period.'}
+    best_period_intensity = int(round(lowest.mean))
+    current = current_period_emission(windows, period)
+    improvement = f'{int(round(100*(1 - best_period_intensity/current)))} %'
+    return {'success': True,
+            'current-intensity': current,
+            'improvement': improvement,
+            'best-period-start': lowest.start,
+            'best-period-end': lowest.end,
+            'best-period-intensity': best_period_intensity}
+
+
+def overview_next_day(windows: ForecastWindows, short_title: bool = False, quintiles=None):
+    period = 3
+    horizon = 24
+
+    mean = windows.mean(windows.horizon_rows[horizon])
+    lowest = windows.greenest_window(period, horizon)
+    best_hour_start = lowest.start
+    best_hour_end = lowest.end
+    if lowest.later_day:
+        best_hour_end += ' i morgen'
+    best_hour_intensity = int(round(lowest.mean))
+    highest = windows.blackest_window(period, horizon)
+    worst_hour_start = highest.start
+    worst_hour_end = highest.end
+    if highest.later_day:
+        worst_hour_end += ' i morgen'
+    worst_hour_intensity = int(round(highest.mean))
+
+    q = _quintile_bounds(quintiles)
+    index = bisect(q, mean) - 1
+    if short_title:
+        colors = ['Meget grøn 💚', 'Grøn 💚', 'Grøn og sort', 'Sort 🏭', 'Kulsort 🏭']
+        general_color = colors[index]
+        # New forecasts arrive around 16:00, so we change our title message accordingly.
+        prefix = 'i dag' if datetime.datetime.now().hour < 16 else 'det næste døgn'
+        title = f'Strømmen {prefix}: {general_color}'
+    else:
+        colors = ['meget grøn 💚', 'grøn 💚', 'både grøn og sort', 'ret sort 🏭', 'kulsort 🏭']
+        general_color = colors[index]
+        forecast_length = min(horizon, math.ceil(len(windows) / 12))
+        title = f'De næste {forecast_length} timer er strømmen generelt {general_color}'
+    message = f'🟢 Grønnest: {best_hour_start}-{best_hour_end} ({best_hour_intensity} g CO2/kWh).\n' +\
+        f'⚫ Sortest: {worst_hour_start}-{worst_hour_end} ({worst_hour_intensity} g CO2/kWh).'
+    return {'title': title, 'message': message}
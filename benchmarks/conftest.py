@@ -0,0 +1,43 @@
+"""Fixtures for the benchmarks, which replay Energinet's responses from a local stub (see benchmarks/energinet.py) and
+cache in a fake Redis, so that they measure our code, and nothing but our code.
+
+Run the benchmarks with `python -m pytest benchmarks`. They need pytest-benchmark, and are skipped without it.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from app import archive, data  # noqa: E402
+from app.data import EmissionData, GenerationMixData  # noqa: E402
+
+from tests.conftest import use_fake_redis  # noqa: E402
+
+from .energinet import StubEnerginet, load  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def energinet():
+    """Points the app at the stub for the whole session."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        now = np.datetime64('now', 'm')
+        stub = StubEnerginet(load(now - now.astype(np.int64) % 5))
+        monkeypatch.setattr(data, 'BASE_URL', stub.start().base_url)
+        yield stub
+        stub.stop()
+
+
+@pytest.fixture(scope='session')
+def emission_data(energinet):
+    return EmissionData.build()
+
+
+@pytest.fixture(scope='session')
+def generation_mix_data(energinet):
+    return GenerationMixData.build()
+
+
+@pytest.fixture
+def fake_cache(monkeypatch, tmp_path, energinet):
+    monkeypatch.setattr(archive, 'ARCHIVE_DIRECTORY', str(tmp_path))
+    return use_fake_redis(monkeypatch)
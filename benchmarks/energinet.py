@@ -0,0 +1,160 @@
+"""Replays recorded Energinet responses from a local stub server, so that benchmarks never depend on Energinet.
+
+Responses are recorded with `python -m benchmarks.energinet record`, which stores what Energinet currently returns for
+the data sets we use in benchmarks/recordings. When replaying, all times are shifted so that the most recent
+measurement is the current time, since building data only asks for recent data, relative to the current time. Without
+recordings, e.g. in a fresh checkout, the stub serves synthetic data of the same shape and size instead, generated from
+a fixed seed so that every run sees the same data.
+
+The stub answers the queries we make the way Energinet does: records come newest first, and can be limited by start,
+end and limit parameters. Responses are encoded once per query, so that serving them costs as little as possible of the
+time measured on the client side.
+"""
+import functools
+import gzip
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from app import data
+from app.data import EMISSION_MIX_RESOURCE, FORECAST_RESOURCE, HISTORY_RESOURCE, PRICE_AREAS
+
+RECORDINGS = os.path.join(os.path.dirname(__file__), 'recordings')
+
+# How much data to record or synthesize: four days of history, which covers the two days we keep with room for
+# rebuilds, and the forecast from six hours ago, as far ahead as there is one.
+HISTORY_ROWS = 4 * 24 * 12
+FORECAST_START = np.timedelta64(6, 'h')
+FORECAST_ROWS = 48 * 12
+GENERATION_MIX_ROWS = 24
+
+STEP = np.timedelta64(5, 'm')
+
+
+def record():
+    """Records the current Energinet responses for all data sets the benchmarks use."""
+    os.makedirs(RECORDINGS, exist_ok=True)
+    now = np.datetime64('now', 'm')
+    queries = {HISTORY_RESOURCE: f'limit={HISTORY_ROWS * len(PRICE_AREAS)}',
+               FORECAST_RESOURCE: f'start={now - FORECAST_START}&timezone=utc&limit=0',
+               EMISSION_MIX_RESOURCE: f'fields={data.GENERATION_MIX_FIELDS}&sort={data.GENERATION_MIX_SORT}'
+                                      f'&limit={GENERATION_MIX_ROWS}'}
+    for resource, query in queries.items():
+        records = data.get_json(f'{data.BASE_URL}/{resource}?{query}')['records']
+        with gzip.open(os.path.join(RECORDINGS, f'{resource}.json.gz'), 'wt') as f:
+            json.dump(records, f)
+        print(f'Recorded {len(records)} records of {resource}')
+
+
+def load(now):
+    """Loads the recorded responses, keyed by data set, with times shifted so that the last measurement is at now, or
+    synthetic responses if there are no recordings."""
+    paths = {resource: os.path.join(RECORDINGS, f'{resource}.json.gz')
+             for resource in (HISTORY_RESOURCE, FORECAST_RESOURCE, EMISSION_MIX_RESOURCE)}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return synthesize(now)
+    recordings = {}
+    for resource, path in paths.items():
+        with gzip.open(path, 'rt') as f:
+            recordings[resource] = json.load(f)
+    shift = now - np.datetime64(recordings[HISTORY_RESOURCE][0]['Minutes5UTC'], 'm')
+    for records in recordings.values():
+        for record in records:
+            for field in ('Minutes5UTC', 'Minutes5DK', 'TimeUTC', 'TimeDK'):
+                if field in record:
+                    record[field] = str(np.datetime64(record[field], 's') + shift)
+    return recordings
+
+
+def synthesize(now):
+    """Generates responses shaped like Energinet's, with a daily cycle, noise, and a difference between the areas."""
+    rng = np.random.default_rng(2017)
+
+    def intensities(times, offset):
+        hours = (times - times.astype('datetime64[D]')) / np.timedelta64(1, 'h')
+        return np.round(offset + 60 * np.sin(2 * np.pi * (hours - 8) / 24) + rng.normal(0, 8, len(times)), 6)
+
+    def records(times):
+        # Newest first, as Energinet returns them, with the areas interleaved.
+        times = times[::-1]
+        values = {area: intensities(times, offset) for area, offset in zip(PRICE_AREAS, (220, 140))}
+        return [{'Minutes5UTC': str(time.astype('datetime64[s]')),
+                 'Minutes5DK': str((time + np.timedelta64(2, 'h')).astype('datetime64[s]')),
+                 'PriceArea': area, 'CO2Emission': float(values[area][i])}
+                for i, time in enumerate(times) for area in PRICE_AREAS]
+
+    history = now - np.arange(HISTORY_ROWS)[::-1] * STEP
+    forecast = now - FORECAST_START + np.arange(FORECAST_ROWS) * STEP
+    hours = now.astype('datetime64[h]') - np.arange(GENERATION_MIX_ROWS // len(PRICE_AREAS)) * np.timedelta64(1, 'h')
+    fields = data.GENERATION_MIX_FIELDS.split(',')[2:]
+    mix = [{'TimeDK': str((hour + np.timedelta64(2, 'h')).astype('datetime64[s]')), 'PriceArea': area,
+            **{field: round(float(rng.uniform(-500, 1500)), 2) for field in fields}}
+           for hour in hours for area in PRICE_AREAS]
+    return {HISTORY_RESOURCE: records(history), FORECAST_RESOURCE: records(forecast),
+            EMISSION_MIX_RESOURCE: mix}
+
+
+class StubEnerginet(ThreadingHTTPServer):
+    """Serves the given responses, keyed by data set, on a free local port."""
+
+    daemon_threads = True
+
+    def __init__(self, recordings):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.recordings = recordings
+        self.respond = functools.lru_cache(maxsize=None)(self._respond)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_port}/dataset/'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _respond(self, resource, query):
+        records = self.recordings.get(resource)
+        if records is None:
+            return None
+        params = dict(parse_qsl(query))
+        time_field = 'Minutes5UTC' if 'Minutes5UTC' in records[0] else 'TimeDK'
+        if 'start' in params:
+            records = [record for record in records if record[time_field] >= params['start']]
+        if 'end' in params:
+            records = [record for record in records if record[time_field] < params['end']]
+        if int(params.get('limit', 100)) > 0:
+            records = records[:int(params.get('limit', 100))]
+        return json.dumps({'total': len(records), 'records': records}).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        body = self.server.respond(url.path.rstrip('/').split('/')[-1], url.query)
+        self.send_response(200 if body is not None else 404)
+        body = body if body is not None else b'{}'
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['record']:
+        record()
+    else:
+        print('Usage: python -m benchmarks.energinet record')
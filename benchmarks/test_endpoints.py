@@ -0,0 +1,52 @@
+"""Benchmarks of the throughput of the API, with a warm cache, as seen by the WSGI app."""
+import pytest
+
+from app import cache
+from app.app import app
+
+# Every round of a benchmark makes this many requests, so that the time of a round is dominated by serving requests.
+REQUESTS_PER_ROUND = 100
+
+PATHS = ['/api/v2/current-emission-intensity', '/api/v2/current-generation-mix', '/api/v1/next-day',
+         '/api/v1/greenest-period/3/24']
+
+
+@pytest.fixture
+def client(fake_cache):
+    cache._update_data()
+    cache._update_generation_mix()
+    return app.test_client()
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_throughput(benchmark, client, path) -> None:
+    def serve():
+        for _ in range(REQUESTS_PER_ROUND):
+            response = client.get(path, headers={'Accept-Encoding': 'gzip, br'})
+        return response
+
+    assert benchmark(serve).status_code == 200
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_throughput_of_revalidation(benchmark, client, path) -> None:
+    etag = client.get(path, headers={'Accept-Encoding': 'gzip, br'}).headers['ETag']
+
+    def serve():
+        for _ in range(REQUESTS_PER_ROUND):
+            response = client.get(path, headers={'Accept-Encoding': 'gzip, br', 'If-None-Match': etag})
+        return response
+
+    assert benchmark(serve).status_code == 304
+
+
+def test_throughput_with_plot(benchmark, client) -> None:
+    # The first version of the API, whose plot specifications are rendered once per worker and version.
+    client.get('/api/v1/current-emission-intensity')
+
+    def serve():
+        for _ in range(REQUESTS_PER_ROUND):
+            response = client.get('/api/v1/current-emission-intensity', headers={'Accept-Encoding': 'gzip'})
+        return response
+
+    assert benchmark(serve).status_code == 200
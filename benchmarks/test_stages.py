@@ -0,0 +1,162 @@
+"""Benchmarks of each stage of building and serving the data, from fetching it from Energinet to caching the result."""
+import json
+
+import numpy as np
+import pytest
+
+from app import cache, charts, data, frames, scheduling, snapshot
+from app.data import (FORECAST_RESOURCE, HISTORY_RESOURCE, PRICE_AREAS, ROWS_PER_AREA, EmissionData,
+                      GenerationMixData, parse_emission_intensities)
+from app.model import (EmissionIntensityModel, GenerationMixModel, build_current_generation_mix, build_model,
+                       build_model_with_plot)
+from app.responses import render
+from app.windows import ForecastWindows, best_period, overview_next_day
+
+
+def _history_url():
+    return f'{data.BASE_URL}/{HISTORY_RESOURCE}?limit={ROWS_PER_AREA * len(PRICE_AREAS)}'
+
+
+def test_fetch_history(benchmark, energinet) -> None:
+    records = benchmark(data.get_json, _history_url())['records']
+    assert len(records) == ROWS_PER_AREA * len(PRICE_AREAS)
+
+
+def test_parse_history(benchmark, energinet) -> None:
+    records = data.get_json(_history_url())['records']
+    areas = benchmark(parse_emission_intensities, records, 'Målt')
+    assert set(areas) == set(PRICE_AREAS)
+
+
+def test_parse_forecast(benchmark, energinet) -> None:
+    records = data.get_json(f'{data.BASE_URL}/{FORECAST_RESOURCE}?limit=0')['records']
+    benchmark(parse_emission_intensities, records, 'Prognose')
+
+
+def test_build_emission_data(benchmark, energinet) -> None:
+    areas = benchmark(EmissionData.build)
+    assert all(len(area.df_history) == data.HISTORY_LENGTH for area in areas.values())
+
+
+def test_extend_emission_data(benchmark, emission_data) -> None:
+    # What the refresher does every few minutes: the histories are read from the cache, and only the newest history is
+    # downloaded.
+    buffers = {area: frames.serialize(area_data) for area, area_data in emission_data.items()}
+    benchmark(lambda: EmissionData.build({area: frames.read_history(buffer) for area, buffer in buffers.items()}))
+
+
+def test_emission_intensity_model(benchmark, emission_data) -> None:
+    benchmark(EmissionIntensityModel, emission_data['DK2'])
+
+
+def test_build_model(benchmark, emission_data) -> None:
+    benchmark(build_model, emission_data['DK2'])
+
+
+def test_forecast_windows(benchmark, emission_data) -> None:
+    benchmark(ForecastWindows.build, emission_data['DK2'].df_forecast)
+
+
+def test_best_period(benchmark, emission_data) -> None:
+    windows = ForecastWindows.build(emission_data['DK2'].df_forecast)
+    assert benchmark(best_period, windows, 3, 24)['success']
+
+
+def test_overview_next_day(benchmark, emission_data) -> None:
+    windows = ForecastWindows.build(emission_data['DK2'].df_forecast)
+    benchmark(overview_next_day, windows)
+
+
+@pytest.mark.parametrize('size', [1, 100, 1000])
+@pytest.mark.parametrize('profiles', [False, True])
+def test_schedule_jobs(benchmark, emission_data, size, profiles) -> None:
+    windows = ForecastWindows.build(emission_data['DK2'].df_forecast)
+    rng = np.random.default_rng(0)
+    jobs = []
+    for _ in range(size):
+        steps = int(rng.integers(1, 12 * 8))
+        jobs.append({'duration': steps * 5, 'earliest-start': str(windows.times_utc[0]),
+                     **({'profile': rng.uniform(0, 11, steps).tolist()} if profiles else {})})
+    jobs = scheduling.parse_jobs({'jobs': jobs})
+    assert all(job['success'] for job in benchmark(scheduling.schedule, windows, jobs)['jobs'])
+
+
+def test_emission_intensity_plot(benchmark, emission_data) -> None:
+    model = EmissionIntensityModel(emission_data['DK2'])
+    benchmark(lambda: model.plot().to_dict())
+
+
+def test_build_model_with_plot(benchmark, emission_data) -> None:
+    benchmark(build_model_with_plot, emission_data['DK2'])
+
+
+def test_build_generation_mix(benchmark, energinet) -> None:
+    benchmark(build_current_generation_mix)
+
+
+def test_generation_mix_model(benchmark, generation_mix_data: GenerationMixData) -> None:
+    benchmark(GenerationMixModel, generation_mix_data)
+
+
+def test_generation_mix_plot(benchmark, generation_mix_data: GenerationMixData) -> None:
+    model = GenerationMixModel(generation_mix_data)
+    benchmark(lambda: model.plot().to_dict())
+
+
+def test_render_model(benchmark, emission_data) -> None:
+    model, _ = build_model(emission_data['DK2'])
+    benchmark(render, model)
+
+
+def test_render_model_with_plot(benchmark, emission_data) -> None:
+    model = build_model_with_plot(emission_data['DK2'])
+    benchmark(render, model)
+
+
+def test_json_encode_model(benchmark, emission_data) -> None:
+    # Plain encoding, for comparison with rendering, which also compresses.
+    model, _ = build_model(emission_data['DK2'])
+    benchmark(json.dumps, model)
+
+
+def test_serialize_frames(benchmark, emission_data) -> None:
+    benchmark(frames.serialize, emission_data['DK2'])
+
+
+def test_deserialize_frames(benchmark, emission_data) -> None:
+    benchmark(frames.deserialize, frames.serialize(emission_data['DK2']))
+
+
+def test_downsample_year(benchmark) -> None:
+    # What the chart of a year takes, from a year of five minute data points to a fixed number of points.
+    times = np.arange(365 * 288) * 5
+    values = 150 + 80 * np.sin(times / 3000) + np.random.default_rng(0).normal(0, 10, len(times))
+    assert len(benchmark(charts.lttb, times, values, charts.CHART_POINTS)) == charts.CHART_POINTS
+
+
+def test_pack_snapshot(benchmark, emission_data) -> None:
+    benchmark(snapshot.pack, emission_data['DK2'])
+
+
+def test_share_snapshot(benchmark, emission_data, tmp_path, monkeypatch) -> None:
+    # What a worker does on seeing a new version, once the first worker on the host has written the file.
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIRECTORY', str(tmp_path))
+    buffer = snapshot.pack(emission_data['DK2'])
+    snapshot.share('dk2', buffer)
+    benchmark(snapshot.share, 'dk2', buffer)
+
+
+def test_cache_round_trip(benchmark, fake_cache, emission_data) -> None:
+    model, windows = build_model(emission_data['DK2'])
+    values = {'model': render(model), 'data': frames.serialize(emission_data['DK2']), 'windows': windows}
+
+    def round_trip():
+        cache._set(cache.EMISSION_INTENSITY, values)
+        return [cache.cache.get(identifier) for identifier in values]
+
+    assert all(entry is not None for entry in benchmark(round_trip))
+
+
+def test_update_data(benchmark, fake_cache, emission_data) -> None:
+    # A complete rebuild as done by the refresher, including downloading, archiving and caching.
+    benchmark(cache._update_data)
@@ -0,0 +1,57 @@
+"""Puts load on a running instance of the app, for comparing the WSGI and the ASGI entry points (see README.md).
+
+Clients request the endpoints which the web app polls, spread evenly, from a fixed number of concurrent connections.
+With --revalidate, clients send back the ETag they got, as browsers do, and mostly get 304s back.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import httpx
+import numpy as np
+
+PATHS = ['/api/v2/current-emission-intensity', '/api/v2/current-generation-mix', '/api/v1/next-day',
+         '/api/v1/next-day-short', '/api/v1/greenest-period/3/24', '/api/v2/current-emission-intensity?area=DK1']
+
+
+async def run(base_url, total, concurrency, revalidate):
+    paths = itertools.islice(itertools.cycle(PATHS), total)
+    etags = {}
+    latencies = []
+    errors = 0
+
+    async def client_loop(client):
+        nonlocal errors
+        for path in paths:
+            headers = {'Accept-Encoding': 'gzip, br'}
+            if revalidate and path in etags:
+                headers['If-None-Match'] = etags[path]
+            start = time.perf_counter()
+            try:
+                response = await client.get(path, headers=headers)
+                if response.status_code not in (200, 304):
+                    errors += 1
+                etags[path] = response.headers.get('ETag', '')
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    milliseconds = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f'{len(latencies)} requests in {elapsed:.1f} s: {len(latencies) / elapsed:.0f} requests/s, '
+          f'p50 {milliseconds[0]:.1f} ms, p95 {milliseconds[1]:.1f} ms, p99 {milliseconds[2]:.1f} ms, {errors} errors')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('base_url', help='e.g. http://localhost:8000')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--revalidate', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(run(args.base_url, args.requests, args.concurrency, args.revalidate))
@@ -1,2 +1,7 @@
 #!/bin/sh
+# With SERVER=asgi, the app is served by the ASGI app in app/asgi.py rather than by the WSGI app. Note that uwsgi speaks
+# the uwsgi protocol on the socket, whereas the ASGI server speaks HTTP, so the proxy in front needs to match.
+if [ "$SERVER" = asgi ]; then
+    exec gunicorn app.asgi:app -k uvicorn.workers.UvicornWorker --workers 2 --bind 0.0.0.0:3031
+fi
 uwsgi --socket 0.0.0.0:3031 -w wsgi --callable app --processes 2 --threads 2
@@ -0,0 +1,79 @@
+"""Fixtures shared by the tests, and by the benchmarks (see benchmarks/conftest.py)."""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fakeredis
+import pytest
+from cachelib import RedisCache
+
+from app import async_cache, cache, subscriptions
+
+
+def use_fake_redis(monkeypatch):
+    """Replaces Redis by a fake one, shared by the synchronous and the asyncio client, and starts from an empty local
+    cache, returning the synchronous client."""
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(cache, 'redis_client', client)
+    monkeypatch.setattr(cache, 'cache', RedisCache(client))
+    monkeypatch.setattr(cache, 'local_cache', {})
+    monkeypatch.setattr(async_cache, 'redis_client', fakeredis.aioredis.FakeRedis(server=server))
+    return client
+
+
+@pytest.fixture
+def fake_cache(monkeypatch):
+    return use_fake_redis(monkeypatch)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(subscriptions, 'DB_PATH', os.path.join(tmp_path, 'subs.db'))
+    monkeypatch.setattr(subscriptions, '_connection', None)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every post with the status and body which the server's respond function gives for its path and body,
+    keeping track of the path, headers and body of each."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, {k.lower(): v for k, v in self.headers.items()}, body))
+        status, response = self.server.respond(self.path, body)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # We get as many concurrent connections as a dispatcher has workers (see e.g. app.push.PUSH_WORKERS).
+    request_queue_size = 64
+
+
+@pytest.fixture
+def stub_server():
+    """Starts local HTTP servers standing in for external services, e.g. a push service or Slack.
+
+    Call it with a function that, given the path and body of a post, returns the status and body to answer with. The
+    server it returns has the url to point the app at, and the requests it has received.
+    """
+    servers = []
+
+    def start(respond):
+        server = StubServer(('127.0.0.1', 0), StubHandler)
+        server.url = f'http://127.0.0.1:{server.server_port}'
+        server.respond = respond
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import archive, data
+
+
+@pytest.fixture
+def archive_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_DIRECTORY', str(tmp_path))
+    return tmp_path
+
+
+MEASURED = archive.series(archive.MEASURED, 'DK2')
+FORECAST = archive.series(archive.FORECAST, 'DK2')
+
+
+def _times(start, periods):
+    return pd.date_range(start, periods=periods, freq='5min').values
+
+
+def test_written_values_are_read_back_with_gaps_as_nan(archive_directory) -> None:
+    archive.write(MEASURED, _times('2020-01-01 00:10', 3), [1.0, 2.0, 3.0])
+    archive.write(MEASURED, _times('2020-01-01 00:30', 2), [5.0, 6.0])
+
+    times, values = archive.read(MEASURED, '2020-01-01 00:05', '2020-01-01 00:40')
+
+    assert list(times) == list(_times('2020-01-01 00:05', 7))
+    np.testing.assert_array_equal(values, [np.nan, 1, 2, 3, np.nan, 5, 6])
+
+
+def test_rewritten_values_replace_old_ones(archive_directory) -> None:
+    archive.write(FORECAST, _times('2020-01-01', 4), [1.0, 2.0, 3.0, 4.0])
+    archive.write(FORECAST, _times('2020-01-01 00:05', 2), [20.0, 30.0])
+
+    _, values = archive.read(FORECAST, '2020-01-01')
+
+    np.testing.assert_array_equal(values, [1, 20, 30, 4])
+
+
+def test_reading_missing_series_gives_nothing(archive_directory) -> None:
+    times, values = archive.read(MEASURED, '2020-01-01', '2021-01-01')
+    assert len(times) == len(values) == 0
+
+
+def test_backfill_only_downloads_incomplete_months(archive_directory, monkeypatch) -> None:
+    downloads = []
+
+    def download(resource, start, end):
+        downloads.append((resource, start))
+        periods = (pd.Timestamp(end) - pd.Timestamp(start)) // pd.Timedelta('5min')
+        times = pd.date_range(start, periods=periods, freq='5min')
+        df = pd.DataFrame({'Minutes5UTC': times, 'CO2Emission': np.arange(len(times), dtype=float)})
+        return {'DK1': df, 'DK2': df}
+
+    monkeypatch.setattr(archive, 'download_emission_intensities', download)
+    for area in ['DK1', 'DK2']:
+        times = pd.date_range('2020-01-01', periods=31 * 288, freq='5min').values
+        archive.write(archive.series(archive.MEASURED, area), times, np.ones(31 * 288))
+
+    archive.backfill('2020-01-15', '2020-03-01')
+
+    assert downloads == [(archive.MEASURED, pd.Timestamp('2020-02-01')),
+                         (archive.FORECAST, pd.Timestamp('2020-01-01')),
+                         (archive.FORECAST, pd.Timestamp('2020-02-01'))]
+    _, values = archive.read(MEASURED, '2020-01-01', '2020-03-01')
+    assert not np.isnan(values).any()
+    assert values[0] == 1 and values[31 * 288] == 0
+
+
+def test_store_archives_history_and_forecast(archive_directory) -> None:
+    history = pd.DataFrame({'Minutes5UTC': _times('2020-01-01', 3), 'CO2Emission': [1.0, 2.0, 3.0]})
+    forecast = pd.DataFrame({'Minutes5UTC': _times('2020-01-01 00:10', 3), 'CO2Emission': [3.0, 4.0, 5.0]})
+
+    archive.store(data.EmissionData(history, forecast), 'DK2')
+
+    np.testing.assert_array_equal(archive.read(MEASURED, '2020-01-01')[1], [1, 2, 3])
+    np.testing.assert_array_equal(archive.read(FORECAST, '2020-01-01 00:10')[1], [np.nan, 4, 5])
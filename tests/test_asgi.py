@@ -0,0 +1,135 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+from app import archive, async_cache, cache, model, stream
+from app.asgi import app
+from app.areas import COMBINED_PRICE_AREA, GENERATION_MIX_AREAS
+from app.responses import render
+
+
+@pytest.fixture
+def fake_cache(fake_cache, monkeypatch):
+    monkeypatch.setattr(stream, 'async_broadcaster', stream.AsyncBroadcaster())
+    return fake_cache
+
+
+@pytest.fixture
+def slow_build(monkeypatch):
+    """Replaces the generation mix builder by a slow one keeping track of how often it is called."""
+    calls = []
+
+    def build():
+        calls.append(1)
+        time.sleep(0.2)
+        return {area: {'success': True, 'build': len(calls)} for area in GENERATION_MIX_AREAS}, None
+
+    monkeypatch.setattr(model, 'build_current_generation_mix', build)
+    return calls
+
+
+async def _get_all(paths, **kwargs):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        return await asyncio.gather(*[client.get(path, **kwargs) for path in paths])
+
+
+def test_concurrent_misses_build_only_once(fake_cache, slow_build) -> None:
+    responses = asyncio.run(_get_all(['/api/v2/current-generation-mix'] * 8))
+    assert len(slow_build) == 1
+    assert [response.json() for response in responses] == [{'success': True, 'build': 1}] * 8
+
+
+def test_waiting_requests_are_woken_by_the_new_version(fake_cache) -> None:
+    # Somebody else holds the lock, and caches the data a little later.
+    token = cache._acquire_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+    identifier = cache._in_area(cache.GENERATION_MIX_IDENTIFIER, COMBINED_PRICE_AREA)
+
+    def build():
+        time.sleep(0.2)
+        cache._set(cache.GENERATION_MIX, {identifier: render({'success': True})})
+
+    threading.Thread(target=build).start()
+    start = time.time()
+    responses = asyncio.run(_get_all(['/api/v2/current-generation-mix'] * 4))
+    # Without the announcement, requests would only give up waiting once the lease runs out.
+    assert time.time() - start < 2
+    assert [response.json() for response in responses] == [{'success': True}] * 4
+    cache._release_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER, token)
+
+
+def test_failed_background_rebuilds_are_reported(fake_cache, capsys) -> None:
+    def update():
+        raise RuntimeError('Energinet is down')
+
+    async def refresh():
+        await async_cache._refresh_in_background(cache.GENERATION_MIX, update)
+        errors = ''
+        deadline = time.time() + 5
+        while 'RuntimeError: Energinet is down' not in errors and time.time() < deadline:
+            await asyncio.sleep(0.01)
+            errors += capsys.readouterr().err
+        return errors
+
+    assert 'RuntimeError: Energinet is down' in asyncio.run(refresh())
+    assert not fake_cache.exists(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+
+
+def test_responses_are_negotiated_like_the_wsgi_app(fake_cache, slow_build) -> None:
+    first, = asyncio.run(_get_all(['/api/v2/current-generation-mix'], headers={'Accept-Encoding': 'gzip'}))
+    assert first.headers['Content-Encoding'] == 'gzip'
+    second, = asyncio.run(_get_all(['/api/v2/current-generation-mix'],
+                                   headers={'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']}))
+    assert second.status_code == 304
+    assert second.content == b''
+
+
+def test_unknown_price_areas_are_rejected(fake_cache, slow_build) -> None:
+    response, = asyncio.run(_get_all(['/api/v2/current-generation-mix?area=SE3']))
+    assert response.json() == {'success': False, 'error': 'Price area must be one of DK, DK1, DK2.'}
+    assert not slow_build
+
+
+def test_stream_starts_with_current_versions(fake_cache) -> None:
+    entries = cache._set(cache.GENERATION_MIX, {'item': render({})})
+
+    async def first_event():
+        events = stream.async_events()
+        try:
+            return await events.__anext__()
+        finally:
+            await events.aclose()
+
+    event = asyncio.run(first_event())
+    assert json.loads(event[len('data: '):]) == {'dataset': 'generation-mix', 'version': entries['item'][2]}
+
+
+def test_history_is_answered_like_the_wsgi_app(fake_cache, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(archive, 'ARCHIVE_DIRECTORY', str(tmp_path))
+    cache._set(cache.EMISSION_INTENSITY, {cache._in_area(cache.QUINTILES_IDENTIFIER, area): None
+                                          for area in cache.PRICE_AREAS})
+    unknown, invalid = asyncio.run(_get_all(['/api/v1/history/greenest-window?days=90',
+                                             '/api/v1/history/hourly?days=90']))
+    assert unknown.json() == {'success': False, 'error': 'There is no history for the given number of days.'}
+    assert invalid.json() == {'success': False, 'error': 'Days must be between 1 and 31.'}
+
+
+def test_jobs_are_scheduled_like_the_wsgi_app(fake_cache) -> None:
+    async def post(body):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+            return (await client.post('/api/v1/schedule', content=body)).json()
+
+    assert asyncio.run(post(b'[]')) == {'success': False, 'error': 'Body must be a JSON object with a list of jobs.'}
+    assert asyncio.run(post(b'{')) == {'success': False, 'error': 'Body must be a JSON object with a list of jobs.'}
+
+
+def test_charts_are_served_like_the_wsgi_app(fake_cache) -> None:
+    cache._set(cache.EMISSION_INTENSITY, {cache._chart_identifier('month', area): render({'area': area})
+                                          for area in cache.PRICE_AREAS})
+    chart, invalid = asyncio.run(_get_all(['/api/v2/emission-intensity-chart?range=month&area=DK1',
+                                           '/api/v2/emission-intensity-chart?range=day']))
+    assert chart.json() == {'area': 'DK1'}
+    assert invalid.json() == {'success': False, 'error': 'Range must be one of week, month, year.'}
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app import cache, model
+from app.areas import COMBINED_PRICE_AREA, GENERATION_MIX_AREAS
+from app.responses import render
+
+
+def get_current_generation_mix():
+    return json.loads(cache.get_current_generation_mix_response().value.body)
+
+
+@pytest.fixture
+def slow_build(monkeypatch):
+    """Replaces the generation mix builder by a slow one keeping track of how often it is called."""
+    calls = []
+
+    def build():
+        calls.append(1)
+        time.sleep(0.2)
+        return {area: {'success': True, 'build': len(calls)} for area in GENERATION_MIX_AREAS}, None
+
+    monkeypatch.setattr(model, 'build_current_generation_mix', build)
+    return calls
+
+
+def test_concurrent_misses_build_only_once(fake_cache, slow_build) -> None:
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_current_generation_mix()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(slow_build) == 1
+    assert results == [{'success': True, 'build': 1}] * 8
+
+
+def test_stale_data_is_served_while_rebuilding(fake_cache, slow_build) -> None:
+    stale = cache.Dataset('generation-mix', cache.GENERATION_MIX_LOCK_IDENTIFIER,
+                          cache.GENERATION_MIX_VERSION_IDENTIFIER, -1, 60)
+    identifier = cache._in_area(cache.GENERATION_MIX_IDENTIFIER, COMBINED_PRICE_AREA)
+    cache._set(stale, {identifier: render({'success': True, 'build': 0})})
+    start = time.time()
+    results = [get_current_generation_mix() for _ in range(5)]
+    assert time.time() - start < 0.2
+    assert results == [{'success': True, 'build': 0}] * 5
+    time.sleep(0.5)
+    assert len(slow_build) == 1
+    assert get_current_generation_mix() == {'success': True, 'build': 1}
+
+
+def test_expired_lock_of_crashed_builder_is_taken_over(fake_cache, slow_build) -> None:
+    fake_cache.set(cache.GENERATION_MIX_LOCK_IDENTIFIER, 'crashed', px=300)
+    assert get_current_generation_mix() == {'success': True, 'build': 1}
+
+
+def test_lock_is_only_released_by_its_holder(fake_cache) -> None:
+    token = cache._acquire_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+    assert token is not None
+    assert cache._acquire_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER) is None
+    cache._release_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER, 'somebody else')
+    assert fake_cache.exists(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+    cache._release_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER, token)
+    assert not fake_cache.exists(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+
+
+def test_lease_is_renewed_while_building(fake_cache, monkeypatch) -> None:
+    # A build outlasting the lease, as when Energinet is slow and requests are retried, keeps the lock to itself.
+    monkeypatch.setattr(cache, 'LOCK_LEASE', 0.2)
+    token = cache._acquire_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+    builder = threading.Thread(target=cache._build, args=(cache.GENERATION_MIX_LOCK_IDENTIFIER, token,
+                                                         lambda: time.sleep(0.6)))
+    builder.start()
+    time.sleep(0.4)
+    assert cache._acquire_lock(cache.GENERATION_MIX_LOCK_IDENTIFIER) is None
+    builder.join()
+    assert not fake_cache.exists(cache.GENERATION_MIX_LOCK_IDENTIFIER)
+
+
+def test_worker_memory_is_used_until_version_changes(fake_cache, slow_build, monkeypatch) -> None:
+    first = cache.get_current_generation_mix_response()
+    # Simply looking up the current version should be all it takes to get the item from memory.
+    redis_cache = cache.cache
+    monkeypatch.setattr(cache, 'cache', None)
+    assert cache.get_current_generation_mix_response() is first
+    monkeypatch.setattr(cache, 'cache', redis_cache)
+    cache.refresh_generation_mix()
+    assert cache.get_current_generation_mix_response().value.body == b'{"success":true,"build":2}'
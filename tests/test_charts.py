@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import archive, cache, charts
+from app.app import app
+from app.data import EMISSION_TYPES, EmissionData
+from app.responses import render
+
+NOW = pd.Timestamp('2021-06-30 12:00')
+
+
+def _frame(times, values, type_):
+    return pd.DataFrame({'Minutes5UTC': times,
+                         'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                         'CO2Emission': values,
+                         'Type': pd.Categorical([type_] * len(times), categories=EMISSION_TYPES)})
+
+
+@pytest.fixture
+def emission_data(tmp_path, monkeypatch):
+    """Two months of measurements, the last two days of which are in the current data along with a forecast."""
+    monkeypatch.setattr(archive, 'ARCHIVE_DIRECTORY', str(tmp_path))
+    times = pd.date_range(NOW - pd.Timedelta(days=60), NOW, freq='5min')
+    noise = np.random.default_rng(0).normal(0, 5, len(times))
+    values = np.round(150 + 80 * np.sin(np.arange(len(times)) / 300) + noise)
+    # A spike which any chart should show, and a gap in the archive.
+    values[len(times) - 3 * 288] = 900
+    values[len(times) - 5 * 288:len(times) - 4 * 288] = np.nan
+    archive.write(archive.series(archive.MEASURED, 'DK1'), times.values[:-576], values[:-576].astype('f4'))
+    forecast_times = pd.date_range(NOW, periods=400, freq='5min')
+    forecast = np.round(200 + 50 * np.cos(np.arange(400) / 40))
+    forecast[0] = values[-1]
+    return EmissionData(_frame(times[-576:], values[-576:], 'Målt'), _frame(forecast_times, forecast, 'Prognose'))
+
+
+def test_lttb_keeps_the_shape_of_the_series() -> None:
+    x = np.arange(10000)
+    y = np.sin(x / 500) * 100
+    y[1234], y[5678] = 500, -500
+    picked = charts.lttb(x, y, 200)
+    assert len(picked) == 200
+    assert picked[0] == 0 and picked[-1] == 9999 and (np.diff(picked) > 0).all()
+    assert 1234 in picked and 5678 in picked
+    assert charts.lttb(x[:50], y[:50], 200).tolist() == list(range(50))
+
+
+def test_charts_are_downsampled_to_a_fixed_number_of_points(emission_data) -> None:
+    for days in charts.CHART_RANGES.values():
+        chart = charts.build_chart(emission_data, 'DK1', days)
+        times, start = np.array(chart['times']), chart['forecast-start']
+        assert len(times) <= charts.CHART_POINTS
+        assert (np.diff(times[:start]) > 0).all() and (np.diff(times[start:]) > 0).all()
+        assert times[0] >= (NOW - pd.Timedelta(days=days)).value // 1000000
+        assert times[-1] == emission_data.df_forecast.Minutes5UTC.max().value // 1000000
+        # The lines of the history and the forecast meet where the forecast starts.
+        assert times[start - 1] == times[start] == chart['now']
+        assert max(chart['intensities'][:start]) == 900
+    # The history, less the gap, and the forecast get their share of the points each.
+    history = 7 * 288 + 1 - 288
+    week = charts.build_chart(emission_data, 'DK1', 7)
+    assert week['forecast-start'] == charts.CHART_POINTS * history // (history + 400)
+
+
+def test_charts_are_served_from_the_cache(fake_cache) -> None:
+    cache._set(cache.EMISSION_INTENSITY, {cache._chart_identifier(name, area): render({'range': name, 'area': area})
+                                          for name in charts.CHART_RANGES for area in cache.PRICE_AREAS})
+    test_client = app.test_client()
+
+    assert test_client.get('/api/v2/emission-intensity-chart').get_json() == {'range': 'week', 'area': 'DK2'}
+    response = test_client.get('/api/v2/emission-intensity-chart?range=Year&area=dk1')
+    assert response.get_json() == {'range': 'year', 'area': 'DK1'}
+    assert 'ETag' in response.headers
+    assert test_client.get('/api/v2/emission-intensity-chart?range=decade').get_json() == {
+        'success': False, 'error': 'Range must be one of week, month, year.'}
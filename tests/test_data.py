@@ -1,11 +1,17 @@
+import io
+import json
+
+import pandas as pd
 import pandas.api.types as ptypes
 import pytest
+
+from app import data, frames
 from app.data import EmissionData, GenerationMixData
 
 
 @pytest.fixture(scope="module")
 def emission_data():
-    return EmissionData.build()
+    return EmissionData.build()["DK2"]
 
 
 def test_emission_data_has_proper_type(emission_data: EmissionData) -> None:
@@ -72,3 +78,103 @@ def test_generation_mix_data_has_expected_columns(
         "Waste",
     }
     assert set(generation_mix_data.df_mix.columns) <= expected
+
+
+class FakeEnerginet:
+    """Serves emission intensities for a fixed point in time, keeping track of the queries it receives."""
+
+    def __init__(self, now):
+        self.now = now
+        self.queries = []
+        # The resources and price areas for which there is no data.
+        self.missing = set()
+
+    def records(self, resource, query):
+        params = dict(param.split('=', 1) for param in query.split('&'))
+        start = pd.Timestamp(params['start']) if 'start' in params else None
+        if resource == 'co2emis':
+            times = pd.date_range(end=self.now, periods=1000, freq='5min')
+        else:
+            times = pd.date_range(start=self.now - pd.Timedelta('1H'), periods=300, freq='5min')
+        times = [t for t in times[::-1] if start is None or t >= start]
+        records = [{'Minutes5UTC': t.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'Minutes5DK': (t + pd.Timedelta('2H')).strftime('%Y-%m-%dT%H:%M:%S'),
+                    'PriceArea': area,
+                    'CO2Emission': 100 + t.minute + offset}
+                   for t in times for area, offset in [('DK1', 200), ('DK2', 0)]
+                   if (resource, area) not in self.missing]
+        return records[:int(params['limit'])]
+
+    def get(self, url, **kwargs):
+        resource, query = url.split('/')[-1].split('?')
+        self.queries.append((resource, query))
+        return FakeResponse({'records': self.records(resource, query)})
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.raw = io.BytesIO(json.dumps(data).encode())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def fake_energinet(monkeypatch):
+    energinet = FakeEnerginet(pd.Timestamp.utcnow().tz_localize(None).floor('5min'))
+    monkeypatch.setattr(data.session, 'get', energinet.get)
+    return energinet
+
+
+def _histories(areas):
+    # The histories as the cache has them, which is how a rebuild gets them (see app.cache._update_data).
+    return {area: frames.read_history(frames.serialize(data)) for area, data in areas.items()}
+
+
+def test_emission_data_only_downloads_new_history(fake_energinet: FakeEnerginet) -> None:
+    previous = _histories(EmissionData.build())
+    fake_energinet.now += pd.Timedelta('15min')
+    fake_energinet.queries.clear()
+    emission_data = EmissionData.build(previous)['DK2']
+    history_queries = [query for resource, query in fake_energinet.queries if resource == 'co2emis']
+    assert len(history_queries) == 1 and 'start=' in history_queries[0]
+    assert len(emission_data.df_history) == 576
+    assert emission_data.df_history.Minutes5UTC.max() == fake_energinet.now
+    assert emission_data.df_history.Minutes5UTC.is_unique
+    assert (emission_data.df_history.Minutes5UTC.diff().dropna() == pd.Timedelta('5min')).all()
+    assert emission_data.df_forecast.Minutes5UTC.min() == fake_energinet.now
+
+
+def test_emission_data_downloads_everything_after_gap(fake_energinet: FakeEnerginet) -> None:
+    previous = _histories(EmissionData.build())
+    fake_energinet.now += pd.Timedelta('3D')
+    emission_data = EmissionData.build(previous)['DK2']
+    assert len(emission_data.df_history) == 576
+    assert emission_data.df_history.Minutes5UTC.max() == fake_energinet.now
+
+
+def test_emission_data_is_split_by_price_area(fake_energinet: FakeEnerginet) -> None:
+    areas = EmissionData.build()
+    assert set(areas) == {'DK1', 'DK2'}
+    # All areas come from the same requests, one for the history and one for the forecast.
+    assert len(fake_energinet.queries) == 2
+    for area, offset in [('DK1', 200), ('DK2', 0)]:
+        df_history = areas[area].df_history
+        assert len(df_history) == 576
+        assert (df_history.CO2Emission == 100 + df_history.Minutes5UTC.dt.minute + offset).all()
+
+
+@pytest.mark.parametrize('resource, error', [('co2emis', 'no emission intensity history for DK1'),
+                                             ('co2emisprog', 'no emission intensity forecast for DK1')])
+def test_emission_data_names_areas_without_data(fake_energinet: FakeEnerginet, resource, error) -> None:
+    fake_energinet.missing.add((resource, 'DK1'))
+    with pytest.raises(ValueError, match=error):
+        EmissionData.build()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import archive, distribution
+
+
+@pytest.fixture
+def archive_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_DIRECTORY', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def measurements(archive_directory):
+    times = pd.date_range('2019-01-01', periods=(365 * 3 + 1) * 288, freq='5min')
+    values = np.random.default_rng(0).gamma(4, 35, len(times))
+    archive.write(archive.series(archive.MEASURED, 'DK2'), times.values, values)
+    return pd.Series(archive.read(archive.series(archive.MEASURED, 'DK2'), '2019-01-01')[1], index=times)
+
+
+def test_quintiles_match_those_of_archived_values(measurements) -> None:
+    distribution.update('DK2')
+    expected = np.quantile(measurements['2021'], distribution.QUINTILES)
+    np.testing.assert_allclose(distribution.quintiles('DK2', 1, today='2022-01-01'), expected, atol=0.1)
+
+
+def test_daily_quintiles_are_those_of_daily_means(measurements) -> None:
+    distribution.update('DK2')
+    daily_means = measurements.groupby(measurements.index.floor('D')).mean()
+    expected = np.quantile(daily_means['2019-01-02':], distribution.QUINTILES)
+    np.testing.assert_allclose(distribution.quintiles('DK2', 3, daily=True, today='2022-01-01'), expected, rtol=1e-5)
+
+
+def test_incremental_updates_match_full_update(measurements) -> None:
+    def all_quintiles():
+        return [distribution.quintiles('DK2', daily=daily, today='2022-01-01') for daily in (False, True)]
+
+    distribution.update('DK2', None, '2021-06-30 12:00')
+    distribution.update('DK2', '2021-06-30 12:00', '2021-12-31 23:55')
+    incremental = all_quintiles()
+    # Updating the same days again must not count their values twice.
+    distribution.update('DK2', '2021-12-30', '2021-12-31')
+    assert all_quintiles() == incremental
+    distribution.update('DK2')
+    assert all_quintiles() == incremental
+
+
+def test_quintiles_are_unknown_without_enough_data(measurements) -> None:
+    distribution.update('DK2')
+    assert distribution.quintiles('DK2', today='2022-01-01') is not None
+    assert distribution.quintiles('DK2', today='2023-01-01') is None
+    assert distribution.quintiles('DK2', daily=True, today='2023-01-01') is None
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import frames
+from app.data import EmissionData
+
+
+@pytest.fixture
+def emission_data():
+    times = pd.date_range('2021-03-27 22:00', periods=48, freq='5min')
+    df = pd.DataFrame({'Minutes5UTC': times,
+                       'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                       'CO2Emission': [100.0 + i for i in range(48)],
+                       'Type': ['Målt'] * 36 + ['Prognose'] * 12})
+    return EmissionData(df.iloc[:36].reset_index(drop=True),
+                        df.iloc[35:].assign(Type='Prognose').reset_index(drop=True))
+
+
+def test_serialization_round_trips(emission_data: EmissionData) -> None:
+    data = frames.deserialize(frames.serialize(emission_data))
+    pd.testing.assert_frame_equal(data.df_history, emission_data.df_history)
+    pd.testing.assert_frame_equal(data.df_forecast, emission_data.df_forecast)
+
+
+def test_history_is_read_without_copying(emission_data: EmissionData) -> None:
+    buffer = frames.serialize(emission_data)
+    times, intensities = frames.read_history(buffer)
+    np.testing.assert_array_equal(times, emission_data.df_history.Minutes5UTC.to_numpy())
+    np.testing.assert_array_equal(intensities, emission_data.df_history.CO2Emission.to_numpy())
+    # Both arrays are views of the buffer.
+    start = np.frombuffer(buffer, dtype=np.uint8).ctypes.data
+    for array in [times, intensities]:
+        assert start <= array.ctypes.data and array.ctypes.data + array.nbytes <= start + len(buffer)
+
+
+def test_unknown_format_version_is_rejected(emission_data: EmissionData, monkeypatch) -> None:
+    buffer = frames.serialize(emission_data)
+    monkeypatch.setattr(frames, 'FORMAT_VERSION', frames.FORMAT_VERSION + 1)
+    with pytest.raises(ValueError):
+        frames.deserialize(buffer)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import archive, cache, history
+from app.app import app
+
+MEASURED = archive.series(archive.MEASURED, 'DK2')
+
+
+@pytest.fixture
+def archive_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_DIRECTORY', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def measurements(archive_directory):
+    times = pd.date_range('2021-01-01', periods=90 * 288, freq='5min')
+    values = np.random.default_rng(0).gamma(4, 35, len(times)).astype('f4')
+    # A day with a gap, which is left out, and a day with too little data to go by.
+    values[(times >= '2021-02-10 06:00') & (times < '2021-02-10 07:00')] = np.nan
+    values[(times >= '2021-02-11 02:00') & (times < '2021-02-11 12:00')] = np.nan
+    archive.write(MEASURED, times.values, values)
+    return pd.Series(values, index=times)
+
+
+def test_daily_rollups_match_the_archived_values(measurements) -> None:
+    history.update('DK2')
+    days = history.daily('DK2', 90, 3, today='2021-04-01')['days']
+    assert len(days) == 90
+    for day in [days[0], days[40], days[89]]:
+        values = measurements[day['date']]
+        assert day['mean'] == pytest.approx(values.mean(), abs=0.05)
+        assert day['min'] == pytest.approx(values.min(), abs=0.05)
+        assert day['max'] == pytest.approx(values.max(), abs=0.05)
+        rolling = values.rolling(36).mean().shift(-35)
+        assert day['greenest-start'] == f'{rolling.idxmin():%Y-%m-%dT%H:%M}Z'
+        assert day['greenest-intensity'] == pytest.approx(rolling.min(), abs=0.05)
+        assert day['blackest-start'] == f'{rolling.idxmax():%Y-%m-%dT%H:%M}Z'
+    assert days[40]['date'] == '2021-02-10' and days[40]['greenest-start'] is not None
+    assert days[41]['date'] == '2021-02-11' and days[41]['mean'] is None and days[41]['greenest-start'] is None
+
+
+def test_hourly_rollups_match_the_archived_values(measurements) -> None:
+    history.update('DK2')
+    hours = history.hourly('DK2', 2, today='2021-04-01')['hours']
+    assert len(hours) == 48
+    assert hours[0]['start'] == '2021-03-30T00:00Z'
+    values = measurements['2021-03-31 13:00':'2021-03-31 13:55']
+    assert hours[37]['mean'] == pytest.approx(values.mean(), abs=0.05)
+    assert hours[37]['max'] == pytest.approx(values.max(), abs=0.05)
+
+
+def test_incremental_updates_match_full_update(measurements) -> None:
+    def answers():
+        return [history.daily('DK2', 90, 2, today='2021-04-01'), history.hourly('DK2', 31, today='2021-04-01')]
+
+    history.update('DK2', None, '2021-02-10 12:00')
+    history.update('DK2', '2021-02-10 12:00', '2021-03-31 23:55')
+    incremental = answers()
+    history.update('DK2')
+    assert answers() == incremental
+
+
+def test_greenest_windows_are_summed_up(measurements) -> None:
+    history.update('DK2')
+    summary = history.greenest_windows('DK2', 30, 3, today='2021-04-01')
+    days = history.daily('DK2', 30, 3, today='2021-04-01')['days']
+    assert summary['days'] == 30
+    assert summary['mean-intensity'] == round(np.mean([day['mean'] for day in days]))
+    assert summary['greenest-intensity'] == round(np.mean([day['greenest-intensity'] for day in days]))
+    assert sum(summary['start-hours']) == 30
+    assert history.greenest_windows('DK2', 30, 3, today='2022-01-01')['success'] is False
+
+
+def test_profile_averages_by_hour_of_day_and_day_of_week(archive_directory) -> None:
+    times = pd.date_range('2021-03-01', periods=28 * 288, freq='5min')
+    archive.write(MEASURED, times.values, (times.dayofweek * 100 + times.hour).values.astype('f4'))
+    history.update('DK2')
+    profile = history.profile('DK2', 28, today='2021-03-29')
+    assert profile['hour-of-day'] == [300 + hour for hour in range(24)]
+    assert profile['day-of-week'] == [weekday * 100 + 11.5 for weekday in range(7)]
+
+
+def test_history_is_served_from_the_cache(archive_directory, fake_cache) -> None:
+    today = pd.Timestamp.utcnow().tz_localize(None).floor('D')
+    times = pd.date_range(today - pd.Timedelta(days=7), periods=7 * 288, freq='5min')
+    archive.write(MEASURED, times.values, np.full(len(times), 100, dtype='f4'))
+    history.update('DK2')
+    cache._set(cache.EMISSION_INTENSITY, {cache._in_area(cache.QUINTILES_IDENTIFIER, area): None
+                                          for area in cache.PRICE_AREAS})
+    test_client = app.test_client()
+
+    response = test_client.get('/api/v1/history/greenest-window?area=DK2&days=90&period=3')
+    assert response.get_json()['days'] == 7
+    assert response.get_json()['improvement'] == '0 %'
+    assert 'ETag' in response.headers
+    # Answers are read from the rollups per request, rather than kept for every combination of parameters.
+    archive.write(MEASURED, times.values, np.full(len(times), 200, dtype='f4'))
+    history.update('DK2')
+    assert test_client.get('/api/v1/history/greenest-window?days=90').get_json()['mean-intensity'] == 200
+    assert not any(cache.local_cache[cache._in_area(cache.QUINTILES_IDENTIFIER, 'DK2')].derived)
+    assert test_client.get('/api/v1/history/profile?area=DK1').get_json()['success'] is False
+    assert test_client.get('/api/v1/history/daily?days=0').get_json()['success'] is False
+    assert test_client.get('/api/v1/history/hourly?days=90').get_json()['success'] is False
+    assert test_client.get('/api/v1/history/daily?period=7').get_json()['success'] is False
@@ -0,0 +1,55 @@
+import subprocess
+import sys
+import textwrap
+
+# Importing the app used to take 1.3 s and 150 MB of memory per worker, since it pulled in everything needed to build
+# data. Only the refresher, and requests for plots, need the heavy dependencies below, so workers should start without
+# them, well within these budgets.
+IMPORT_TIME_BUDGET = 1.0
+IMPORT_MEMORY_BUDGET = 80 * 1024 * 1024
+HEAVY_MODULES = ['altair', 'pandas', 'pyarrow', 'pywebpush', 'aiohttp']
+
+
+def _run(code):
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(code)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return eval(result.stdout)
+
+
+def test_app_imports_within_budget() -> None:
+    loaded, duration, memory = _run(f'''
+        import sys, time
+        start = time.perf_counter()
+        import app.app
+        duration = time.perf_counter() - start
+        # The peak as of the import. Unlike ru_maxrss, it does not carry over the peak of pytest, which started us.
+        with open('/proc/self/status') as f:
+            memory = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+        print(([name for name in {HEAVY_MODULES!r} if name in sys.modules], duration, memory))
+    ''')
+    assert loaded == []
+    assert duration < IMPORT_TIME_BUDGET
+    assert memory < IMPORT_MEMORY_BUDGET
+
+
+def test_cached_responses_are_served_without_heavy_dependencies() -> None:
+    status, body, loaded = _run(f'''
+        import sys
+        import fakeredis
+        from cachelib import RedisCache
+        from app import cache
+        from app.app import app
+        from app.responses import render
+
+        cache.redis_client = fakeredis.FakeRedis()
+        cache.cache = RedisCache(cache.redis_client)
+        cache._set(cache.EMISSION_INTENSITY, {{cache._in_area(cache.EMISSION_INTENSITY_MODEL_IDENTIFIER, area):
+                                               render({{'success': True}}) for area in cache.PRICE_AREAS}})
+        cache.local_cache.clear()
+        response = app.test_client().get('/api/v2/current-emission-intensity?area=DK1')
+        print((response.status_code, response.get_json(),
+               [name for name in {HEAVY_MODULES!r} if name in sys.modules]))
+    ''')
+    assert status == 200
+    assert body == {'success': True}
+    assert loaded == []
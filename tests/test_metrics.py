@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from app import metrics, model
+from app.app import app
+from app.areas import GENERATION_MIX_AREAS
+
+
+@pytest.fixture
+def fake_cache(fake_cache):
+    # Forget whatever other tests counted.
+    metrics.registry.pending.clear()
+    return fake_cache
+
+
+def _samples(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_histograms_are_exported_cumulatively(fake_cache) -> None:
+    for value in [0.0005, 0.003, 0.003, 100]:
+        metrics.STAGE_DURATION.observe(value, stage='test')
+    samples = _samples(metrics.export())
+    assert samples['gsweb_stage_duration_seconds_bucket{stage="test",le="0.001"}'] == '1.0'
+    assert samples['gsweb_stage_duration_seconds_bucket{stage="test",le="0.0025"}'] == '1.0'
+    assert samples['gsweb_stage_duration_seconds_bucket{stage="test",le="0.005"}'] == '3.0'
+    assert samples['gsweb_stage_duration_seconds_bucket{stage="test",le="60"}'] == '3.0'
+    assert samples['gsweb_stage_duration_seconds_bucket{stage="test",le="+Inf"}'] == '4.0'
+    assert samples['gsweb_stage_duration_seconds_count{stage="test"}'] == '4.0'
+    assert float(samples['gsweb_stage_duration_seconds_sum{stage="test"}']) == pytest.approx(100.0065)
+
+
+def test_counts_of_all_processes_are_added_up(fake_cache) -> None:
+    # Another process flushed its counts to Redis earlier.
+    metrics.LOCK_WAIT_TIMEOUTS.inc(dataset='test')
+    metrics.registry.flush()
+    metrics.LOCK_WAIT_TIMEOUTS.inc(2, dataset='test')
+    assert _samples(metrics.export())['gsweb_lock_wait_timeouts_total{dataset="test"}'] == '3.0'
+
+
+def test_requests_and_cache_lookups_are_counted(fake_cache, monkeypatch) -> None:
+    monkeypatch.setattr(model, 'build_current_generation_mix',
+                        lambda: ({area: {'success': True} for area in GENERATION_MIX_AREAS}, None))
+    client = app.test_client()
+    for _ in range(3):
+        client.get('/api/v2/current-generation-mix')
+    samples = _samples(client.get('/metrics').data.decode())
+    assert samples['gsweb_request_duration_seconds_count{route="/api/v2/current-generation-mix"}'] == '3.0'
+    assert samples['gsweb_cache_lookups_total{dataset="generation-mix",result="miss"}'] == '1.0'
+    assert samples['gsweb_cache_lookups_total{dataset="generation-mix",result="local"}'] == '2.0'
+    assert samples['gsweb_stage_duration_seconds_count{stage="cache-write"}'] == '1.0'
+
+
+def test_counting_is_cheap(fake_cache) -> None:
+    start = time.perf_counter()
+    for _ in range(10000):
+        metrics.CACHE_LOOKUPS.inc(dataset='test', result='local')
+    # Counting happens on every request, so it must take no more than a few microseconds.
+    assert (time.perf_counter() - start) / 10000 < 50e-6
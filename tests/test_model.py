@@ -0,0 +1,100 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.data import EmissionData
+from app.model import build_model
+from app.windows import ForecastWindows, best_period, overview_next_day
+
+CHARTS_DIRECTORY = os.path.join(os.path.dirname(__file__), '..', 'app', 'static', 'charts')
+
+
+@pytest.fixture(scope="module")
+def df_forecast():
+    times = pd.date_range('2021-06-01 10:00', periods=30 * 12, freq='5min')
+    rng = np.random.default_rng(42)
+    values = np.round(150 + 80 * np.sin(np.arange(len(times)) / 50) + rng.normal(0, 10, len(times)))
+    return pd.DataFrame({'Minutes5UTC': times,
+                         'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                         'CO2Emission': values,
+                         'Type': 'Prognose'})
+
+
+def rolling_extreme(df_forecast, period, horizon, idxmax):
+    """Finds the greenest/blackest window through a pandas rolling mean, for reference."""
+    df = df_forecast[df_forecast.Minutes5UTC < df_forecast.Minutes5UTC.min() + pd.Timedelta(f'{horizon}H')]
+    min_periods = period * 12
+    rolling = df.set_index('Minutes5DK').CO2Emission.rolling(f'{period}H', min_periods=min_periods).mean()
+    rolling = rolling[min_periods-1:]
+    extreme = rolling.idxmax() if idxmax else rolling.idxmin()
+    start = extreme - pd.Timedelta(f'{period}H') + pd.Timedelta('5m')
+    end = extreme + pd.Timedelta('5m')
+    return rolling.loc[extreme], start.strftime('%H:%M'), end.strftime('%H:%M')
+
+
+def test_windows_match_rolling_means(df_forecast: pd.DataFrame) -> None:
+    windows = ForecastWindows.build(df_forecast)
+    for period in range(1, 7):
+        for horizon in range(6, 73):
+            greenest = windows.greenest_window(period, horizon)
+            blackest = windows.blackest_window(period, horizon)
+            for window, idxmax in [(greenest, False), (blackest, True)]:
+                mean, start, end = rolling_extreme(df_forecast, period, horizon, idxmax)
+                assert window.mean == pytest.approx(mean)
+                assert (window.start, window.end) == (start, end)
+
+
+def test_best_period_rejects_periods_longer_than_forecast(df_forecast: pd.DataFrame) -> None:
+    windows = ForecastWindows.build(df_forecast.iloc[:30])
+    assert not best_period(windows, 3, 24)['success']
+    assert best_period(windows, 2, 24)['success']
+
+
+def test_overview_next_day_marks_windows_starting_tomorrow(df_forecast: pd.DataFrame) -> None:
+    overview = overview_next_day(ForecastWindows.build(df_forecast))
+    assert overview['title'].startswith('De næste 24 timer')
+    assert overview['message'].count('i morgen') >= 1
+
+
+def _placeholders(template):
+    """Finds the names of all values of the form "$name" in a chart template, which static/js/main.js fills in."""
+    if isinstance(template, str):
+        return {template[1:]} if template.startswith('$') else set()
+    if isinstance(template, list):
+        return set().union(*map(_placeholders, template))
+    if isinstance(template, dict):
+        return set().union(*map(_placeholders, template.values()))
+    return set()
+
+
+@pytest.mark.parametrize('name, placeholders', [
+    ('emission-intensity', {'intensities', 'now', 'bands', 'domain', 'selection'}),
+    ('generation-mix', {'mix', 'dataTime'}),
+])
+def test_chart_templates_have_the_placeholders_filled_in(name, placeholders) -> None:
+    with open(os.path.join(CHARTS_DIRECTORY, f'{name}.json')) as f:
+        assert _placeholders(json.load(f)) == placeholders
+
+
+def test_model_has_what_the_chart_needs(df_forecast: pd.DataFrame) -> None:
+    times = pd.date_range('2021-05-30 10:00', periods=2 * 288, freq='5min')
+    df_history = pd.DataFrame({'Minutes5UTC': times,
+                               'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                               'CO2Emission': np.arange(len(times)) % 300 + 50.0,
+                               'Type': 'Målt'})
+    model, _ = build_model(EmissionData(df_history, df_forecast), quintiles=[100, 150, 200, 250])
+    # Everything must be plain JSON, as it is rendered as is.
+    model = json.loads(json.dumps(model))
+
+    assert len(model['times']) == len(model['intensities']) == len(df_history) + len(df_forecast)
+    assert all(type(time) is int for time in model['times'])
+    assert all(type(intensity) is int for intensity in model['intensities'])
+    assert model['times'][0] == times[0].value // 1000000
+    assert model['forecast-start'] == len(df_history)
+    assert model['now'] == times[-1].value // 1000000
+    assert model['selection'] == [model['now'] - 12 * 3600 * 1000, model['now'] + 12 * 3600 * 1000]
+    assert model['plot-height'] == max(250, max(model['intensities']) + 25)
+    assert model['quintiles'] == [0, 100, 150, 200, 250, 1000]
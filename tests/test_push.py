@@ -0,0 +1,56 @@
+import base64
+import json
+import os
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from py_vapid import Vapid02
+
+from app import push, subscriptions
+
+
+@pytest.fixture
+def push_service(stub_server):
+    """Stands in for a push service, accepting notifications for every endpoint except those under /gone/."""
+    return stub_server(lambda path, body: (410 if path.startswith('/gone/') else 201, b''))
+
+
+def _subscription(endpoint):
+    key = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return json.dumps({'endpoint': endpoint,
+                       'keys': {'p256dh': base64.urlsafe_b64encode(key).decode().rstrip('='),
+                                'auth': base64.urlsafe_b64encode(os.urandom(16)).decode().rstrip('=')}})
+
+
+def _stored_subscriptions():
+    return [data for chunk in subscriptions.chunks() for _, data in chunk]
+
+
+def test_send_notifications_removes_gone_subscriptions(push_service, database) -> None:
+    subscriptions = [_subscription(f'{push_service.url}/{path}/{i}') for i in range(20) for path in ('live', 'gone')]
+    for subscription in subscriptions:
+        push.save_subscription(subscription)
+    vapid = Vapid02()
+    vapid.generate_keys()
+
+    stats = push.send_notifications(b'{"title":"Test","message":"Test"}', vapid, 'mailto:test@example.com')
+
+    assert (stats.sent, stats.failed, stats.removed) == (20, 0, 20)
+    assert sorted(_stored_subscriptions()) == sorted(s for s in subscriptions if '/live/' in s)
+    assert len(push_service.requests) == 40
+    # All requests carry the same signature, since they all go to the same push service.
+    assert len({headers['authorization'] for _, headers, _ in push_service.requests}) == 1
+    assert all(headers['content-encoding'] == 'aes128gcm' for _, headers, _ in push_service.requests)
+
+
+def test_send_notifications_counts_unreachable_services_as_failed(database) -> None:
+    push.save_subscription(_subscription('http://127.0.0.1:9/unreachable'))
+    vapid = Vapid02()
+    vapid.generate_keys()
+
+    stats = push.send_notifications(b'{}', vapid, 'mailto:test@example.com')
+
+    assert (stats.sent, stats.failed, stats.removed) == (0, 1, 0)
+    assert len(_stored_subscriptions()) == 1
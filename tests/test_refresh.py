@@ -0,0 +1,19 @@
+import time
+
+from app.refresh import RETRY_INTERVAL, RefreshJob
+
+
+def test_refresh_job_schedules_next_run_after_interval() -> None:
+    calls = []
+    job = RefreshJob('test', lambda: calls.append(1), interval=100)
+    job.run()
+    assert calls == [1]
+    assert job.next_run > time.time() + 90
+
+
+def test_refresh_job_retries_soon_after_failure() -> None:
+    def fail():
+        raise RuntimeError('Energinet is down')
+    job = RefreshJob('test', fail, interval=1000)
+    job.run()
+    assert job.next_run <= time.time() + RETRY_INTERVAL
@@ -0,0 +1,45 @@
+import gzip
+import json
+import time
+
+from app import app
+from app.responses import render, serve
+
+
+def test_rendered_response_is_compressed_json() -> None:
+    rendered = render({'success': True, 'current-intensity': 123})
+    assert json.loads(rendered.body) == {'success': True, 'current-intensity': 123}
+    assert gzip.decompress(rendered.gzip) == rendered.body
+
+
+def test_response_is_cacheable_until_stale() -> None:
+    rendered = render({'success': True})
+    with app.test_request_context():
+        response = serve(rendered, time.time() + 100)
+    assert response.status_code == 200
+    assert response.get_data() == rendered.body
+    assert 90 <= response.cache_control.max_age <= 100
+    with app.test_request_context():
+        response = serve(rendered, time.time() - 100)
+    assert response.cache_control.max_age == 0
+
+
+def test_response_is_compressed_if_accepted() -> None:
+    rendered = render({'success': True})
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = serve(rendered, time.time())
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == rendered.body
+
+
+def test_matching_etag_gives_not_modified() -> None:
+    rendered = render({'success': True})
+    with app.test_request_context():
+        etag = serve(rendered, time.time()).headers['ETag']
+    with app.test_request_context(headers={'If-None-Match': etag}):
+        response = serve(rendered, time.time())
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    with app.test_request_context(headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'}):
+        response = serve(rendered, time.time())
+    assert response.status_code == 200
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import cache, scheduling
+from app.app import app
+from app.windows import ForecastWindows
+
+START = np.datetime64('2021-06-01T10:00', 'm')
+
+
+@pytest.fixture(scope="module")
+def windows():
+    times = pd.date_range('2021-06-01 10:00', periods=30 * 12, freq='5min')
+    rng = np.random.default_rng(42)
+    values = np.round(150 + 80 * np.sin(np.arange(len(times)) / 50) + rng.normal(0, 10, len(times)))
+    return ForecastWindows.build(pd.DataFrame({'Minutes5UTC': times,
+                                               'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                                               'CO2Emission': values,
+                                               'Type': 'Prognose'}))
+
+
+def _reference(windows, first, last, weights):
+    """Finds the best start by trying every one of them, for reference."""
+    values = np.diff(windows.prefix_sums)
+    costs = [np.dot(values[start:start + len(weights)], weights) for start in range(first, last + 1)]
+    best = int(np.argmin(np.round(costs, 9)))
+    return first + best, costs[best] / np.sum(weights), costs[0] / np.sum(weights)
+
+
+def test_jobs_are_scheduled_at_their_greenest_start(windows) -> None:
+    rng = np.random.default_rng(0)
+    jobs = []
+    for i in range(200):
+        length = int(rng.integers(1, 100))
+        first = int(rng.integers(0, 200))
+        last = int(rng.integers(first, 360 - length + 1))
+        job = {'id': f'job-{i}', 'duration': length * 5,
+               'earliest-start': f'{START + first * scheduling.STEP}Z',
+               'deadline': str(START + (last + length) * scheduling.STEP)}
+        if i % 2:
+            job['profile'] = rng.uniform(0, 11, length).round(1).tolist()
+        jobs.append((job, first, last))
+
+    result = scheduling.schedule(windows, scheduling.parse_jobs({'jobs': [job for job, _, _ in jobs]}))
+
+    assert result['success']
+    for (job, first, last), scheduled in zip(jobs, result['jobs']):
+        start, intensity, baseline = _reference(windows, first, last, job.get('profile', np.ones(job['duration'] // 5)))
+        assert scheduled['id'] == job['id']
+        assert scheduled['start'] == f'{START + start * scheduling.STEP}Z'
+        assert scheduled['end'] == f'{START + start * scheduling.STEP + np.timedelta64(job["duration"], "m")}Z'
+        assert scheduled['intensity'] == round(intensity)
+        assert scheduled['savings'] == round(baseline - intensity)
+        assert ('emissions' in scheduled) == ('profile' in job)
+
+
+def test_emissions_follow_from_the_profile(windows) -> None:
+    values = np.diff(windows.prefix_sums)
+    jobs = scheduling.parse_jobs({'jobs': [{'duration': 10, 'profile': [6, 12], 'earliest-start': str(START),
+                                            'deadline': str(START + 2 * scheduling.STEP)}]})
+    job, = scheduling.schedule(windows, jobs)['jobs']
+    # 6 kW for 5 minutes is 0.5 kWh, and 12 kW is 1 kWh.
+    assert job['emissions'] == round(0.5 * values[0] + 1 * values[1])
+    assert job['emissions-saved'] == 0
+
+
+def test_times_are_rounded_to_the_forecast_and_default_to_all_of_it(windows) -> None:
+    jobs = scheduling.parse_jobs({'jobs': [{'duration': 30 * 60}, {'duration': 30 * 60 + 5},
+                                           {'duration': 60, 'earliest-start': '2021-06-02T15:01Z'},
+                                           {'duration': 60, 'earliest-start': '2021-06-02T15:00Z'}]},
+                                 now='2021-06-01T09:00')
+    full, too_long, too_late, latest = scheduling.schedule(windows, jobs)['jobs']
+    assert full['start'] == '2021-06-01T10:00Z' and full['end'] == '2021-06-02T16:00Z'
+    assert too_long['success'] is False
+    assert too_late['success'] is False
+    assert latest['start'] == '2021-06-02T15:00Z'
+
+
+@pytest.mark.parametrize('body, error', [
+    (None, 'Body must be a JSON object with a list of jobs.'),
+    ({'jobs': []}, 'There must be between 1 and 1000 jobs.'),
+    ({'jobs': [{'duration': 7}]}, 'Duration of job 0 must be a positive number of minutes divisible by 5.'),
+    ({'jobs': [{'duration': 10, 'profile': [1]}]},
+     'Profile of job 0 must be a list with the power draw for each 5 minutes of the job.'),
+    ({'jobs': [{'duration': 10, 'profile': [0, 0]}]}, 'Profile of job 0 must be non-negative, and not all zero.'),
+    ({'jobs': [{'duration': 10, 'deadline': 'tomorrow'}]},
+     'Times of job 0 must be given as ISO 8601, e.g. 2021-06-01T14:30Z.'),
+    ({'jobs': [{'duration': 10 ** 30}]}, 'Duration of job 0 must be at most 10080 minutes.'),
+    ({'jobs': [{'duration': 10, 'earliest-start': 2 ** 70}]},
+     'Times of job 0 must be given as ISO 8601, e.g. 2021-06-01T14:30Z.'),
+    ({'jobs': [{'duration': 10, 'earliest-start': True}]},
+     'Times of job 0 must be given as ISO 8601, e.g. 2021-06-01T14:30Z.'),
+    ({'jobs': [{'duration': 10, 'deadline': '9' * 30}]},
+     'Times of job 0 must be between 2000-01-01T00:00Z and 2100-01-01T00:00Z.'),
+    ({'jobs': [{'duration': 10, 'deadline': 'NaT'}]},
+     'Times of job 0 must be between 2000-01-01T00:00Z and 2100-01-01T00:00Z.'),
+    ({'jobs': [{'duration': 10, 'profile': [1e308, 1e308]}]}, 'Profile of job 0 must not draw more than 1000000 kW.'),
+])
+def test_invalid_jobs_are_rejected(body, error) -> None:
+    with pytest.raises(ValueError, match=error):
+        scheduling.parse_jobs(body)
+
+
+def test_jobs_are_scheduled_against_the_cached_forecast(windows, fake_cache) -> None:
+    cache._set(cache.EMISSION_INTENSITY, {cache._in_area(cache.FORECAST_WINDOWS_IDENTIFIER, 'DK1'): windows})
+    test_client = app.test_client()
+
+    job = {'id': 'car', 'duration': 120, 'earliest-start': '2021-06-01T10:00Z'}
+    response = test_client.post('/api/v1/schedule?area=DK1', json={'jobs': [job] * 500})
+    expected, = scheduling.schedule(windows, scheduling.parse_jobs({'jobs': [job]}))['jobs']
+    assert response.get_json()['jobs'] == [expected] * 500
+    response = test_client.post('/api/v1/schedule', data='not json')
+    assert response.get_json() == {'success': False, 'error': 'Body must be a JSON object with a list of jobs.'}
@@ -0,0 +1,83 @@
+import json
+import time
+from urllib.parse import parse_qs
+
+import pytest
+
+from app import cache, slack, subscriptions
+from app.app import app
+from app.responses import render
+
+
+@pytest.fixture
+def slack_service(stub_server, monkeypatch):
+    """Stands in for Slack, exchanging any code for a token, and accepting posts to every webhook except those under
+    /gone/."""
+    def respond(path, body):
+        if path == '/api/oauth.v2.access':
+            team = parse_qs(body.decode())['code'][0]
+            return 200, json.dumps({'ok': True, 'access_token': f'xoxb-{team}', 'team': {'id': team},
+                                    'incoming_webhook': {'url': f'{server.url}/hooks/{team}'}}).encode()
+        return 404 if path.startswith('/gone/') else 200, b'ok'
+
+    server = stub_server(respond)
+    monkeypatch.setattr(slack, 'SLACK_API', f'{server.url}/api')
+    monkeypatch.setattr(slack, 'RESPONSE_URL_PREFIX', server.url)
+    monkeypatch.setenv('SLACK_CLIENT_ID', 'client')
+    monkeypatch.setenv('SLACK_CLIENT_SECRET', 'secret')
+    return server
+
+
+def _answers(area):
+    return {cache._in_area(cache.SLACK_IDENTIFIER, area): render({'response_type': 'in_channel', 'text': area})
+            for area in cache.PRICE_AREAS}
+
+
+def test_commands_are_answered_from_the_cache(fake_cache, slack_service) -> None:
+    cache._set(cache.EMISSION_INTENSITY, _answers('DK1'))
+    response = app.test_client().post('/api/v1/slack', data={'text': 'dk1', 'response_url': f'{slack_service.url}/r'})
+    assert response.get_json() == {'response_type': 'in_channel', 'text': 'DK1'}
+    assert slack_service.requests == []
+
+
+def test_commands_are_acknowledged_at_once_and_answered_later_when_not_cached(fake_cache, slack_service,
+                                                                              monkeypatch) -> None:
+    def update():
+        time.sleep(0.2)
+        return cache._set(cache.EMISSION_INTENSITY, _answers('DK2'))
+
+    monkeypatch.setattr(cache, '_update_data', update)
+    start = time.time()
+    response = app.test_client().post('/api/v1/slack', data={'text': '', 'response_url': f'{slack_service.url}/r'})
+    assert time.time() - start < 0.2
+    assert response.get_json() == slack.ACKNOWLEDGEMENT
+    deadline = time.time() + 5
+    while not slack_service.requests and time.time() < deadline:
+        time.sleep(0.01)
+    (path, _, body), = slack_service.requests
+    assert path == '/r' and json.loads(body) == {'response_type': 'in_channel', 'text': 'DK2'}
+
+
+def test_answers_are_only_posted_to_slack(fake_cache, slack_service, monkeypatch) -> None:
+    monkeypatch.setattr(slack, '_responders', None)
+    response = app.test_client().post('/api/v1/slack', data={'response_url': 'http://example.com/'})
+    assert response.get_json() == slack.ACKNOWLEDGEMENT
+
+
+def test_installations_are_stored_and_sent_the_daily_digest(fake_cache, slack_service, database) -> None:
+    client = app.test_client()
+    for team in ['T1', 'T2', 'T3']:
+        assert client.get(f'/api/v1/slack-authorize?code={team}').data.startswith(b'App added!')
+    # Whoever installed the app in the third workspace has since removed it.
+    installation = json.loads(dict(subscriptions.slack_installations())['T3'])
+    installation['incoming_webhook']['url'] = f'{slack_service.url}/gone/T3'
+    subscriptions.save_slack_installation('T3', json.dumps(installation))
+    cache._set(cache.EMISSION_INTENSITY, _answers('DK2'))
+    slack_service.requests.clear()
+
+    stats = slack.send_daily_digest()
+
+    assert (stats.sent, stats.failed, stats.removed) == (2, 0, 1)
+    assert sorted(path for path, _, _ in slack_service.requests) == ['/gone/T3', '/hooks/T1', '/hooks/T2']
+    assert [team for team, _ in subscriptions.slack_installations()] == ['T1', 'T2']
+    assert json.loads(dict(subscriptions.slack_installations())['T1'])['access_token'] == 'xoxb-T1'
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import cache, snapshot
+from app.app import app
+from app.data import EMISSION_TYPES, EmissionData
+
+
+@pytest.fixture
+def emission_data():
+    times = pd.date_range('2021-03-27 22:00', periods=48 * 12, freq='5min')
+    df = pd.DataFrame({'Minutes5UTC': times,
+                       'Minutes5DK': times.tz_localize('UTC').tz_convert('Europe/Copenhagen'),
+                       'CO2Emission': np.round(150 + 80 * np.sin(np.arange(len(times)) / 50)),
+                       'Type': pd.Categorical(['Målt'] * 300 + ['Prognose'] * 276, categories=EMISSION_TYPES)})
+    return EmissionData(df.iloc[:300].reset_index(drop=True),
+                        df.iloc[299:].assign(Type=pd.Categorical(['Prognose'] * 277, categories=EMISSION_TYPES))
+                        .reset_index(drop=True))
+
+
+@pytest.fixture
+def snapshot_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIRECTORY', str(tmp_path / 'snapshots'))
+    return tmp_path / 'snapshots'
+
+
+def test_snapshots_round_trip(emission_data) -> None:
+    buffer = snapshot.pack(emission_data)
+    assert len(buffer) == 16 + 6 * 577
+    data = snapshot.unpack(buffer).emission_data()
+    pd.testing.assert_frame_equal(data.df_history, emission_data.df_history)
+    pd.testing.assert_frame_equal(data.df_forecast, emission_data.df_forecast)
+
+
+def test_unknown_format_version_is_rejected(emission_data, monkeypatch) -> None:
+    buffer = snapshot.pack(emission_data)
+    monkeypatch.setattr(snapshot, 'FORMAT_VERSION', snapshot.FORMAT_VERSION + 1)
+    with pytest.raises(ValueError):
+        snapshot.unpack(buffer)
+
+
+def test_workers_share_a_single_file(emission_data, snapshot_directory) -> None:
+    buffer = snapshot.pack(emission_data)
+    first, second = snapshot.share('dk1', buffer), snapshot.share('dk1', buffer)
+    assert os.listdir(snapshot_directory) == [f'dk1-{snapshot._digest(buffer)}']
+    assert not first.intensities.flags.writeable
+    np.testing.assert_array_equal(first.times, second.times)
+
+    # A new snapshot replaces the earlier one, which those still mapping it can keep reading.
+    emission_data.df_forecast.loc[1:, 'CO2Emission'] += 1
+    newer = snapshot.share('dk1', snapshot.pack(emission_data))
+    assert len(os.listdir(snapshot_directory)) == 1
+    assert newer.intensities[-1] == first.intensities[-1] + 1
+    # Should the file of the current snapshot go missing, the next worker to need it writes it again.
+    os.remove(snapshot_directory / os.listdir(snapshot_directory)[0])
+    np.testing.assert_array_equal(snapshot.share('dk1', snapshot.pack(emission_data)).intensities, newer.intensities)
+
+
+def test_plots_are_built_from_the_shared_snapshot(emission_data, snapshot_directory, fake_cache) -> None:
+    values = {cache._in_area(cache.SNAPSHOT_IDENTIFIER, 'DK1'): snapshot.pack(emission_data),
+              cache._in_area(cache.QUINTILES_IDENTIFIER, 'DK1'): None}
+    cache._set(cache.EMISSION_INTENSITY, values)
+
+    response = app.test_client().get('/api/v1/current-emission-intensity?area=DK1')
+    assert response.get_json()['current-intensity'] == int(emission_data.df_forecast.CO2Emission[0])
+    assert 'plot-data' in response.get_json()
+    assert cache.get_snapshot('DK1').forecast_start == 300
+    assert len(os.listdir(snapshot_directory)) == 1
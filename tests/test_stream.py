@@ -0,0 +1,86 @@
+import json
+import time
+
+import pytest
+
+from app import cache, stream
+from app.app import app
+from app.responses import render
+
+
+@pytest.fixture
+def fake_cache(fake_cache, monkeypatch):
+    monkeypatch.setattr(stream, 'broadcaster', stream.Broadcaster())
+    monkeypatch.setattr(stream, 'HEARTBEAT_INTERVAL', 0.1)
+    return fake_cache
+
+
+def _wait_for_subscription(client):
+    deadline = time.time() + 5
+    while dict(client.pubsub_numsub(cache.VERSIONS_CHANNEL)).get(cache.VERSIONS_CHANNEL.encode(), 0) == 0:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def _data(event):
+    assert event.startswith('data: ') and event.endswith('\n\n')
+    return json.loads(event[len('data: '):])
+
+
+def test_clients_get_current_versions_and_then_new_ones(fake_cache) -> None:
+    entries = cache._set(cache.GENERATION_MIX, {'item': render({})})
+    events = stream.events()
+    first = _data(next(events))
+    assert first == {'dataset': 'generation-mix', 'version': entries['item'][2]}
+
+    _wait_for_subscription(fake_cache)
+    entries = cache._set(cache.EMISSION_INTENSITY, {'item': render({})})
+    event = next(events)
+    while event.startswith(':'):
+        event = next(events)
+    assert _data(event) == {'dataset': 'emission-intensity', 'version': entries['item'][2]}
+    events.close()
+    assert not stream.broadcaster.clients
+
+
+def test_idle_clients_get_heartbeats(fake_cache) -> None:
+    events = stream.events()
+    assert next(events) == ': heartbeat\n\n'
+    events.close()
+
+
+def test_lost_connections_are_closed_before_reconnecting(fake_cache, monkeypatch, capsys) -> None:
+    monkeypatch.setattr(stream, 'RECONNECT_INTERVAL', 0.01)
+    subscriptions, pubsub = [], fake_cache.pubsub
+
+    def failing_pubsub(**kwargs):
+        subscriptions.append(pubsub(**kwargs))
+        if len(subscriptions) == 1:
+            def listen():
+                raise ConnectionError('Connection lost')
+            subscriptions[0].listen = listen
+        return subscriptions[-1]
+
+    monkeypatch.setattr(fake_cache, 'pubsub', failing_pubsub)
+    stream.broadcaster.connect()
+    deadline = time.time() + 5
+    while len(subscriptions) < 2:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    _wait_for_subscription(fake_cache)
+    assert subscriptions[0].connection is None and subscriptions[1].connection is not None
+    assert 'Connection lost' in capsys.readouterr().err
+
+
+def test_threaded_workers_do_not_serve_the_stream(fake_cache) -> None:
+    response = app.test_client().get('/api/v1/stream')
+    assert response.status_code == 204 and not response.data
+    assert not stream.broadcaster.clients
+
+
+def test_gevent_workers_serve_the_stream(fake_cache, monkeypatch) -> None:
+    monkeypatch.setattr(stream, 'can_hold_connections', lambda: True)
+    response = app.test_client().get('/api/v1/stream')
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    assert next(response.response) == b': heartbeat\n\n'
+    response.close()
@@ -0,0 +1,62 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from app import subscriptions
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, 'subs.db')
+    monkeypatch.setattr(subscriptions, 'DB_PATH', path)
+    monkeypatch.setattr(subscriptions, '_connection', None)
+    return path
+
+
+def _subscription(endpoint, auth='auth'):
+    return json.dumps({'endpoint': endpoint, 'keys': {'p256dh': 'key', 'auth': auth}})
+
+
+def test_saving_same_endpoint_replaces_subscription(database) -> None:
+    subscriptions.save(_subscription('https://push.example.com/1', auth='old'))
+    subscriptions.save(_subscription('https://push.example.com/1', auth='new'))
+    subscriptions.save(_subscription('https://push.example.com/2'))
+    stored = [data for chunk in subscriptions.chunks() for _, data in chunk]
+    assert stored == [_subscription('https://push.example.com/1', auth='new'),
+                      _subscription('https://push.example.com/2')]
+
+
+def test_remove_matches_on_endpoint(database) -> None:
+    subscriptions.save(_subscription('https://push.example.com/1', auth='old'))
+    subscriptions.remove(_subscription('https://push.example.com/1', auth='new'))
+    assert subscriptions.count() == 0
+
+
+def test_chunks_cover_all_subscriptions_while_removing(database) -> None:
+    for i in range(25):
+        subscriptions.save(_subscription(f'https://push.example.com/{i}'))
+    seen = []
+    for chunk in subscriptions.chunks(chunk_size=10):
+        assert len(chunk) <= 10
+        seen.extend(data for _, data in chunk)
+        subscriptions.remove_ids(subscription_id for subscription_id, _ in chunk)
+    assert len(set(seen)) == 25
+    assert subscriptions.count() == 0
+
+
+def test_legacy_database_is_migrated_without_duplicates(database) -> None:
+    connection = sqlite3.connect(database)
+    connection.execute('CREATE TABLE subs (sub text)')
+    legacy = [_subscription('https://push.example.com/1', auth='old'), _subscription('https://push.example.com/2'),
+              _subscription('https://push.example.com/1', auth='new'), 'not a subscription']
+    connection.executemany('INSERT INTO subs (sub) VALUES (?)', [(data,) for data in legacy])
+    connection.commit()
+    connection.close()
+
+    stored = sorted(data for chunk in subscriptions.chunks() for _, data in chunk)
+    assert stored == sorted([_subscription('https://push.example.com/1', auth='new'),
+                             _subscription('https://push.example.com/2')])
+    version = subscriptions._connect().execute('PRAGMA user_version').fetchone()[0]
+    assert version == len(subscriptions.MIGRATIONS)